@@ -0,0 +1,166 @@
+"""
+Compare the development launch path with the production server under load
+
+Run from the backend directory:
+
+    python benchmarks/bench_server.py [--modes main,serve] [--duration 20] [--clients 4] [--connections 32]
+
+Each mode is started as a subprocess on a free port: ``main`` is
+``python main.py`` (one uvicorn process) and ``serve`` is ``python
+serve.py`` (gunicorn with uvicorn workers; set ``PRELOAD_APP`` to
+compare preloading). ``--clients``
+processes then keep ``--connections`` keep-alive connections each busy
+with a mix of endpoints that need no TomTom access, and the run reports
+throughput, latency percentiles, errors and the servers' combined
+proportional memory (PSS, Linux only). Leave cores free for the clients
+(``WEB_CONCURRENCY``) or the load generator becomes the bottleneck.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    "main": [sys.executable, "main.py"],
+    "serve": [sys.executable, "serve.py"]
+}
+
+# Served from process memory: static data, running aggregates and cached graph searches
+URLS = [
+    "/health",
+    "/api/traffic/cities",
+    "/api/traffic/highways",
+    "/api/traffic/overview",
+    "/api/traffic/route/options?from_city=lahore&to_city=peshawar"
+]
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _descendants(pid: int) -> List[int]:
+    pids = [pid]
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children") as f:
+            for child in f.read().split():
+                pids.extend(_descendants(int(child)))
+    return pids
+
+def server_pss_mb(pid: int) -> Optional[float]:
+    """Proportional set size of a process tree; shared pages count once in total"""
+    try:
+        total_kb = 0
+        for process in _descendants(pid):
+            with open(f"/proc/{process}/smaps_rollup") as f:
+                total_kb += next(int(line.split()[1]) for line in f if line.startswith("Pss:"))
+        return total_kb / 1024
+    except (OSError, StopIteration):
+        return None
+
+async def _load(base_url: str, connections: int, duration: float) -> Dict[str, list]:
+    latencies: List[float] = []
+    errors: List[str] = []
+    deadline = time.perf_counter() + duration
+
+    async def worker(client: httpx.AsyncClient, offset: int):
+        index = offset
+        while time.perf_counter() < deadline:
+            url = URLS[index % len(URLS)]
+            index += 1
+            started = time.perf_counter()
+            try:
+                response = await client.get(url)
+                if response.status_code != 200:
+                    errors.append(str(response.status_code))
+            except httpx.HTTPError as e:
+                errors.append(type(e).__name__)
+            latencies.append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(base_url=base_url, timeout=30.0, limits=limits) as client:
+        await asyncio.gather(*(worker(client, offset) for offset in range(connections)))
+    return {"latencies": latencies, "errors": errors}
+
+def _client_process(args):
+    return asyncio.run(_load(*args))
+
+def run_mode(mode: str, duration: float, clients: int, connections: int) -> Dict[str, float]:
+    port = _free_port()
+    env = dict(os.environ, PORT=str(port), HOST="127.0.0.1", ENVIRONMENT="benchmark")
+    env.setdefault("TOMTOM_API_KEY", "benchmark")
+    env.setdefault("CACHE_BACKEND", "memory")
+    server = subprocess.Popen(COMMANDS[mode], cwd=BACKEND, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                if httpx.get(f"{base_url}/health", timeout=1.0).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline or server.poll() is not None:
+                raise RuntimeError(f"{mode} server did not start")
+            time.sleep(0.2)
+        # Warm caches (route options, overview snapshot) in every worker before measuring
+        asyncio.run(_load(base_url, connections, 2.0))
+
+        with multiprocessing.Pool(clients) as pool:
+            started = time.perf_counter()
+            results = pool.map(_client_process, [(base_url, connections, duration)] * clients)
+            elapsed = time.perf_counter() - started
+        memory = server_pss_mb(server.pid)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=40)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    latencies = sorted(latency for result in results for latency in result["latencies"])
+    errors = sum(len(result["errors"]) for result in results)
+
+    def percentile(fraction: float) -> float:
+        return latencies[min(int(fraction * len(latencies)), len(latencies) - 1)] * 1000
+
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50": percentile(0.5),
+        "p99": percentile(0.99),
+        "errors": errors,
+        "pss_mb": memory
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", default="main,serve", help="comma-separated launch paths to compare (main, serve)")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load per mode")
+    parser.add_argument("--clients", type=int, default=4, help="load generator processes")
+    parser.add_argument("--connections", type=int, default=32, help="concurrent connections per client process")
+    args = parser.parse_args()
+
+    print(f"{args.clients} clients x {args.connections} connections for {args.duration:g}s, {os.cpu_count()} cores")
+    print(f"{'mode':<8}{'requests':>10}{'req/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}{'PSS MB':>9}")
+    for mode in args.modes.split(","):
+        result = run_mode(mode, args.duration, args.clients, args.connections)
+        memory = f"{result['pss_mb']:.0f}" if result["pss_mb"] is not None else "n/a"
+        print(
+            f"{mode:<8}{result['requests']:>10}{result['rps']:>10.0f}{result['p50']:>9.1f}"
+            f"{result['p99']:>9.1f}{result['errors']:>8}{memory:>9}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Micro-benchmarks for the static city and highway data paths of TrafficService
+
+Run from the backend directory:
+
+    python benchmarks/bench_static_data.py [--number N]
+
+No network access is needed; the shared cache is forced to the in-memory
+backend and one highway gets a synthetic corridor snapshot so the live
+overlay path is measured too.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TOMTOM_API_KEY", "benchmark")
+os.environ["CACHE_BACKEND"] = "memory"
+
+from fastapi.encoders import jsonable_encoder
+
+from services.tomtom_service import tomtom_service
+from services.traffic_service import traffic_service
+
+def _snapshot(route_code: str):
+    segments = [
+        {
+            "index": index, "lat": 33.0, "lon": 73.0, "from_km": index * 10.0, "to_km": index * 10.0 + 10.0,
+            "current_speed": 80, "free_flow_speed": 100, "speed_ratio": 0.8,
+            "traffic_level": "Moderate", "road_closure": False
+        }
+        for index in range(16)
+    ]
+    status = {
+        "traffic_level": "Moderate", "speed_ratio": 0.8, "coverage": 1.0, "congested_segments": 0,
+        "closed_segments": 0, "estimated_delay_minutes": 4.0, "worst_segment": 0
+    }
+    data = {"route_code": route_code, "updated_at": time.time(), "segments": segments, "status": status}
+    return {"fetched_at": time.time(), "result": {"success": True, "data": data}}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=5000, help="calls per timing run")
+    parser.add_argument("--repeat", type=int, default=5, help="timing runs; the best is reported")
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(tomtom_service.cache.set("corridor:M-2", _snapshot("M-2"), 3600))
+
+    cases = {
+        "get_cities_traffic_data": lambda: traffic_service.get_cities_traffic_data(),
+        "get_cities_traffic_data + encode": lambda: _encoded(traffic_service.get_cities_traffic_data()),
+        "get_route_suggestions (known pair)": lambda: traffic_service.get_route_suggestions("LAHORE", "islamabad"),
+        "get_route_suggestions (generic)": lambda: traffic_service.get_route_suggestions("Multan", "Peshawar"),
+        "get_route_suggestions (unknown)": lambda: traffic_service.get_route_suggestions("Quetta", "Lahore"),
+        "get_highway_data": lambda: traffic_service.get_highway_data(),
+        "get_highway_data + encode": lambda: _encoded(traffic_service.get_highway_data()),
+    }
+
+    print(f"{'case':<38} {'us/call':>10}")
+    for name, factory in cases.items():
+        best = min(loop.run_until_complete(_timed(factory, args.number)) for _ in range(args.repeat))
+        print(f"{name:<38} {best / args.number * 1e6:>10.2f}")
+    loop.close()
+
+async def _timed(factory, number: int) -> float:
+    # Awaited inside one running loop so event loop entry is not part of the figure
+    start = time.perf_counter()
+    for _ in range(number):
+        await factory()
+    return time.perf_counter() - start
+
+async def _encoded(coroutine):
+    return jsonable_encoder(await coroutine)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Replay a recorded traffic shape against a running backend
+
+Run from the backend directory, with the server started in replay mode
+(TOMTOM_CAPTURE_MODE=replay) on the archives captured in production:
+
+    python benchmarks/replay_load.py "/path/to/tomtom_capture-*.zip" [--speed 10] [--base-url URL]
+
+Every upstream call in the archives is mapped back to the backend
+request that causes it (flow and incidents to the city nearest the
+sampled point or box, routes, searches and tiles) and sent at its
+recorded offset divided by ``--speed``. Requests for the same URL within
+one second of each other are sent once, since one backend request can
+fan out into several upstream calls (e.g. incident tiles).
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+import zipfile
+from collections import Counter
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from services.city_registry import city_registry
+
+def _city(lat: float, lon: float) -> Optional[str]:
+    nearest = city_registry.nearest(lat, lon, max_distance_km=100)
+    return nearest[0]["name"].lower() if nearest else None
+
+def backend_url(meta: dict) -> Optional[str]:
+    """Backend request that leads to a recorded upstream call, or None if unknown"""
+    path = meta["path"]
+    query = dict(meta["query"])
+    parts = path.strip("/").split("/")
+    if "flowSegmentData" in parts:
+        lat, lon = (float(value) for value in query["point"].split(","))
+        city = _city(lat, lon)
+        return f"/api/traffic/flow/{city}" if city else None
+    if "incidentDetails" in parts:
+        min_lon, min_lat, max_lon, max_lat = (float(value) for value in parts[parts.index("s3") + 1].split(","))
+        city = _city((min_lat + max_lat) / 2, (min_lon + max_lon) / 2)
+        return f"/api/traffic/incidents/{city}" if city else None
+    if "calculateRoute" in parts:
+        origin, destination = parts[parts.index("calculateRoute") + 1].split(":")
+        return f"/api/traffic/route?origin={origin}&destination={destination}"
+    if parts[:3] == ["search", "2", "search"]:
+        city = _city(float(query["lat"]), float(query["lon"]))
+        term = parts[3].rsplit(".", 1)[0]
+        return f"/api/traffic/search?query={quote(term)}&city={city}" if city else None
+    if "tile" in parts:
+        layer, style, z, x, tail = parts[-5:]
+        return f"/api/traffic/tiles/{layer}/{z}/{x}/{tail}?style={style}"
+    return None
+
+def load_schedule(pattern: str) -> List[Tuple[float, str]]:
+    """(seconds from the first call, backend url) in recorded order"""
+    calls = []
+    for path in sorted(glob.glob(pattern)):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                meta = json.loads(info.comment)
+                url = backend_url(meta)
+                if url:
+                    calls.append((meta["at"], url))
+    calls.sort()
+    schedule = []
+    last_sent = {}
+    for at, url in calls:
+        if at - last_sent.get(url, -1e9) >= 1.0:
+            last_sent[url] = at
+            schedule.append((at - calls[0][0], url))
+    return schedule
+
+async def replay(schedule: List[Tuple[float, str]], base_url: str, speed: float):
+    latencies = []
+    statuses = Counter()
+
+    async def send(client: httpx.AsyncClient, url: str):
+        started = time.perf_counter()
+        try:
+            response = await client.get(url)
+            statuses[response.status_code] += 1
+        except httpx.HTTPError as e:
+            statuses[type(e).__name__] += 1
+        latencies.append(time.perf_counter() - started)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60.0) as client:
+        start = time.perf_counter()
+        tasks = []
+        for offset, url in schedule:
+            delay = offset / speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(client, url)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(fraction: float) -> float:
+        return latencies[min(int(fraction * len(latencies)), len(latencies) - 1)] * 1000
+
+    print(f"{len(schedule)} requests in {elapsed:.1f}s ({len(schedule) / elapsed:.1f} req/s)")
+    print(f"latency ms: p50 {percentile(0.5):.1f}  p95 {percentile(0.95):.1f}  p99 {percentile(0.99):.1f}  max {latencies[-1] * 1000:.1f}")
+    print("status:", dict(statuses))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("archives", help="capture archive path or glob pattern")
+    parser.add_argument("--speed", type=float, default=10.0, help="replay rate relative to the recording")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000", help="backend to send requests to")
+    args = parser.parse_args()
+
+    schedule = load_schedule(args.archives)
+    if not schedule:
+        sys.exit(f"No replayable calls found in {args.archives}")
+    span = schedule[-1][0]
+    print(f"Replaying {len(schedule)} requests recorded over {span:.0f}s at {args.speed:g}x")
+    asyncio.run(replay(schedule, args.base_url, args.speed))
+
+if __name__ == "__main__":
+    main()
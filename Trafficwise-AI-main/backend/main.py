@@ -1,6 +1,7 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
+import asyncio
 import logging
 import os
 from contextlib import asynccontextmanager
@@ -11,6 +12,17 @@ load_dotenv()
 
 # Import routes
 from routes.traffic import router as traffic_router
+from routes.chat import router as chat_router
+from routes.alerts import router as alerts_router
+from services.timing import ServerTimingMiddleware, profiler_from_env
+from services.tile_service import tile_service
+from services.tomtom_service import tomtom_service
+from services.traffic_service import traffic_service
+from services.city_registry import city_registry
+from services.refresh_scheduler import refresh_scheduler
+from services.geofence import geofence_alerts
+from services.heatmap_service import heatmap_service
+from services.overview_service import national_overview
 
 # Configure logging
 logging.basicConfig(
@@ -26,15 +38,35 @@ async def lifespan(app: FastAPI):
     logger.info(f"Environment: {os.getenv('ENVIRONMENT', 'development')}")
     
     # Verify TomTom API key
-    if not os.getenv("TOMTOM_API_KEY"):
+    if tomtom_service.capture.mode == "replay":
+        logger.info("📼 Replaying recorded TomTom responses")
+    elif not os.getenv("TOMTOM_API_KEY"):
         logger.warning("⚠️ TomTom API key not found in environment variables")
     else:
         logger.info("✅ TomTom API key configured")
     
+    # Background jobs, cancelled on shutdown
+    background_tasks = [
+        asyncio.create_task(geofence_alerts.watch_loop()),
+        asyncio.create_task(national_overview.sync_loop())
+    ]
+    if os.getenv("TILE_PREFETCH", "false").lower() == "true":
+        background_tasks.append(asyncio.create_task(tile_service.prefetch_loop()))
+    if os.getenv("CORRIDOR_MONITOR", "false").lower() == "true":
+        background_tasks.append(asyncio.create_task(traffic_service.corridors.refresh_loop()))
+    if os.getenv("CITY_REFRESH", "false").lower() == "true":
+        background_tasks.append(asyncio.create_task(refresh_scheduler.refresh_loop()))
+    if os.getenv("HEATMAP", "false").lower() == "true":
+        background_tasks.append(asyncio.create_task(heatmap_service.refresh_loop()))
+    
     yield
     
     # Shutdown
     logger.info("🛑 Shutting down TrafficWise AI Backend...")
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    tomtom_service.capture.flush()
 
 # Create FastAPI app
 app = FastAPI(
@@ -60,8 +92,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Added last so it wraps everything else and can time gzip as well
+if os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true":
+    app.add_middleware(ServerTimingMiddleware, profiler=profiler_from_env())
+
 # Include routers
 app.include_router(traffic_router)
+app.include_router(chat_router)
+app.include_router(alerts_router)
 
 @app.get("/")
 async def root():
@@ -76,7 +114,13 @@ async def root():
             "route_planning": "/api/traffic/route",
             "place_search": "/api/traffic/search",
             "dashboard": "/api/traffic/dashboard/{city}",
-            "supported_cities": "/api/traffic/cities"
+            "supported_cities": "/api/traffic/cities",
+            "map_tiles": "/api/traffic/tiles/{layer}/{z}/{x}/{y}.png",
+            "highways": "/api/traffic/highways",
+            "nearest_city": "/api/traffic/nearest",
+            "chat": "/api/chat",
+            "alerts": "/api/alerts/ws",
+            "heatmap": "/api/traffic/heatmap/{city}.png"
         }
     }
 
@@ -87,7 +131,7 @@ async def health_check():
         "status": "healthy",
         "environment": os.getenv("ENVIRONMENT", "development"),
         "tomtom_api": "configured" if os.getenv("TOMTOM_API_KEY") else "missing",
-        "supported_cities": 15,
+        "supported_cities": len(city_registry.cities),
         "services": {
             "traffic_flow": "available",
             "traffic_incidents": "available", 
@@ -99,6 +143,12 @@ async def health_check():
     return health_status
 
 if __name__ == "__main__":
+    if os.getenv("ENVIRONMENT") == "production":
+        # Multi-worker server with the app preloaded; see serve.py
+        from serve import main as serve
+        serve()
+        raise SystemExit
+    
     import uvicorn
     
     port = int(os.getenv("PORT", 8000))
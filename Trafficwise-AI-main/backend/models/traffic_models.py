@@ -2,8 +2,8 @@
 Traffic data models for Pakistani cities and routes
 """
 
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, Literal, Optional, Dict, Any, Tuple
 from enum import Enum
 
 class TrafficLevel(str, Enum):
@@ -13,14 +13,17 @@ class TrafficLevel(str, Enum):
     VERY_HEAVY = "Very Heavy"
 
 class TrafficData(BaseModel):
+    # Built once from the static city table and shared between requests
+    model_config = ConfigDict(frozen=True)
+
     city: str
     lat: float
     lon: float
     traffic_level: TrafficLevel
     color: str
     info: str
-    peak_hours: Optional[List[str]] = None
-    alternative_routes: Optional[List[str]] = None
+    peak_hours: Optional[Tuple[str, ...]] = None
+    alternative_routes: Optional[Tuple[str, ...]] = None
 
 class TrafficDataRequest(BaseModel):
     from_city: str
@@ -28,6 +31,31 @@ class TrafficDataRequest(BaseModel):
     avoid_congestion: bool = True
     departure_time: Optional[str] = None
 
+class NearestCitiesRequest(BaseModel):
+    points: List[Tuple[float, float]] = Field(..., max_length=10000)  # [[lat, lon], ...]
+    max_distance_km: Optional[float] = Field(None, gt=0)
+    include_snapshots: bool = False
+
+class PlaceQuery(BaseModel):
+    query: str = Field(..., min_length=1, max_length=200)
+    city: str
+
+class BulkSearchRequest(BaseModel):
+    queries: List[PlaceQuery] = Field(..., max_length=5000)
+    limit: int = Field(5, ge=1, le=100)  # results per query
+
+class AlertSubscriptionRequest(BaseModel):
+    type: Literal["area", "corridor"]
+    name: Optional[str] = Field(None, max_length=100)
+    # area: a circle around a point
+    lat: Optional[float] = Field(None, ge=-90, le=90)
+    lon: Optional[float] = Field(None, ge=-180, le=180)
+    radius_km: float = Field(5.0, gt=0, le=50)
+    # corridor: a line given as points or a highway route code, with a buffer on either side
+    points: Optional[List[Tuple[float, float]]] = Field(None, min_length=2, max_length=1000)  # [[lat, lon], ...]
+    route_code: Optional[str] = None
+    buffer_km: float = Field(1.0, gt=0, le=10)
+
 class RouteData(BaseModel):
     from_city: str
     to_city: str
@@ -38,7 +66,21 @@ class RouteData(BaseModel):
     waypoints: List[Dict[str, float]]  # [{"lat": 31.5, "lon": 74.3}, ...]
     alternative_routes: Optional[List[Dict[str, Any]]] = None
 
+class RouteOption(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    route_type: str  # "motorway", "highway", "city_road"
+    name: str
+    distance: str
+    duration: str
+    traffic_level: TrafficLevel
+    toll_cost: str
+    recommended: bool
+
 class HighwayData(BaseModel):
+    # Static records are shared; live conditions are applied with model_copy(update=...)
+    model_config = ConfigDict(frozen=True)
+
     name: str
     route_code: str  # M-1, M-2, N-5, etc.
     start_city: str
@@ -46,8 +88,12 @@ class HighwayData(BaseModel):
     total_distance: str
     traffic_level: TrafficLevel
     toll_required: bool
-    waypoints: List[Dict[str, float]]
+    toll_rs: float = 0.0  # Car toll for the full length, in rupees
+    waypoints: Tuple[Dict[str, float], ...]
     current_conditions: Optional[str] = None
+    segments: Optional[List[Dict[str, Any]]] = None  # Live flow per sampled stretch
+    corridor_status: Optional[Dict[str, Any]] = None
+    last_updated: Optional[float] = None
 
 class ChatRequest(BaseModel):
     message: str
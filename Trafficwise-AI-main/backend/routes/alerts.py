@@ -0,0 +1,124 @@
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from pydantic import ValidationError
+import asyncio
+import logging
+from typing import Any, Dict
+from models.traffic_models import AlertSubscriptionRequest
+from services.anomaly_service import anomaly_detector
+from services.geofence import geofence_alerts
+from services.push_service import push_hub, push_sessions
+from services.traffic_service import traffic_service
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/alerts", tags=["alerts"])
+
+def _subscription_shape(request: AlertSubscriptionRequest):
+    """(points, radius_km) for a subscription request"""
+    if request.type == "area":
+        if request.lat is None or request.lon is None:
+            raise ValueError("An area subscription needs lat and lon")
+        return [(request.lat, request.lon)], request.radius_km
+    if request.route_code:
+        highway = next((highway for highway in traffic_service.highways if highway.route_code.lower() == request.route_code.lower()), None)
+        if highway is None:
+            raise ValueError(f"Unknown highway {request.route_code}")
+        return [(point["lat"], point["lon"]) for point in highway.waypoints], request.buffer_km
+    if not request.points:
+        raise ValueError("A corridor subscription needs points or a route_code")
+    return [tuple(point) for point in request.points], request.buffer_km
+
+async def _handle(user_id: str, message: Any) -> Dict[str, Any]:
+    if not isinstance(message, dict):
+        raise ValueError("Messages must be JSON objects")
+    action = message.get("action")
+    if action == "subscribe":
+        request = AlertSubscriptionRequest.model_validate(message)
+        points, radius_km = _subscription_shape(request)
+        subscription = await geofence_alerts.subscribe(user_id, request.type, points, radius_km, request.name)
+        return {"type": "subscribed", "subscription": subscription}
+    if action == "unsubscribe":
+        subscription_id = str(message.get("id", ""))
+        if not geofence_alerts.unsubscribe(user_id, subscription_id):
+            raise ValueError(f"No subscription {subscription_id}")
+        return {"type": "unsubscribed", "id": subscription_id}
+    if action == "list":
+        return {"type": "subscriptions", "data": geofence_alerts.subscriptions(user_id)}
+    raise ValueError("action must be subscribe, unsubscribe or list")
+
+@router.post("/session")
+async def create_alert_session():
+    """Issue a token for the alerts socket; subscriptions and alerts belong to it"""
+    try:
+        return {
+            "success": True,
+            "data": await push_sessions.issue()
+        }
+    except Exception as e:
+        logger.error(f"Error creating alert session: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.websocket("/ws")
+async def alerts_socket(websocket: WebSocket, token: str = Query(..., min_length=1, max_length=128)):
+    """Manage area and corridor subscriptions and receive incident alerts.
+
+    Connect with a token from ``POST /api/alerts/session``; unknown or expired
+    tokens are refused with close code 1008.
+
+    Send ``{"action": "subscribe", "type": "area", "lat": ..., "lon": ..., "radius_km": 5}``,
+    ``{"action": "subscribe", "type": "corridor", "points": [[lat, lon], ...], "buffer_km": 1}``
+    (or ``"route_code": "M-2"``), ``{"action": "unsubscribe", "id": ...}`` or ``{"action": "list"}``.
+    Alerts arrive as ``{"type": "alert", ...}``; city speed and incident anomalies as ``{"type": "anomaly", ...}``. Subscriptions end when the user's last connection closes.
+    """
+    user_id = await push_sessions.user_id(token)
+    if user_id is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    connection = push_hub.connect(user_id)
+
+    async def send():
+        while True:
+            await websocket.send_json(await connection.queue.get())
+
+    sender = asyncio.create_task(send())
+    try:
+        while True:
+            try:
+                reply = await _handle(user_id, await websocket.receive_json())
+            except (ValueError, ValidationError) as e:
+                reply = {"type": "error", "message": str(e)}
+            connection.put(reply)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Error in alerts connection for {user_id}: {str(e)}")
+    finally:
+        sender.cancel()
+        push_hub.disconnect(connection)
+        if not push_hub.is_connected(user_id):
+            geofence_alerts.unsubscribe_user(user_id)
+
+@router.get("/stats")
+async def get_alert_stats():
+    """Get subscription, grid index, anomaly and push channel counts for this worker"""
+    return {
+        "success": True,
+        "data": {
+            "geofence": geofence_alerts.stats(),
+            "anomalies": anomaly_detector.stats(),
+            "push": push_hub.stats()
+        }
+    }
+
+@router.get("/anomalies")
+async def get_active_anomalies():
+    """Cities whose speed or incident count is currently far outside their own baseline"""
+    anomalies = anomaly_detector.active()
+    return {
+        "success": True,
+        "data": {
+            "anomalies": anomalies,
+            "total": len(anomalies)
+        }
+    }
@@ -0,0 +1,54 @@
+from fastapi import APIRouter, HTTPException
+import logging
+import os
+from models.ai_models import ChatRequest, ChatResponse
+from services.ai_services import ai_service, admission_key, is_failure, REMOTE_SERVICES, SERVICE_KEY_ENV
+from services.admission import chat_admission, AdmissionRejected
+from services.timing import TimedJSONResponse, current_timings
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api", tags=["chat"], default_response_class=TimedJSONResponse)
+
+@router.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest):
+    """Chat with an AI service about Pakistani traffic"""
+    service_type = request.service_type
+    config = request.config
+    api_key = request.api_key or (config.api_key if config else None)
+    if service_type in REMOTE_SERVICES:
+        api_key = api_key or os.getenv(SERVICE_KEY_ENV[service_type])
+        if not api_key:
+            raise HTTPException(status_code=400, detail=f"An API key is required for {service_type.value}")
+    
+    try:
+        if service_type in REMOTE_SERVICES:
+            async with chat_admission.admit(admission_key(service_type, api_key), len(request.message)) as waited:
+                timings = current_timings()
+                if timings is not None:
+                    timings.record("queue", waited * 1000)
+                response, service_used = await ai_service.respond(request.message, service_type, api_key, config)
+        else:
+            response, service_used = await ai_service.respond(request.message, service_type, api_key, config)
+        
+        return ChatResponse(
+            response=response,
+            service_used=service_used.value,
+            status="error" if is_failure(response) else "success"
+        )
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        logger.error(f"Error getting chat response from {service_type.value}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/chat/stats")
+async def get_chat_stats():
+    """Get chat admission queue load, queue wait times and provider latencies"""
+    return {
+        "success": True,
+        "data": {
+            "admission": chat_admission.stats(),
+            "provider_latency_seconds": ai_service.latency.stats()
+        }
+    }
@@ -1,11 +1,33 @@
-from fastapi import APIRouter, HTTPException, Query
-from typing import Optional, List
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from typing import Optional, List, Dict, Any
+from datetime import datetime, timezone
+import asyncio
+import json
 import logging
-from services.tomtom_service import tomtom_service
+import os
+import time
+from services.tomtom_service import tomtom_service, PAKISTAN_BBOX
+from services.traffic_service import traffic_service
+from services.city_registry import city_registry
+from services.refresh_scheduler import refresh_scheduler
+from models.traffic_models import BulkSearchRequest, NearestCitiesRequest
+from services.timing import TimedJSONResponse, span
+from services.cluster_service import incident_clusters
+from services.isochrone_service import isochrone_service
+from services.pareto_service import pareto_routes
+from services.history_store import history_store, columnar_available, METRICS as HISTORY_METRICS, EXPORT_FORMATS
+from services.overview_service import national_overview
+from services.anomaly_service import anomaly_detector
+from services.heatmap_service import heatmap_service, MEDIA_TYPES as HEATMAP_MEDIA_TYPES
+from services.tile_service import tile_service, TileFileResponse, TILE_STYLES, DEFAULT_STYLES, CONTENT_TYPES
 
 logger = logging.getLogger(__name__)
 
-router = APIRouter(prefix="/api/traffic", tags=["traffic"])
+router = APIRouter(prefix="/api/traffic", tags=["traffic"], default_response_class=TimedJSONResponse)
+
+# Route endpoints name the supported city an endpoint lies in when it is this close
+ROUTE_CITY_RADIUS_KM = 50.0
 
 @router.get("/cities")
 async def get_supported_cities():
@@ -27,6 +49,7 @@ async def get_supported_cities():
 async def get_traffic_flow(city: str):
     """Get real-time traffic flow data for a Pakistani city"""
     try:
+        refresh_scheduler.record_demand(city)
         result = await tomtom_service.get_traffic_flow(city)
         if result["success"]:
             return result
@@ -38,10 +61,97 @@ async def get_traffic_flow(city: str):
         logger.error(f"Error getting traffic flow for {city}: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+def _parse_bbox(bbox: Optional[str]):
+    """Parse a min_lon,min_lat,max_lon,max_lat query parameter (defaults to all of Pakistan)
+
+    The box is clipped to Pakistan; only its traffic is served.
+    """
+    if not bbox:
+        return PAKISTAN_BBOX
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be min_lon,min_lat,max_lon,max_lat")
+    if not (-180 <= min_lon < max_lon <= 180 and -90 <= min_lat < max_lat <= 90):
+        raise HTTPException(status_code=400, detail="bbox is out of range or empty")
+    min_lon, min_lat = max(min_lon, PAKISTAN_BBOX[0]), max(min_lat, PAKISTAN_BBOX[1])
+    max_lon, max_lat = min(max_lon, PAKISTAN_BBOX[2]), min(max_lat, PAKISTAN_BBOX[3])
+    if min_lon >= max_lon or min_lat >= max_lat:
+        raise HTTPException(status_code=400, detail="bbox does not overlap Pakistan")
+    return min_lon, min_lat, max_lon, max_lat
+
+@router.get("/incidents/region")
+async def get_region_incidents(
+    bbox: Optional[str] = Query(None, description="min_lon,min_lat,max_lon,max_lat; defaults to all of Pakistan"),
+    stream: bool = Query(False, description="Stream incidents as NDJSON while tiles are still loading")
+):
+    """Get traffic incidents for a region larger than a single city"""
+    region = _parse_bbox(bbox)
+    tiles = tomtom_service.region_tiles(*region)
+    if tiles > tomtom_service.incident_max_tiles:
+        raise HTTPException(status_code=400, detail=f"bbox needs {tiles} incident tiles; the limit is {tomtom_service.incident_max_tiles}")
+    
+    if stream:
+        cached = await tomtom_service.get_cached_region_incidents(*region)
+        
+        async def ndjson():
+            if cached is not None:
+                for incident in cached["data"]["incidents"]:
+                    yield json.dumps(incident) + "\n"
+                return
+            async for incident in tomtom_service.stream_region_incidents(*region):
+                yield json.dumps(incident) + "\n"
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+    
+    try:
+        result = await tomtom_service.get_region_incidents(*region)
+        if result["success"]:
+            return result
+        else:
+            raise HTTPException(status_code=400, detail=result["error"])
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting traffic incidents for region {region}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/clusters")
+async def get_incident_clusters(
+    bbox: Optional[str] = Query(None, description="min_lon,min_lat,max_lon,max_lat; defaults to all of Pakistan"),
+    zoom: int = Query(..., ge=0, le=22, description="Map zoom level")
+):
+    """Get incident clusters for the visible map area at a zoom level"""
+    min_lon, min_lat, max_lon, max_lat = _parse_bbox(bbox)
+    try:
+        # Make sure every city in view has current incidents (normally a cache hit);
+        # the cluster index rebuilds itself when any of them refreshes
+        margin = 0.18
+        cities = [
+            name for name, coords in tomtom_service.pakistan_cities.items()
+            if min_lon - margin <= coords["lon"] <= max_lon + margin
+            and min_lat - margin <= coords["lat"] <= max_lat + margin
+        ]
+        await asyncio.gather(*(tomtom_service.get_traffic_incidents(city) for city in cities))
+        
+        clusters = incident_clusters.query(min_lon, min_lat, max_lon, max_lat, zoom)
+        return {
+            "success": True,
+            "data": {
+                "zoom": zoom,
+                "total_clusters": len(clusters),
+                "total_incidents": sum(cluster["count"] for cluster in clusters),
+                "clusters": clusters
+            }
+        }
+    except Exception as e:
+        logger.error(f"Error getting incident clusters for {bbox} at zoom {zoom}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @router.get("/incidents/{city}")
 async def get_traffic_incidents(city: str):
     """Get traffic incidents for a Pakistani city"""
     try:
+        refresh_scheduler.record_demand(city)
         result = await tomtom_service.get_traffic_incidents(city)
         if result["success"]:
             return result
@@ -53,15 +163,133 @@ async def get_traffic_incidents(city: str):
         logger.error(f"Error getting traffic incidents for {city}: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+def _resolve_point(value: str) -> str:
+    """Pass "lat,lon" through; a supported city name becomes its canonical position"""
+    city = city_registry.get(value.strip())
+    return f"{city['lat']},{city['lon']}" if city else value
+
+def _route_city(point: str) -> Optional[str]:
+    """Supported city a "lat,lon" point lies in, if any"""
+    try:
+        lat, lon = (float(value) for value in point.split(","))
+    except ValueError:
+        return None
+    match = city_registry.nearest(lat, lon, ROUTE_CITY_RADIUS_KM)
+    return match[0]["name"] if match else None
+
+async def _city_snapshot(city: str, include_incidents: bool = True) -> Dict[str, Any]:
+    """Cached flow and incidents for a supported city; parts that are unavailable are None"""
+    flow_result, incidents_result = await asyncio.gather(
+        tomtom_service.get_traffic_flow(city),
+        tomtom_service.get_traffic_incidents(city),
+        return_exceptions=True
+    )
+    snapshot = {"traffic_flow": None, "total_incidents": None}
+    if isinstance(flow_result, dict) and flow_result.get("success"):
+        snapshot["traffic_flow"] = flow_result["data"]
+    if isinstance(incidents_result, dict) and incidents_result.get("success"):
+        snapshot["total_incidents"] = incidents_result["data"]["total_incidents"]
+        if include_incidents:
+            snapshot["incidents"] = incidents_result["data"]["incidents"]
+    return snapshot
+
+@router.get("/nearest")
+async def get_nearest_city(
+    lat: float = Query(..., ge=-90, le=90, description="Latitude"),
+    lon: float = Query(..., ge=-180, le=180, description="Longitude"),
+    max_distance_km: Optional[float] = Query(None, gt=0, description="Only match cities this close"),
+    snapshot: bool = Query(True, description="Include the city's current flow and incidents")
+):
+    """Resolve a GPS position to the nearest supported city"""
+    match = city_registry.nearest(lat, lon, max_distance_km)
+    if match is None:
+        raise HTTPException(status_code=404, detail=f"No supported city within {max_distance_km} km")
+    city, distance = match
+    try:
+        data = {
+            "city": city["name"],
+            "coordinates": {"lat": city["lat"], "lon": city["lon"]},
+            "distance_km": round(distance, 3)
+        }
+        if snapshot:
+            refresh_scheduler.record_demand(city["name"])
+            data["snapshot"] = await _city_snapshot(city["name"])
+        return {
+            "success": True,
+            "data": data
+        }
+    except Exception as e:
+        logger.error(f"Error resolving nearest city for {lat},{lon}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.post("/nearest")
+async def resolve_nearest_cities(request: NearestCitiesRequest):
+    """Resolve a batch of GPS positions to their nearest supported cities"""
+    try:
+        # Thousands of lookups take tens of milliseconds; keep them off the event loop
+        matches = await asyncio.get_running_loop().run_in_executor(
+            None, city_registry.nearest_many, request.points, request.max_distance_km
+        )
+        results = [
+            {"city": match[0]["name"], "distance_km": round(match[1], 3)} if match else None
+            for match in matches
+        ]
+        data = {
+            "total": len(results),
+            "resolved": sum(1 for result in results if result),
+            "results": results
+        }
+        if request.include_snapshots:
+            cities = sorted({result["city"] for result in results if result})
+            snapshots = await asyncio.gather(*(_city_snapshot(city, include_incidents=False) for city in cities))
+            data["snapshots"] = dict(zip(cities, snapshots))
+        return {
+            "success": True,
+            "data": data
+        }
+    except Exception as e:
+        logger.error(f"Error resolving nearest cities for {len(request.points)} points: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/isochrone")
+async def get_isochrone(
+    lat: float = Query(..., ge=-90, le=90, description="Latitude"),
+    lon: float = Query(..., ge=-180, le=180, description="Longitude"),
+    minutes: str = Query("15,30,60", description="Comma-separated travel times in minutes (up to 4, each at most 120)")
+):
+    """Get polygons of the area reachable from a point within each travel time, at current speeds"""
+    try:
+        limits = [int(value) for value in minutes.split(",")]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="minutes must be comma-separated integers")
+    if not 1 <= len(limits) <= 4 or not all(1 <= limit <= 120 for limit in limits):
+        raise HTTPException(status_code=400, detail="minutes must be 1 to 4 values between 1 and 120")
+    
+    try:
+        result = await isochrone_service.get_isochrone(lat, lon, limits)
+        if result["success"]:
+            return result
+        else:
+            raise HTTPException(status_code=400, detail=result["error"])
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error computing isochrone from {lat},{lon}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @router.get("/route")
 async def get_route_with_traffic(
-    origin: str = Query(..., description="Origin coordinates (lat,lon) or address"),
-    destination: str = Query(..., description="Destination coordinates (lat,lon) or address")
+    origin: str = Query(..., description="Origin coordinates (lat,lon) or supported city name"),
+    destination: str = Query(..., description="Destination coordinates (lat,lon) or supported city name"),
+    geometry: bool = Query(True, description="Include the encoded route line, per-zoom simplifications and traffic sections")
 ):
     """Get route with traffic information between two points"""
     try:
-        result = await tomtom_service.get_route_traffic(origin, destination)
+        origin, destination = _resolve_point(origin), _resolve_point(destination)
+        result = await tomtom_service.get_route_traffic(origin, destination, include_geometry=geometry)
         if result["success"]:
+            result["data"]["origin_city"] = _route_city(origin)
+            result["data"]["destination_city"] = _route_city(destination)
             return result
         else:
             raise HTTPException(status_code=400, detail=result["error"])
@@ -71,14 +299,61 @@ async def get_route_with_traffic(
         logger.error(f"Error getting route from {origin} to {destination}: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@router.get("/route/departures")
+async def get_departure_sweep(
+    origin: str = Query(..., description="Origin coordinates (lat,lon) or supported city name"),
+    destination: str = Query(..., description="Destination coordinates (lat,lon) or supported city name"),
+    window_start: Optional[datetime] = Query(None, description="Start of the departure window (ISO 8601, default now, PKT if no offset)"),
+    window_hours: float = Query(3.0, gt=0, le=24, description="Length of the departure window in hours"),
+    step_minutes: int = Query(15, ge=5, le=120, description="Minutes between candidate departures")
+):
+    """Find the best departure time for a route across a window of candidate times"""
+    try:
+        origin, destination = _resolve_point(origin), _resolve_point(destination)
+        result = await tomtom_service.get_departure_sweep(
+            origin, destination,
+            window_start=window_start,
+            window_hours=window_hours,
+            step_minutes=step_minutes
+        )
+        if result["success"]:
+            return result
+        else:
+            raise HTTPException(status_code=400, detail=result["error"])
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error sweeping departures from {origin} to {destination}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/route/options")
+async def get_route_options(
+    from_city: str = Query(..., description="Supported origin city"),
+    to_city: str = Query(..., description="Supported destination city"),
+    max_routes: Optional[int] = Query(None, ge=1, le=20, description="Return at most this many routes, fastest first")
+):
+    """Get every route between two cities that is not beaten on travel time, toll and distance at once"""
+    try:
+        result = await pareto_routes.get_routes(from_city, to_city, max_routes)
+        if result["success"]:
+            return result
+        else:
+            raise HTTPException(status_code=400, detail=result["error"])
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting route options from {from_city} to {to_city}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @router.get("/search")
 async def search_places(
     query: str = Query(..., description="Search query for places"),
-    city: str = Query(..., description="Pakistani city to search in")
+    city: str = Query(..., description="Pakistani city to search in"),
+    limit: int = Query(20, ge=1, le=100, description="Maximum number of places")
 ):
     """Search for places in Pakistani cities"""
     try:
-        result = await tomtom_service.search_places(query, city)
+        result = await tomtom_service.search_places(query, city, limit)
         if result["success"]:
             return result
         else:
@@ -89,13 +364,65 @@ async def search_places(
         logger.error(f"Error searching places for '{query}' in {city}: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@router.post("/search/bulk")
+async def search_places_bulk(request: BulkSearchRequest):
+    """Search many (query, city) pairs, streaming one NDJSON line per pair as results arrive"""
+    pairs = [(item.query, item.city) for item in request.queries]
+    
+    async def ndjson():
+        async for line in tomtom_service.search_places_bulk(pairs, request.limit):
+            yield json.dumps(line) + "\n"
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@router.get("/highways")
+async def get_highways():
+    """Get major Pakistani highways with live per-segment corridor conditions"""
+    try:
+        highways = await traffic_service.get_highway_data()
+        return {
+            "success": True,
+            "data": {
+                "highways": highways,
+                "total": len(highways)
+            }
+        }
+    except Exception as e:
+        logger.error(f"Error getting highway data: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/refresh-schedule")
+async def get_refresh_schedule():
+    """Get the adaptive refresh interval and its inputs for every city"""
+    try:
+        cities = refresh_scheduler.status()
+        return {
+            "success": True,
+            "data": {
+                "enabled": os.getenv("CITY_REFRESH", "false").lower() == "true",
+                "calls_per_minute": round(refresh_scheduler.budget.rate * 60, 1),
+                "cities": cities
+            }
+        }
+    except Exception as e:
+        logger.error(f"Error getting refresh schedule: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/overview")
+async def get_national_overview():
+    """Country-wide speed index, incidents by severity and the slowest cities, from running aggregates"""
+    try:
+        return national_overview.get_overview()
+    except Exception as e:
+        logger.error(f"Error getting national overview: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @router.get("/dashboard/{city}")
 async def get_traffic_dashboard(city: str):
     """Get complete traffic dashboard data for a Pakistani city"""
     try:
-        # Get traffic flow and incidents concurrently
-        import asyncio
+        refresh_scheduler.record_demand(city)
         
+        # Get traffic flow and incidents concurrently
         flow_task = tomtom_service.get_traffic_flow(city)
         incidents_task = tomtom_service.get_traffic_incidents(city)
         
@@ -103,42 +430,53 @@ async def get_traffic_dashboard(city: str):
             flow_task, incidents_task, return_exceptions=True
         )
         
-        dashboard_data = {
-            "city": city.title(),
-            "timestamp": "",
-            "traffic_flow": None,
-            "incidents": None,
-            "summary": {
-                "overall_status": "unknown",
-                "total_incidents": 0,
-                "avg_speed": 0,
-                "traffic_level": "unknown"
+        with span("logic"):
+            dashboard_data = {
+                "city": city.title(),
+                "timestamp": "",
+                "traffic_flow": None,
+                "incidents": None,
+                "summary": {
+                    "overall_status": "unknown",
+                    "total_incidents": 0,
+                    "avg_speed": 0,
+                    "traffic_level": "unknown"
+                }
             }
-        }
         
-        # Process traffic flow data
-        if isinstance(flow_result, dict) and flow_result.get("success"):
-            dashboard_data["traffic_flow"] = flow_result["data"]
-            dashboard_data["timestamp"] = flow_result["data"].get("timestamp", "")
-            dashboard_data["summary"]["avg_speed"] = flow_result["data"].get("current_speed", 0)
-            dashboard_data["summary"]["traffic_level"] = flow_result["data"].get("traffic_level", "unknown")
+            # Process traffic flow data
+            if isinstance(flow_result, dict) and flow_result.get("success"):
+                dashboard_data["traffic_flow"] = flow_result["data"]
+                dashboard_data["timestamp"] = flow_result["data"].get("timestamp", "")
+                dashboard_data["summary"]["avg_speed"] = flow_result["data"].get("current_speed", 0)
+                dashboard_data["summary"]["traffic_level"] = flow_result["data"].get("traffic_level", "unknown")
         
-        # Process incidents data
-        if isinstance(incidents_result, dict) and incidents_result.get("success"):
-            dashboard_data["incidents"] = incidents_result["data"]
-            dashboard_data["summary"]["total_incidents"] = incidents_result["data"].get("total_incidents", 0)
+            # Process incidents data
+            if isinstance(incidents_result, dict) and incidents_result.get("success"):
+                dashboard_data["incidents"] = incidents_result["data"]
+                dashboard_data["summary"]["total_incidents"] = incidents_result["data"].get("total_incidents", 0)
         
-        # Determine overall status
-        if dashboard_data["traffic_flow"] and dashboard_data["incidents"]:
-            traffic_level = dashboard_data["summary"]["traffic_level"]
-            incident_count = dashboard_data["summary"]["total_incidents"]
+            # Determine overall status against the city's own baseline once it has one
+            baseline = anomaly_detector.status(city)
+            dashboard_data["summary"]["anomalies"] = baseline
+            if dashboard_data["traffic_flow"] and dashboard_data["incidents"] and baseline:
+                worst_z = max(-baseline["speed_ratio"]["z"], baseline["incidents"]["z"])
+                if any(metric["anomalous"] for metric in baseline.values()):
+                    dashboard_data["summary"]["overall_status"] = "congested"
+                elif worst_z >= anomaly_detector.threshold / 2:
+                    dashboard_data["summary"]["overall_status"] = "moderate"
+                else:
+                    dashboard_data["summary"]["overall_status"] = "good"
+            elif dashboard_data["traffic_flow"] and dashboard_data["incidents"]:
+                traffic_level = dashboard_data["summary"]["traffic_level"]
+                incident_count = dashboard_data["summary"]["total_incidents"]
             
-            if traffic_level == "light" and incident_count <= 2:
-                dashboard_data["summary"]["overall_status"] = "good"
-            elif traffic_level == "moderate" or incident_count <= 5:
-                dashboard_data["summary"]["overall_status"] = "moderate"
-            else:
-                dashboard_data["summary"]["overall_status"] = "congested"
+                if traffic_level == "light" and incident_count <= 2:
+                    dashboard_data["summary"]["overall_status"] = "good"
+                elif traffic_level == "moderate" or incident_count <= 5:
+                    dashboard_data["summary"]["overall_status"] = "moderate"
+                else:
+                    dashboard_data["summary"]["overall_status"] = "congested"
         
         return {
             "success": True,
@@ -147,4 +485,105 @@ async def get_traffic_dashboard(city: str):
         
     except Exception as e:
         logger.error(f"Error getting traffic dashboard for {city}: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/tiles/{layer}/{z}/{x}/{y}.{fmt}")
+async def get_map_tile(
+    request: Request,
+    layer: str,
+    z: int,
+    x: int,
+    y: int,
+    fmt: str,
+    style: Optional[str] = Query(None, description="TomTom tile style, e.g. relative0 for flow or s3 for incidents")
+):
+    """Proxy TomTom traffic flow/incident tiles through the shared disk cache"""
+    style = style or DEFAULT_STYLES.get(layer)
+    if layer not in TILE_STYLES or style not in TILE_STYLES[layer]:
+        raise HTTPException(status_code=404, detail=f"Unknown tile layer or style: {layer}/{style}")
+    if fmt not in CONTENT_TYPES or not 0 <= z <= 22 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=400, detail="Invalid tile coordinates or format")
+    
+    try:
+        result = await tile_service.get_tile(layer, style, z, x, y, fmt)
+    except Exception as e:
+        logger.error(f"Error getting map tile {layer}/{z}/{x}/{y}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+    
+    if not result["success"]:
+        raise HTTPException(status_code=502, detail=result["error"])
+    
+    headers = {
+        "ETag": result["etag"],
+        "Cache-Control": f"public, max-age={result['max_age']}"
+    }
+    if result["etag"] in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        if "file" in result:
+            result["file"].close()
+        return Response(status_code=304, headers=headers)
+    if "file" in result:
+        return TileFileResponse(result["file"], media_type=result["media_type"], headers=headers)
+    return Response(content=result["body"], media_type=result["media_type"], headers=headers)
+
+@router.get("/heatmap/{city}.{fmt}")
+async def get_heatmap(request: Request, city: str, fmt: str):
+    """Congestion heatmap of a city as a PNG or a byte grid (speed ratio * 250, 255 for no data, north row first)"""
+    if fmt not in HEATMAP_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Format must be png or bin")
+    if city.lower() not in tomtom_service.pakistan_cities:
+        raise HTTPException(status_code=404, detail=f"City {city} not supported")
+    
+    try:
+        result = await heatmap_service.get_heatmap(city, fmt)
+    except Exception as e:
+        logger.error(f"Error getting heatmap for {city}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+    
+    if not result["success"]:
+        raise HTTPException(status_code=404, detail=result["error"])
+    
+    headers = {
+        "ETag": result["etag"],
+        "Cache-Control": f"public, max-age={int(heatmap_service.interval)}",
+        "X-Heatmap-Size": str(result["size"]),
+        "X-Heatmap-BBox": ",".join(str(value) for value in result["bbox"]),
+        "X-Heatmap-Updated": str(int(result["updated_at"]))
+    }
+    if result["etag"] in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=result["body"], media_type=result["media_type"], headers=headers)
+
+@router.get("/history/export")
+async def export_history(
+    metric: str = Query("flow", description="flow or incidents"),
+    city: Optional[str] = Query(None, description="Comma-separated cities, all if omitted"),
+    start: Optional[datetime] = Query(None, description="ISO 8601 start (inclusive), defaults to 7 days before end"),
+    end: Optional[datetime] = Query(None, description="ISO 8601 end (exclusive), defaults to now"),
+    format: str = Query("csv", description="csv, arrow or parquet")
+):
+    """Stream recorded flow or incident history for a time range without loading it into memory"""
+    if metric not in HISTORY_METRICS:
+        raise HTTPException(status_code=400, detail="Metric must be flow or incidents")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Format must be csv, arrow or parquet")
+    if format != "csv" and not columnar_available():
+        raise HTTPException(status_code=400, detail="Arrow and Parquet exports need pyarrow installed; use format=csv")
+    
+    cities = [name.strip().lower() for name in city.split(",") if name.strip()] if city else []
+    for name in cities:
+        if name not in tomtom_service.pakistan_cities:
+            raise HTTPException(status_code=404, detail=f"City {name} not supported")
+    
+    # Naive datetimes are taken as UTC
+    end_ts = (end.timestamp() if end.tzinfo else end.replace(tzinfo=timezone.utc).timestamp()) if end else time.time()
+    start_ts = (start.timestamp() if start.tzinfo else start.replace(tzinfo=timezone.utc).timestamp()) if start else end_ts - 7 * 86400
+    if start_ts >= end_ts:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    
+    extension = {"csv": "csv", "arrow": "arrows", "parquet": "parquet"}[format]
+    filename = f"trafficwise_{metric}_{int(start_ts)}_{int(end_ts)}.{extension}"
+    return StreamingResponse(
+        history_store.export(metric, cities, start_ts, end_ts, format),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -0,0 +1,122 @@
+"""
+Production server for the TrafficWise AI backend
+
+Run from the backend directory:
+
+    python serve.py
+
+Gunicorn manages one uvicorn worker per core (``WEB_CONCURRENCY`` to
+override) on uvloop and httptools. Each worker imports the app itself by
+default. ``PRELOAD_APP=true`` imports it once in the master and forks, so
+route tables, the city registry and the road graph are shared
+copy-on-write (about a quarter less memory with two workers), but
+everything the services open at import then comes from the master; it is
+opt-in until all of that is known to be fork-safe.
+
+More workers only add throughput while there are free cores. On a single
+core the extra processes compete for it: 236-238 req/s with two workers
+against 261 for one plain uvicorn process in ``benchmarks/bench_server.py``.
+
+On SIGTERM workers stop accepting connections and finish in-flight
+requests for up to ``GRACEFUL_TIMEOUT`` seconds, then run the app's
+shutdown (background tasks, capture flush). Gunicorn does not run on
+Windows; there the same settings start uvicorn's own multi-process
+supervisor without preloading.
+"""
+
+import gc
+import logging
+import os
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+try:
+    from gunicorn.app.base import BaseApplication
+    from uvicorn.workers import UvicornWorker
+except ImportError:
+    BaseApplication = UvicornWorker = None
+
+APP = "main:app"
+
+def settings() -> Dict[str, Any]:
+    """Server settings from the environment"""
+    graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+    return {
+        "bind": f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', 8000)}",
+        # Workers are async, so one per core keeps every core busy without oversubscribing
+        "workers": int(os.getenv("WEB_CONCURRENCY", 0)) or os.cpu_count() or 1,
+        "preload_app": os.getenv("PRELOAD_APP", "false").lower() == "true",
+        "backlog": int(os.getenv("SERVER_BACKLOG", 2048)),
+        # Keep above the idle timeout of any load balancer in front, or it will reuse closed connections
+        "keepalive": int(os.getenv("KEEPALIVE_SECONDS", 15)),
+        "graceful_timeout": graceful_timeout,
+        "timeout": int(os.getenv("WORKER_TIMEOUT", 60)),
+        # Recycling workers drops per-worker state (alert subscriptions, anomaly baselines), so it is off by default
+        "max_requests": int(os.getenv("MAX_REQUESTS", 0)),
+        "max_requests_jitter": int(os.getenv("MAX_REQUESTS_JITTER", 0)),
+        "accesslog": "-" if os.getenv("ACCESS_LOG", "false").lower() == "true" else None,
+        # Worker heartbeats on tmpfs avoid stalls when the disk is slow
+        "worker_tmp_dir": "/dev/shm" if os.path.isdir("/dev/shm") else None
+    }
+
+if UvicornWorker is not None:
+    class TrafficWiseWorker(UvicornWorker):
+        """Uvicorn worker pinned to uvloop and httptools, closing lingering connections before gunicorn's deadline"""
+
+        CONFIG_KWARGS = {
+            "loop": "uvloop",
+            "http": "httptools",
+            # Leave time for the app's shutdown after open connections (e.g. alert sockets) are cancelled
+            "timeout_graceful_shutdown": max(int(os.getenv("GRACEFUL_TIMEOUT", 30)) - 5, 1)
+        }
+
+    class ProductionServer(BaseApplication):
+        def __init__(self, options: Dict[str, Any]):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                if value is not None:
+                    self.cfg.set(key, value)
+            # By import path: gunicorn reports and re-imports it, and this file may be running as __main__
+            self.cfg.set("worker_class", "serve.TrafficWiseWorker")
+            self.cfg.set("when_ready", when_ready)
+
+        def load(self):
+            from main import app
+            return app
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        # Objects loaded before the fork are never freed; keeping them out of the collector's
+        # generations stops its bookkeeping from copying their shared pages into every worker.
+        # Without preloading the master holds none of the app, so there is nothing to protect
+        gc.freeze()
+    server.log.info(f"🌟 Serving {APP} on {server.cfg.bind[0]} with {server.cfg.workers} workers")
+
+def main():
+    options = settings()
+    if BaseApplication is not None:
+        ProductionServer(options).run()
+        return
+
+    import uvicorn
+
+    host, port = options["bind"].rsplit(":", 1)
+    logger.info(f"🌟 Gunicorn unavailable; starting {options['workers']} uvicorn workers on {host}:{port}")
+    uvicorn.run(
+        APP,
+        host=host,
+        port=int(port),
+        workers=options["workers"],
+        backlog=options["backlog"],
+        timeout_keep_alive=options["keepalive"],
+        timeout_graceful_shutdown=max(options["graceful_timeout"] - 5, 1),
+        access_log=options["accesslog"] is not None,
+        log_level="info"
+    )
+
+if __name__ == "__main__":
+    main()
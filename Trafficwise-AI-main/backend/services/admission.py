@@ -0,0 +1,191 @@
+"""
+Admission control for AI chat calls
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List
+
+class AdmissionRejected(Exception):
+    """The queue is full or a request waited too long; retry after ``retry_after`` seconds"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AdmissionQueue:
+    """Caps concurrent calls globally and per API key, queueing the excess.
+
+    Waiting requests are ordered by arrival time, with long prompts
+    counted as arriving ``long_prompt_penalty`` seconds later. Short
+    prompts overtake recent long ones but a long prompt is never starved.
+    A request whose key is at its cap lets the next one in line go first.
+    When the queue is at ``max_queue``, or a request waits longer than
+    ``max_wait``, it is rejected with a suggested retry delay.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        max_per_key: int,
+        max_queue: int,
+        max_wait: float,
+        short_prompt_chars: int,
+        long_prompt_penalty: float
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_per_key = max_per_key
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.short_prompt_chars = short_prompt_chars
+        self.long_prompt_penalty = long_prompt_penalty
+
+        self._active = 0
+        self._active_per_key: Dict[str, int] = {}
+        # Entries are (priority, sequence, key, future); futures of abandoned waits are cancelled
+        self._heap: List[tuple] = []
+        self._sequence = itertools.count()
+        self._queued = 0
+
+        # Metrics
+        self._service_time = 5.0  # moving average of seconds a call holds its slot
+        self._waits = deque(maxlen=500)
+        self.admitted = 0
+        self.rejected = 0
+        self.skipped = 0  # optional calls (hedges) that found no free slot
+
+    def _has_capacity(self, key: str) -> bool:
+        return self._active < self.max_concurrent and self._active_per_key.get(key, 0) < self.max_per_key
+
+    def _start(self, key: str):
+        self._active += 1
+        self._active_per_key[key] = self._active_per_key.get(key, 0) + 1
+
+    def _finish(self, key: str):
+        self._active -= 1
+        remaining = self._active_per_key[key] - 1
+        if remaining:
+            self._active_per_key[key] = remaining
+        else:
+            del self._active_per_key[key]
+        self._dispatch()
+
+    def _dispatch(self):
+        """Admit waiting requests in priority order while there is capacity"""
+        blocked = []
+        while self._heap and self._active < self.max_concurrent:
+            entry = heapq.heappop(self._heap)
+            _, _, key, future = entry
+            if future.done():
+                continue
+            if not self._has_capacity(key):
+                blocked.append(entry)
+                continue
+            self._start(key)
+            future.set_result(None)
+        for entry in blocked:
+            heapq.heappush(self._heap, entry)
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to be free for a new request"""
+        return max(1, math.ceil((self._queued + 1) * self._service_time / self.max_concurrent))
+
+    @asynccontextmanager
+    async def admit(self, key: str, prompt_chars: int, wait: bool = True):
+        """Hold a slot for ``key`` while the block runs; yields the seconds spent waiting.
+
+        With ``wait=False`` a slot is taken only if one is free right now and
+        nobody is queued for it; otherwise AdmissionRejected is raised at
+        once. Optional calls such as hedges use this, so they never wait in
+        line or get ahead of requests that are waiting.
+        """
+        if not wait:
+            if self._queued or not self._has_capacity(key):
+                self.skipped += 1
+                raise AdmissionRejected("No chat slot free", self.retry_after())
+            self._start(key)
+            self.admitted += 1
+            started = time.monotonic()
+            try:
+                yield 0.0
+            finally:
+                self._service_time += 0.1 * (time.monotonic() - started - self._service_time)
+                self._finish(key)
+            return
+
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected("Chat queue is full", self.retry_after())
+
+        arrived = time.monotonic()
+        penalty = 0.0 if prompt_chars <= self.short_prompt_chars else self.long_prompt_penalty
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (arrived + penalty, next(self._sequence), key, future))
+        self._queued += 1
+        try:
+            self._dispatch()
+            if not future.done():
+                await asyncio.wait({future}, timeout=self.max_wait)
+        except BaseException:
+            # Cancelled while waiting; hand back a slot granted in the meantime
+            if future.done() and not future.cancelled():
+                self._finish(key)
+            future.cancel()
+            raise
+        finally:
+            self._queued -= 1
+
+        if not future.done():
+            future.cancel()
+            self.rejected += 1
+            raise AdmissionRejected("Timed out waiting for a chat slot", self.retry_after())
+
+        waited = time.monotonic() - arrived
+        self._waits.append(waited)
+        self.admitted += 1
+        started = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self._service_time += 0.1 * (time.monotonic() - started - self._service_time)
+            self._finish(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current load and recent queue wait times in milliseconds"""
+        waits = sorted(self._waits)
+
+        def percentile(fraction: float):
+            return round(waits[min(int(fraction * len(waits)), len(waits) - 1)] * 1000, 1) if waits else None
+
+        return {
+            "active": self._active,
+            "queued": self._queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "skipped": self.skipped,
+            "queue_wait_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "max": percentile(1.0)},
+            "limits": {
+                "max_concurrent": self.max_concurrent,
+                "max_per_key": self.max_per_key,
+                "max_queue": self.max_queue
+            }
+        }
+
+def admission_from_env() -> AdmissionQueue:
+    return AdmissionQueue(
+        max_concurrent=int(os.getenv("AI_MAX_CONCURRENT", 8)),
+        max_per_key=int(os.getenv("AI_MAX_CONCURRENT_PER_KEY", 2)),
+        max_queue=int(os.getenv("AI_MAX_QUEUE", 64)),
+        max_wait=float(os.getenv("AI_QUEUE_TIMEOUT", 30)),
+        short_prompt_chars=int(os.getenv("AI_SHORT_PROMPT_CHARS", 280)),
+        long_prompt_penalty=float(os.getenv("AI_LONG_PROMPT_PENALTY", 2.0))
+    )
+
+# Initialize queue (per worker process)
+chat_admission = admission_from_env()
@@ -2,19 +2,86 @@
 AI Services for handling different AI providers
 """
 
-import requests
+import httpx
+import hashlib
 import json
 import asyncio
-from typing import Optional
+import os
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
 import logging
 
 from models.ai_models import AIServiceType, AIConfig
+from services.admission import chat_admission, AdmissionRejected
+from services.prompt_context import prompt_context, SYSTEM_PREFIX
 
 logger = logging.getLogger(__name__)
 
+# Providers that call a remote model and are worth hedging
+REMOTE_SERVICES = (AIServiceType.GOOGLE_GEMINI, AIServiceType.OPENAI)
+
+# Server-side keys that let the other remote provider act as a secondary
+SERVICE_KEY_ENV = {
+    AIServiceType.GOOGLE_GEMINI: "GOOGLE_GEMINI_API_KEY",
+    AIServiceType.OPENAI: "OPENAI_API_KEY"
+}
+
+def is_failure(response: str) -> bool:
+    """Providers report errors as text starting with ❌"""
+    return response.startswith("❌")
+
+def admission_key(service_type: AIServiceType, api_key: str) -> str:
+    """Admission limits are per provider key; only a digest of the key is kept"""
+    return hashlib.sha256(f"{service_type.value}:{api_key}".encode()).hexdigest()[:16]
+
+class LatencyTracker:
+    """Recent response times per provider.
+
+    Calls cancelled before answering (a primary that lost its hedge race)
+    are kept as their elapsed time, a lower bound on how long they would
+    have taken. Dropping them would leave only the fast calls, pulling the
+    percentile and so the hedge delay down until nearly every call hedges.
+    """
+    
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: Dict[AIServiceType, deque] = {}
+        self._window = window
+    
+    def record(self, service_type: AIServiceType, seconds: float):
+        self._samples.setdefault(service_type, deque(maxlen=self._window)).append(seconds)
+    
+    def percentile(self, service_type: AIServiceType, fraction: float) -> Optional[float]:
+        """Latency below which ``fraction`` of recent responses arrived, or None until there are enough samples"""
+        samples = self._samples.get(service_type)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+    
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {
+            service_type.value: {
+                "samples": len(samples),
+                "p50": self.percentile(service_type, 0.5),
+                "p95": self.percentile(service_type, 0.95)
+            }
+            for service_type, samples in self._samples.items()
+        }
+
 class AIService:
     def __init__(self):
         self.timeout = 30
+        
+        # Hedging: if the primary provider has not answered after its own
+        # p-th percentile latency, a secondary starts and the first good answer wins
+        self.hedge_enabled = os.getenv("AI_HEDGE_ENABLED", "true").lower() == "true"
+        self.hedge_percentile = float(os.getenv("AI_HEDGE_PERCENTILE", 0.95))
+        self.hedge_min_delay = float(os.getenv("AI_HEDGE_MIN_DELAY", 1.0))
+        self.hedge_max_delay = float(os.getenv("AI_HEDGE_MAX_DELAY", 10.0))
+        self.hedge_default_delay = float(os.getenv("AI_HEDGE_DEFAULT_DELAY", 5.0))  # until enough samples
+        self.latency = LatencyTracker()
     
     async def get_response(
         self, 
@@ -24,7 +91,105 @@ class AIService:
         config: Optional[AIConfig] = None
     ) -> str:
         """Get AI response based on service type"""
+        response, _ = await self.respond(message, service_type, api_key, config)
+        return response
+    
+    async def respond(
+        self, 
+        message: str, 
+        service_type: AIServiceType, 
+        api_key: Optional[str] = None,
+        config: Optional[AIConfig] = None
+    ) -> Tuple[str, AIServiceType]:
+        """Get an AI response and the service that produced it, hedging remote providers"""
+        # Only calls on the server's own key are hedged, so a user's key (or a bad one)
+        # never falls over onto the server's paid keys
+        if (
+            not self.hedge_enabled
+            or service_type not in REMOTE_SERVICES
+            or api_key != os.getenv(SERVICE_KEY_ENV[service_type])
+        ):
+            return await self._timed_call(message, service_type, api_key, config), service_type
         
+        secondary_type, secondary_key = self._secondary(service_type)
+        primary = asyncio.create_task(self._timed_call(message, service_type, api_key, config))
+        secondary = None
+        try:
+            # A quick failure of the primary starts the secondary straight away
+            done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay(service_type))
+            if done and not is_failure(primary.result()):
+                return primary.result(), service_type
+            
+            logger.info(f"⏱️ Hedging {service_type.value} with {secondary_type.value}")
+            secondary = asyncio.create_task(self._admitted_call(message, secondary_type, secondary_key))
+            pending = {primary, secondary} - done
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in (primary, secondary):
+                    if task in done and not is_failure(task.result()):
+                        return task.result(), service_type if task is primary else secondary_type
+            
+            # Both failed; the primary's error is the one the user asked about
+            return primary.result(), service_type
+        finally:
+            for task in (primary, secondary):
+                if task is not None and not task.done():
+                    task.cancel()
+    
+    def hedge_delay(self, service_type: AIServiceType) -> float:
+        """Seconds to wait for a provider before starting the secondary"""
+        delay = self.latency.percentile(service_type, self.hedge_percentile)
+        if delay is None:
+            return self.hedge_default_delay
+        return min(max(delay, self.hedge_min_delay), self.hedge_max_delay)
+    
+    def _secondary(self, service_type: AIServiceType) -> Tuple[AIServiceType, Optional[str]]:
+        """The other remote provider if the server has a key for it, else the offline responder"""
+        for other in REMOTE_SERVICES:
+            if other != service_type and os.getenv(SERVICE_KEY_ENV[other]):
+                return other, os.getenv(SERVICE_KEY_ENV[other])
+        return AIServiceType.OFFLINE, None
+    
+    async def _admitted_call(self, message: str, service_type: AIServiceType, api_key: Optional[str]) -> str:
+        """A secondary call, holding an admission slot for its key like any other remote call.
+
+        A hedge never queues: with no slot free right now it is skipped (reported as a
+        failure, so the primary is awaited), since one that waits for a slot only adds load.
+        """
+        if service_type not in REMOTE_SERVICES:
+            return await self._timed_call(message, service_type, api_key, None)
+        try:
+            async with chat_admission.admit(admission_key(service_type, api_key), len(message), wait=False):
+                return await self._timed_call(message, service_type, api_key, None)
+        except AdmissionRejected as e:
+            return f"❌ {service_type.value} is busy: {str(e)}"
+    
+    async def _timed_call(
+        self, 
+        message: str, 
+        service_type: AIServiceType, 
+        api_key: Optional[str], 
+        config: Optional[AIConfig]
+    ) -> str:
+        started = time.monotonic()
+        try:
+            response = await self._call(message, service_type, api_key, config)
+        except asyncio.CancelledError:
+            # Censored sample: the answer would have taken at least this long
+            self.latency.record(service_type, time.monotonic() - started)
+            raise
+        # Only successful calls say how long a good answer takes
+        if not is_failure(response):
+            self.latency.record(service_type, time.monotonic() - started)
+        return response
+    
+    async def _call(
+        self, 
+        message: str, 
+        service_type: AIServiceType, 
+        api_key: Optional[str] = None,
+        config: Optional[AIConfig] = None
+    ) -> str:
         if service_type == AIServiceType.GOOGLE_GEMINI:
             return await self.chat_with_gemini(message, api_key, config)
         elif service_type == AIServiceType.OPENAI:
@@ -45,21 +210,14 @@ class AIService:
         model = config.model if config and config.model else "gemini-1.5-flash"
         temperature = config.temperature if config and config.temperature else 0.7
         
-        enhanced_prompt = f"""You are a traffic and urban planning expert for Pakistan. Help with the following query: {user_message}
-
-Consider Pakistani context including:
-- Local traffic patterns and peak hours (7-9 AM, 5-8 PM)
-- Public transport systems (Metro Bus, Orange Line, BRT)
-- Weather impacts (monsoon season July-Sept, fog Dec-Feb)
-- Cultural and religious events affecting traffic (Friday prayers, Ramadan, Eid)
-- Infrastructure challenges and ongoing development projects
-- Major cities: Karachi, Lahore, Islamabad, Rawalpindi, Faisalabad, Peshawar
-- Highway systems: Motorways (M-1, M-2, M-3), GT Road, National Highways
-
-Provide practical, actionable advice specific to Pakistani traffic conditions.
-"""
+        # Static framing first, then live conditions from the cache, then the query
+        context = await prompt_context.build(user_message)
+        enhanced_prompt = "\n\n".join(
+            part for part in (SYSTEM_PREFIX, context, f"Help with the following query: {user_message}") if part
+        )
         
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
+        # The key goes in a header: httpx logs request URLs at INFO
+        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
         
         payload = {
             "contents": [
@@ -98,11 +256,13 @@ Provide practical, actionable advice specific to Pakistani traffic conditions.
         }
         
         headers = {
-            "Content-Type": "application/json"
+            "Content-Type": "application/json",
+            "x-goog-api-key": api_key
         }
         
         try:
-            response = requests.post(url, headers=headers, json=payload, timeout=self.timeout)
+            async with httpx.AsyncClient(timeout=self.timeout) as client:
+                response = await client.post(url, headers=headers, json=payload)
             
             if response.status_code == 400:
                 error_detail = response.json()
@@ -126,9 +286,9 @@ Provide practical, actionable advice specific to Pakistani traffic conditions.
             else:
                 return "❌ No response generated. The content might have been blocked by safety filters."
                 
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
             return "❌ Request timed out. Please try again."
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             return f"❌ Connection Error: {str(e)}"
         except json.JSONDecodeError:
             return "❌ Invalid response format from Gemini API"
@@ -146,9 +306,11 @@ Provide practical, actionable advice specific to Pakistani traffic conditions.
         temperature = config.temperature if config and config.temperature else 0.7
         max_tokens = config.max_tokens if config and config.max_tokens else 1000
         
-        enhanced_prompt = f"""As a traffic and urban planning expert for Pakistan, help with: {user_message}
-        
-Consider Pakistani context including major cities, traffic patterns, public transport, and cultural factors."""
+        context = await prompt_context.build(user_message)
+        messages = [{"role": "system", "content": SYSTEM_PREFIX}]
+        if context:
+            messages.append({"role": "system", "content": context})
+        messages.append({"role": "user", "content": user_message})
         
         headers = {
             "Authorization": f"Bearer {api_key}",
@@ -157,18 +319,18 @@ Consider Pakistani context including major cities, traffic patterns, public tran
         
         payload = {
             "model": "gpt-3.5-turbo",
-            "messages": [{"role": "user", "content": enhanced_prompt}],
+            "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens
         }
         
         try:
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=self.timeout
-            )
+            async with httpx.AsyncClient(timeout=self.timeout) as client:
+                response = await client.post(
+                    "https://api.openai.com/v1/chat/completions",
+                    headers=headers,
+                    json=payload
+                )
             response.raise_for_status()
             return response.json()["choices"][0]["message"]["content"]
         except Exception as e:
@@ -276,4 +438,7 @@ This would typically use:
 - Ramadan timings change traffic patterns
 - Wedding seasons (winter) increase congestion
 
-How can I help you with specific route or traffic planning?"""
\ No newline at end of file
+How can I help you with specific route or traffic planning?"""
+
+# Initialize service
+ai_service = AIService()
@@ -0,0 +1,149 @@
+"""
+Online anomaly detection on city speed ratios and incident counts
+"""
+
+import logging
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from services.push_service import PushHub, push_hub
+from services.tomtom_service import tomtom_service
+
+logger = logging.getLogger(__name__)
+
+class Baseline:
+    """Exponentially weighted mean and variance of one series, decayed by elapsed time"""
+
+    __slots__ = ("mean", "var", "samples", "updated_at")
+
+    def __init__(self):
+        self.mean = 0.0
+        self.var = 0.0
+        self.samples = 0
+        self.updated_at = 0.0
+
+    def zscore(self, value: float, min_std: float) -> float:
+        return (value - self.mean) / max(math.sqrt(self.var), min_std)
+
+    def update(self, value: float, now: float, half_life: float):
+        if self.samples == 0:
+            self.mean = value
+        else:
+            # Refreshes are irregular, so weight by time since the last one rather than per sample;
+            # early on, a plain running mean keeps the first value from dominating
+            alpha = max(1.0 - 0.5 ** (max(now - self.updated_at, 0.0) / half_life), 1.0 / (self.samples + 1))
+            diff = value - self.mean
+            increment = alpha * diff
+            self.mean += increment
+            self.var = (1.0 - alpha) * (self.var + diff * increment)
+        self.samples += 1
+        self.updated_at = now
+
+# Metric -> (direction that is bad, smallest standard deviation used for z-scores)
+METRICS = {
+    "speed_ratio": (-1, float(os.getenv("ANOMALY_MIN_STD_SPEED_RATIO", 0.03))),
+    "incidents": (1, float(os.getenv("ANOMALY_MIN_STD_INCIDENTS", 1.0)))
+}
+
+class AnomalyDetector:
+    """Per-city baselines of speed ratio and incident count, checked as each refresh arrives.
+
+    A value is scored against the baseline from before it, then folded
+    in, so memory and work per refresh are constant. Once a baseline has
+    ``min_samples`` values, a score beyond ``threshold`` standard
+    deviations in the bad direction (slower traffic, more incidents)
+    marks the metric anomalous. Changes of state are broadcast on the
+    push channel.
+    """
+
+    def __init__(self, hub: PushHub, half_life_seconds: float, threshold: float, min_samples: int):
+        self.hub = hub
+        self.half_life = half_life_seconds
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self._baselines: Dict[str, Dict[str, Baseline]] = {}
+        # city -> metric -> latest {"value", "z", "anomalous"}
+        self._latest: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.anomalies_raised = 0
+        tomtom_service.on_refresh("flow", self._on_flow)
+        tomtom_service.on_refresh("incidents", self._on_incidents)
+
+    def _on_flow(self, city: str, data: Dict[str, Any]):
+        free_flow = data.get("free_flow_speed") or 0
+        if data.get("road_closure"):
+            self.observe(city, "speed_ratio", 0.0)
+        elif free_flow > 0:
+            self.observe(city, "speed_ratio", min(data.get("current_speed", 0) / free_flow, 1.0))
+
+    def _on_incidents(self, city: str, data: Dict[str, Any]):
+        self.observe(city, "incidents", float(data.get("total_incidents", len(data.get("incidents", [])))))
+
+    def observe(self, city: str, metric: str, value: float, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        direction, min_std = METRICS[metric]
+        baseline = self._baselines.setdefault(city, {}).setdefault(metric, Baseline())
+        ready = baseline.samples >= self.min_samples
+        z = baseline.zscore(value, min_std) if ready else None
+        anomalous = ready and z * direction >= self.threshold
+        expected = baseline.mean
+        baseline.update(value, now, self.half_life)
+
+        latest = self._latest.setdefault(city, {})
+        was_anomalous = latest.get(metric, {}).get("anomalous", False)
+        latest[metric] = {"value": value, "z": z, "anomalous": anomalous}
+        if anomalous != was_anomalous:
+            if anomalous:
+                self.anomalies_raised += 1
+                logger.info(f"📈 {metric} anomaly in {city}: {value:.3g} vs baseline {expected:.3g} (z={z:.1f})")
+            self.hub.broadcast({
+                "type": "anomaly",
+                "city": city,
+                "metric": metric,
+                "active": anomalous,
+                "value": round(value, 3),
+                "baseline": round(expected, 3),
+                "z": round(z, 2) if z is not None else None,
+                "timestamp": now
+            })
+
+    def status(self, city: str) -> Optional[Dict[str, Any]]:
+        """Latest scores of a city's metrics, or None until both baselines have warmed up"""
+        latest = self._latest.get(city.lower(), {})
+        baselines = self._baselines.get(city.lower(), {})
+        if any(metric not in latest or latest[metric]["z"] is None for metric in METRICS):
+            return None
+        return {
+            metric: {
+                "value": round(latest[metric]["value"], 3),
+                "baseline": round(baselines[metric].mean, 3),
+                "std": round(math.sqrt(baselines[metric].var), 3),
+                "z": round(latest[metric]["z"], 2),
+                "anomalous": latest[metric]["anomalous"]
+            }
+            for metric in METRICS
+        }
+
+    def active(self) -> List[Dict[str, Any]]:
+        return [
+            {"city": city, "metric": metric, "value": round(state["value"], 3), "z": round(state["z"], 2)}
+            for city, metrics in self._latest.items()
+            for metric, state in metrics.items()
+            if state["anomalous"]
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cities": len(self._baselines),
+            "active": len(self.active()),
+            "anomalies_raised": self.anomalies_raised
+        }
+
+# Initialize service (per worker process; fed by every refresh this worker sees)
+anomaly_detector = AnomalyDetector(
+    push_hub,
+    half_life_seconds=float(os.getenv("ANOMALY_HALF_LIFE_SECONDS", 6 * 3600)),
+    threshold=float(os.getenv("ANOMALY_Z_THRESHOLD", 3.0)),
+    min_samples=int(os.getenv("ANOMALY_MIN_SAMPLES", 12))
+)
@@ -0,0 +1,245 @@
+"""
+Record and replay of upstream HTTP responses for offline load testing
+"""
+
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Query parameters that must never reach the archive or affect the key
+SECRET_PARAMS = {"key"}
+
+# Response headers needed to decode a replayed body
+KEPT_HEADERS = ("content-type", "content-encoding", "etag")
+
+def _query(request: httpx.Request) -> List[Tuple[str, str]]:
+    return sorted((name, value) for name, value in request.url.params.multi_items() if name not in SECRET_PARAMS)
+
+def request_key(request: httpx.Request) -> str:
+    """Stable key for a request, ignoring the API key"""
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.url.path.encode())
+    for name, value in _query(request):
+        digest.update(f"\0{name}={value}".encode())
+    return digest.hexdigest()[:32]
+
+def path_key(request: httpx.Request) -> str:
+    """Looser key on method and path only, used when replay has no exact match"""
+    return hashlib.sha256(f"{request.method} {request.url.path}".encode()).hexdigest()[:32]
+
+class CaptureArchive:
+    """Zip archive of recorded responses.
+
+    Each response is one deflated entry named ``<request key>/<sequence>``
+    holding the raw body; its metadata (status, headers, latency, request
+    path and query without the API key) is the entry's zip comment. The zip
+    central directory is therefore the index. Records are buffered and
+    appended in batches so the directory is not rewritten per response.
+    """
+
+    def __init__(self, path: str, flush_every: int = 100, flush_seconds: float = 5.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self._buffer: List[Tuple[str, Dict[str, Any], bytes]] = []
+        self._sequence = 0
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, request: httpx.Request, status: int, headers: httpx.Headers, body: bytes, latency: float):
+        meta = {
+            "method": request.method,
+            "path": request.url.path,
+            "query": _query(request),
+            "status": status,
+            "headers": {name: headers[name] for name in KEPT_HEADERS if name in headers},
+            "latency_ms": round(latency * 1000, 1),
+            "at": time.time(),
+            "path_key": path_key(request)
+        }
+        self._sequence += 1
+        self._buffer.append((f"{request_key(request)}/{self._sequence:08d}", meta, body))
+        if len(self._buffer) >= self.flush_every or time.monotonic() - self._flushed_at >= self.flush_seconds:
+            records, self._buffer = self._buffer, []
+            self._flushed_at = time.monotonic()
+            try:
+                asyncio.get_running_loop().run_in_executor(None, self._write, records)
+            except RuntimeError:
+                self._write(records)
+
+    def flush(self):
+        """Write buffered records now (called on shutdown)"""
+        records, self._buffer = self._buffer, []
+        if records:
+            self._write(records)
+
+    def _write(self, records: List[Tuple[str, Dict[str, Any], bytes]]):
+        with self._lock:
+            with zipfile.ZipFile(self.path, "a", compression=zipfile.ZIP_DEFLATED) as archive:
+                for name, meta, body in records:
+                    info = zipfile.ZipInfo(name, date_time=time.localtime(meta["at"])[:6])
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    info.comment = json.dumps(meta, separators=(",", ":")).encode()
+                    archive.writestr(info, body)
+        logger.info(f"📼 Captured {len(records)} upstream responses to {self.path}")
+
+class _RecordingStream(httpx.AsyncByteStream):
+    """Passes the body through unchanged and records it once it has been read"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_complete):
+        self._stream = stream
+        self._on_complete = on_complete
+        self._chunks: List[bytes] = []
+        self._recorded = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._chunks.append(chunk)
+            yield chunk
+        self._finish()
+
+    async def aclose(self):
+        # Consumers that stop early (e.g. the incident stream parser) still get recorded
+        self._finish()
+        await self._stream.aclose()
+
+    def _finish(self):
+        if not self._recorded:
+            self._recorded = True
+            self._on_complete(b"".join(self._chunks))
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """Sends requests upstream and records every response into an archive"""
+
+    def __init__(self, archive: CaptureArchive):
+        self.archive = archive
+        self._inner = httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.monotonic()
+        response = await self._inner.handle_async_request(request)
+
+        def on_complete(body: bytes):
+            self.archive.record(request, response.status_code, response.headers, body, time.monotonic() - started)
+
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_RecordingStream(response.stream, on_complete),
+            extensions=response.extensions
+        )
+
+    async def aclose(self):
+        await self._inner.aclose()
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """Serves recorded responses instead of calling upstream.
+
+    Responses recorded for the same request are served in recorded order,
+    wrapping around, so replay shows the same changes over time as the
+    capture. Each response is delayed by its recorded latency times
+    ``latency_scale`` (0 serves immediately). Requests with no exact match
+    fall back to any response for the same path (e.g. a different
+    ``departAt``), then to a 404.
+    """
+
+    def __init__(self, paths: List[str], latency_scale: float = 1.0):
+        self.latency_scale = latency_scale
+        self._archives = [zipfile.ZipFile(path) for path in paths]
+        self._by_key: Dict[str, List[Tuple[zipfile.ZipFile, zipfile.ZipInfo, Dict[str, Any]]]] = {}
+        self._by_path: Dict[str, List[Tuple[zipfile.ZipFile, zipfile.ZipInfo, Dict[str, Any]]]] = {}
+        for archive in self._archives:
+            for info in archive.infolist():
+                meta = json.loads(info.comment)
+                entry = (archive, info, meta)
+                self._by_key.setdefault(info.filename.split("/")[0], []).append(entry)
+                self._by_path.setdefault(meta["path_key"], []).append(entry)
+        for entries in list(self._by_key.values()) + list(self._by_path.values()):
+            entries.sort(key=lambda entry: entry[2]["at"])
+        self._cursors: Dict[str, int] = {}
+        logger.info(f"📼 Replaying {sum(len(entries) for entries in self._by_key.values())} responses from {len(paths)} archive(s)")
+
+    def _next(self, index: Dict[str, list], key: str):
+        entries = index.get(key)
+        if not entries:
+            return None
+        cursor = self._cursors.get(key, 0)
+        self._cursors[key] = cursor + 1
+        return entries[cursor % len(entries)]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        entry = self._next(self._by_key, request_key(request)) or self._next(self._by_path, path_key(request))
+        if entry is None:
+            return httpx.Response(404, json={"error": "Request not in capture archive"})
+        archive, info, meta = entry
+        if self.latency_scale > 0:
+            await asyncio.sleep(meta["latency_ms"] / 1000 * self.latency_scale)
+        return httpx.Response(meta["status"], headers=meta["headers"], content=archive.read(info))
+
+    async def aclose(self):
+        # Shared by every client; archives stay open for the life of the process
+        pass
+
+class Capture:
+    """Capture configuration: hands out transports for the selected mode.
+
+    Archives are opened on first use in each process, not when the
+    configuration is read: under a preloading server that happens in the
+    master before fork, where ``{pid}`` would name the master and every
+    worker would share one archive file and its zip read offsets.
+    """
+
+    def __init__(self, mode: str, path: str, latency_scale: float):
+        self.mode = mode
+        self.path = path
+        self.latency_scale = latency_scale
+        if mode == "replay" and not glob.glob(path.replace("{pid}", "*")):
+            raise ValueError(f"No capture archive found at {path}")
+        self._pid = None
+        self._archive: Optional[CaptureArchive] = None
+        self._replay: Optional[ReplayTransport] = None
+
+    def _open(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        if self.mode == "record":
+            # One archive per worker process; replay reads them all
+            self._archive = CaptureArchive(self.path.replace("{pid}", str(os.getpid())))
+        elif self.mode == "replay":
+            self._replay = ReplayTransport(sorted(glob.glob(self.path.replace("{pid}", "*"))), self.latency_scale)
+
+    def transport(self) -> Optional[httpx.AsyncBaseTransport]:
+        """Transport for a new client, or None for a normal upstream connection"""
+        if self.mode == "off":
+            return None
+        self._open()
+        if self.mode == "record":
+            return RecordingTransport(self._archive)
+        return self._replay
+
+    def flush(self):
+        # Only this process's own archive; one inherited from before fork belongs to the parent
+        if self.mode == "record" and self._pid == os.getpid():
+            self._archive.flush()
+
+def capture_from_env() -> Capture:
+    """TOMTOM_CAPTURE_MODE is off (default), record or replay"""
+    mode = os.getenv("TOMTOM_CAPTURE_MODE", "off").lower()
+    if mode not in ("off", "record", "replay"):
+        raise ValueError(f"Unknown TOMTOM_CAPTURE_MODE: {mode}")
+    path = os.getenv("TOMTOM_CAPTURE_FILE", os.path.join(tempfile.gettempdir(), "tomtom_capture-{pid}.zip"))
+    return Capture(mode, path, float(os.getenv("TOMTOM_REPLAY_LATENCY_SCALE", 1.0)))
@@ -0,0 +1,132 @@
+"""
+Supported cities and nearest-city lookup for arbitrary coordinates
+"""
+
+import math
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Canonical positions are the points TomTom flow is sampled at.
+# Population (2017 census, city proper) weights national aggregates.
+CITIES = [
+    {"name": "Karachi", "lat": 24.8607, "lon": 67.0011, "zoom": 11, "population": 14910352},
+    {"name": "Lahore", "lat": 31.5204, "lon": 74.3587, "zoom": 11, "population": 11126285},
+    {"name": "Islamabad", "lat": 33.6844, "lon": 73.0479, "zoom": 11, "population": 1014825},
+    {"name": "Rawalpindi", "lat": 33.5651, "lon": 73.0169, "zoom": 12, "population": 2098231},
+    {"name": "Faisalabad", "lat": 31.4504, "lon": 73.1350, "zoom": 11, "population": 3204726},
+    {"name": "Multan", "lat": 30.1575, "lon": 71.5249, "zoom": 11, "population": 1871843},
+    {"name": "Peshawar", "lat": 34.0151, "lon": 71.5249, "zoom": 11, "population": 1970042},
+    {"name": "Quetta", "lat": 30.1798, "lon": 66.9750, "zoom": 11, "population": 1001205},
+    {"name": "Sialkot", "lat": 32.4945, "lon": 74.5229, "zoom": 12, "population": 655852},
+    {"name": "Gujranwala", "lat": 32.1877, "lon": 74.1945, "zoom": 12, "population": 2027001},
+    {"name": "Hyderabad", "lat": 25.3960, "lon": 68.3578, "zoom": 11, "population": 1732693},
+    {"name": "Bahawalpur", "lat": 29.4000, "lon": 71.6833, "zoom": 11, "population": 762111},
+    {"name": "Sargodha", "lat": 32.0836, "lon": 72.6711, "zoom": 11, "population": 659862},
+    {"name": "Sukkur", "lat": 27.7058, "lon": 68.8574, "zoom": 11, "population": 499900},
+    {"name": "Larkana", "lat": 27.5590, "lon": 68.2120, "zoom": 11, "population": 490508}
+]
+
+def unit_vector(lat: float, lon: float) -> Tuple[float, float, float]:
+    """Point on the unit sphere; straight-line distance between these orders points like great-circle distance"""
+    phi, lam = math.radians(lat), math.radians(lon)
+    cos_phi = math.cos(phi)
+    return (cos_phi * math.cos(lam), cos_phi * math.sin(lam), math.sin(phi))
+
+def chord_to_km(chord: float) -> float:
+    """Great-circle distance for a chord between two unit-sphere points"""
+    return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1.0))
+
+def km_to_chord(km: float) -> float:
+    return 2 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2)
+
+class KDTree:
+    """Static 3-d tree over unit-sphere vectors with O(log n) nearest-neighbour queries"""
+
+    def __init__(self, points: Sequence[Tuple[float, float, float]]):
+        self.points = list(points)
+        # Node arrays; a node is the index of its point, -1 marks a missing child
+        self._axis: List[int] = [0] * len(self.points)
+        self._left: List[int] = [-1] * len(self.points)
+        self._right: List[int] = [-1] * len(self.points)
+        self._root = self._build(list(range(len(self.points))))
+
+    def _build(self, indices: List[int]) -> int:
+        if not indices:
+            return -1
+        # Split on the widest axis at the median point
+        spreads = [
+            max(self.points[i][axis] for i in indices) - min(self.points[i][axis] for i in indices)
+            for axis in range(3)
+        ]
+        axis = spreads.index(max(spreads))
+        indices.sort(key=lambda i: self.points[i][axis])
+        middle = len(indices) // 2
+        node = indices[middle]
+        self._axis[node] = axis
+        self._left[node] = self._build(indices[:middle])
+        self._right[node] = self._build(indices[middle + 1:])
+        return node
+
+    def nearest(self, point: Tuple[float, float, float], max_distance: float = math.inf) -> Tuple[int, float]:
+        """Index of and straight-line distance to the closest point, or (-1, inf) if none is within ``max_distance``"""
+        best_index = -1
+        best = max_distance * max_distance
+        stack = [(self._root, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            # The bound is the squared distance to the splitting plane seen on the way down
+            if node < 0 or bound >= best:
+                continue
+            x, y, z = self.points[node]
+            distance = (point[0] - x) ** 2 + (point[1] - y) ** 2 + (point[2] - z) ** 2
+            if distance < best:
+                best_index, best = node, distance
+            axis = self._axis[node]
+            diff = point[axis] - self.points[node][axis]
+            near, far = (self._left[node], self._right[node]) if diff < 0 else (self._right[node], self._left[node])
+            stack.append((far, diff * diff))
+            stack.append((near, 0.0))
+        return best_index, math.sqrt(best) if best_index >= 0 else math.inf
+
+class CityRegistry:
+    """Single source of supported cities, by name and by position"""
+
+    def __init__(self, cities: Iterable[Dict[str, Any]]):
+        self.cities = tuple(cities)
+        self._by_name = {city["name"].casefold(): city for city in self.cities}
+        self._tree = KDTree([unit_vector(city["lat"], city["lon"]) for city in self.cities])
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """City by case-insensitive name, or None"""
+        return self._by_name.get(name.casefold())
+
+    def position(self, name: str) -> Dict[str, float]:
+        """``{"lat", "lon"}`` of a supported city"""
+        city = self._by_name[name.casefold()]
+        return {"lat": city["lat"], "lon": city["lon"]}
+
+    def names(self) -> List[str]:
+        return [city["name"] for city in self.cities]
+
+    def coordinates(self) -> Dict[str, Dict[str, Any]]:
+        """Lower-cased name to ``{"lat", "lon", "zoom"}``, the shape TomTomService looks cities up in"""
+        return {
+            city["name"].lower(): {"lat": city["lat"], "lon": city["lon"], "zoom": city["zoom"]}
+            for city in self.cities
+        }
+
+    def nearest(self, lat: float, lon: float, max_distance_km: Optional[float] = None) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Closest city to a point and its great-circle distance in km, or None if none is within ``max_distance_km``"""
+        max_chord = km_to_chord(max_distance_km) if max_distance_km is not None else math.inf
+        index, chord = self._tree.nearest(unit_vector(lat, lon), max_chord)
+        if index < 0:
+            return None
+        return self.cities[index], chord_to_km(chord)
+
+    def nearest_many(self, points: Iterable[Tuple[float, float]], max_distance_km: Optional[float] = None) -> List[Optional[Tuple[Dict[str, Any], float]]]:
+        """``nearest`` for every (lat, lon) point"""
+        return [self.nearest(lat, lon, max_distance_km) for lat, lon in points]
+
+# Initialize registry
+city_registry = CityRegistry(CITIES)
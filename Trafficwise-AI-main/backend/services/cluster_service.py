@@ -0,0 +1,127 @@
+"""
+Zoom-aware grid clustering of traffic incidents for map rendering
+"""
+
+import math
+import os
+from typing import Any, Dict, List, Tuple
+
+from services.tomtom_service import tomtom_service
+
+SEVERITY_RANK = {"info": 0, "minor": 1, "moderate": 2, "major": 3}
+
+def world_pixel(lat: float, lon: float, zoom: int) -> Tuple[float, float]:
+    """Web Mercator pixel coordinates of a point at a zoom level (256 px tiles)"""
+    scale = 256 * 2 ** zoom
+    lat_rad = math.radians(max(min(lat, 85.0511), -85.0511))
+    x = (lon + 180.0) / 360.0 * scale
+    y = (1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * scale
+    return x, y
+
+class IncidentClusterIndex:
+    """Hierarchical grid clusters of incidents, precomputed for every zoom level.
+
+    Each level is a grid of ``cell_px`` screen pixels. Because a cell at
+    zoom ``z - 1`` covers exactly four cells at zoom ``z``, coarser levels are
+    built by merging the finer one (cell index >> 1) instead of re-scanning
+    incidents. A query touches at most the cells visible in the viewport, so
+    its cost and payload do not grow with the number of incidents.
+    """
+
+    def __init__(self, max_zoom: int = 16, cell_px: int = 64):
+        self.max_zoom = max_zoom
+        self.cell_px = cell_px
+        self._incidents_by_city: Dict[str, List[Dict[str, Any]]] = {}
+        self._levels: List[Dict[Tuple[int, int], Dict[str, Any]]] = [{} for _ in range(max_zoom + 1)]
+
+    def update_city(self, city: str, data: Dict[str, Any]):
+        """Replace a city's incidents and rebuild the cluster levels"""
+        self._incidents_by_city[city] = data.get("incidents", [])
+        self._rebuild()
+
+    def _rebuild(self):
+        finest: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        for incidents in self._incidents_by_city.values():
+            for incident in incidents:
+                lat = incident["coordinates"]["lat"]
+                lon = incident["coordinates"]["lon"]
+                x, y = world_pixel(lat, lon, self.max_zoom)
+                cell = (int(x // self.cell_px), int(y // self.cell_px))
+                cluster = finest.get(cell)
+                if cluster is None:
+                    finest[cell] = {
+                        "count": 1,
+                        "lat_sum": lat,
+                        "lon_sum": lon,
+                        "severity": incident["severity"],
+                        "incident": incident
+                    }
+                else:
+                    self._merge(cluster, 1, lat, lon, incident["severity"])
+
+        levels = [None] * (self.max_zoom + 1)
+        levels[self.max_zoom] = finest
+        for zoom in range(self.max_zoom - 1, -1, -1):
+            coarser: Dict[Tuple[int, int], Dict[str, Any]] = {}
+            for (x, y), child in levels[zoom + 1].items():
+                parent_cell = (x >> 1, y >> 1)
+                parent = coarser.get(parent_cell)
+                if parent is None:
+                    coarser[parent_cell] = dict(child)
+                else:
+                    self._merge(parent, child["count"], child["lat_sum"], child["lon_sum"], child["severity"])
+            levels[zoom] = coarser
+        self._levels = levels
+
+    @staticmethod
+    def _merge(cluster: Dict[str, Any], count: int, lat_sum: float, lon_sum: float, severity: str):
+        cluster["count"] += count
+        cluster["lat_sum"] += lat_sum
+        cluster["lon_sum"] += lon_sum
+        cluster["incident"] = None
+        if SEVERITY_RANK.get(severity, 0) > SEVERITY_RANK.get(cluster["severity"], 0):
+            cluster["severity"] = severity
+
+    def query(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float, zoom: int) -> List[Dict[str, Any]]:
+        """Clusters whose cell intersects the bounding box at a zoom level"""
+        zoom = min(max(zoom, 0), self.max_zoom)
+        level = self._levels[zoom]
+
+        min_x, min_y = world_pixel(max_lat, min_lon, zoom)
+        max_x, max_y = world_pixel(min_lat, max_lon, zoom)
+        x_range = range(int(min_x // self.cell_px), int(max_x // self.cell_px) + 1)
+        y_range = range(int(min_y // self.cell_px), int(max_y // self.cell_px) + 1)
+
+        # Probe the visible cells, unless the level has fewer clusters than that
+        if len(x_range) * len(y_range) <= len(level):
+            cells = (
+                ((x, y), level[(x, y)])
+                for x in x_range for y in y_range
+                if (x, y) in level
+            )
+        else:
+            cells = (
+                (cell, cluster) for cell, cluster in level.items()
+                if cell[0] in x_range and cell[1] in y_range
+            )
+
+        clusters = []
+        for (x, y), cluster in cells:
+            entry = {
+                "cell": [zoom, x, y],
+                "count": cluster["count"],
+                "lat": round(cluster["lat_sum"] / cluster["count"], 6),
+                "lon": round(cluster["lon_sum"] / cluster["count"], 6),
+                "severity": cluster["severity"]
+            }
+            if cluster["incident"] is not None:
+                entry["incident"] = cluster["incident"]
+            clusters.append(entry)
+        return clusters
+
+# Initialize service
+incident_clusters = IncidentClusterIndex(
+    max_zoom=int(os.getenv("CLUSTER_MAX_ZOOM", 16)),
+    cell_px=int(os.getenv("CLUSTER_CELL_PX", 64))
+)
+tomtom_service.on_refresh("incidents", incident_clusters.update_city)
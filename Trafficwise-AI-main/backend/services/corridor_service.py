@@ -0,0 +1,191 @@
+"""
+Highway corridor monitoring from flow sampled along each highway
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from models.traffic_models import TrafficLevel
+from services.rate_limit import TokenBucket
+from services.tomtom_service import tomtom_service
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+def sample_polyline(waypoints: List[Dict[str, float]], spacing_km: float) -> List[Tuple[float, float, float]]:
+    """Points every ``spacing_km`` along a waypoint line, as (lat, lon, km from start)"""
+    samples = [(waypoints[0]["lat"], waypoints[0]["lon"], 0.0)]
+    travelled = 0.0
+    next_at = spacing_km
+    for start, end in zip(waypoints, waypoints[1:]):
+        length = haversine_km(start["lat"], start["lon"], end["lat"], end["lon"])
+        while length > 0 and next_at <= travelled + length:
+            fraction = (next_at - travelled) / length
+            samples.append((
+                start["lat"] + (end["lat"] - start["lat"]) * fraction,
+                start["lon"] + (end["lon"] - start["lon"]) * fraction,
+                next_at
+            ))
+            next_at += spacing_km
+        travelled += length
+
+    last = waypoints[-1]
+    if travelled - samples[-1][2] > spacing_km * 0.25:
+        samples.append((last["lat"], last["lon"], travelled))
+    return samples
+
+def traffic_level_for_ratio(speed_ratio: Optional[float]) -> Optional[TrafficLevel]:
+    """Map current/free-flow speed to a traffic level"""
+    if speed_ratio is None:
+        return None
+    if speed_ratio > 0.8:
+        return TrafficLevel.LIGHT
+    if speed_ratio > 0.5:
+        return TrafficLevel.MODERATE
+    if speed_ratio > 0.25:
+        return TrafficLevel.HEAVY
+    return TrafficLevel.VERY_HEAVY
+
+class CorridorMonitor:
+    """Samples flow along each highway and keeps per-segment snapshots in the shared cache"""
+
+    def __init__(self, highways: List[Dict[str, Any]]):
+        self.highways = {highway["route_code"]: highway for highway in highways}
+        self.spacing_km = float(os.getenv("CORRIDOR_SPACING_KM", 10))
+        self.interval = float(os.getenv("CORRIDOR_REFRESH_SECONDS", 900))
+        self.concurrency = int(os.getenv("CORRIDOR_CONCURRENCY", 8))
+        # Shared by every corridor so a refresh never exceeds the upstream budget
+        self.budget = TokenBucket(rate=float(os.getenv("CORRIDOR_CALLS_PER_SECOND", 5)))
+        self.samples = {
+            route_code: sample_polyline(highway["waypoints"], self.spacing_km)
+            for route_code, highway in self.highways.items()
+        }
+        self._lease: Optional[str] = None
+
+    def _key(self, route_code: str) -> str:
+        return f"corridor:{route_code}"
+
+    async def get_snapshot(self, route_code: str) -> Optional[Dict[str, Any]]:
+        """Latest corridor snapshot produced by the background refresh, if any"""
+        entry = await tomtom_service.cache.get(self._key(route_code))
+        return entry["result"]["data"] if entry else None
+
+    async def sample_corridor(self, route_code: str) -> Dict[str, Any]:
+        """Fetch flow for every sample point of a corridor and summarise it per segment"""
+        try:
+            samples = self.samples[route_code]
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def fetch(lat: float, lon: float) -> Dict[str, Any]:
+                async with semaphore:
+                    await self.budget.acquire()
+                    return await tomtom_service.get_point_flow(lat, lon)
+
+            results = await asyncio.gather(*(fetch(lat, lon) for lat, lon, _ in samples))
+            return {
+                "success": True,
+                "data": self._summarise(route_code, samples, results)
+            }
+        except Exception as e:
+            logger.error(f"Error sampling corridor {route_code}: {str(e)}")
+            return {
+                "success": False,
+                "error": "Internal server error",
+                "message": str(e)
+            }
+
+    def _summarise(self, route_code: str, samples: List[Tuple[float, float, float]], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        total_km = samples[-1][2]
+        segments = []
+        weighted_ratio = 0.0
+        measured_km = 0.0
+        delay_hours = 0.0
+
+        for index, ((lat, lon, km), result) in enumerate(zip(samples, results)):
+            # Each sample stands for the stretch halfway to its neighbours
+            from_km = (samples[index - 1][2] + km) / 2 if index > 0 else 0.0
+            to_km = (km + samples[index + 1][2]) / 2 if index + 1 < len(samples) else total_km
+            length_km = to_km - from_km
+
+            segment = {
+                "index": index,
+                "lat": round(lat, 5),
+                "lon": round(lon, 5),
+                "from_km": round(from_km, 1),
+                "to_km": round(to_km, 1),
+                "current_speed": None,
+                "free_flow_speed": None,
+                "speed_ratio": None,
+                "traffic_level": None,
+                "road_closure": False
+            }
+            if result.get("success"):
+                flow = result["data"]
+                current, free_flow = flow["current_speed"], flow["free_flow_speed"]
+                segment["current_speed"] = current
+                segment["free_flow_speed"] = free_flow
+                segment["road_closure"] = flow["road_closure"]
+                if free_flow > 0:
+                    ratio = 0.0 if flow["road_closure"] else min(current / free_flow, 1.0)
+                    segment["speed_ratio"] = round(ratio, 3)
+                    # Plain values: with the memory cache the snapshot is never round-tripped through JSON
+                    segment["traffic_level"] = traffic_level_for_ratio(ratio).value
+                    weighted_ratio += ratio * length_km
+                    measured_km += length_km
+                    if current > 0:
+                        delay_hours += length_km / current - length_km / free_flow
+            segments.append(segment)
+
+        speed_ratio = weighted_ratio / measured_km if measured_km else None
+        traffic_level = traffic_level_for_ratio(speed_ratio)
+        congested = [segment for segment in segments if segment["traffic_level"] in (TrafficLevel.HEAVY.value, TrafficLevel.VERY_HEAVY.value)]
+        measured = [segment for segment in segments if segment["speed_ratio"] is not None]
+        worst = min(measured, key=lambda segment: segment["speed_ratio"]) if measured else None
+
+        return {
+            "route_code": route_code,
+            "updated_at": time.time(),
+            "segments": segments,
+            "status": {
+                "traffic_level": traffic_level.value if traffic_level else None,
+                "speed_ratio": round(speed_ratio, 3) if speed_ratio is not None else None,
+                "coverage": round(measured_km / total_km, 3) if total_km else 0.0,
+                "congested_segments": len(congested),
+                "closed_segments": sum(1 for segment in segments if segment["road_closure"]),
+                "estimated_delay_minutes": round(delay_hours * 60, 1),
+                "worst_segment": worst["index"] if worst else None
+            }
+        }
+
+    async def refresh_loop(self):
+        """Re-sample every corridor before its snapshot expires; one worker at a time"""
+        while True:
+            try:
+                # Renewed each round, and held across the sleep, so the refresh stays in one worker
+                self._lease = await tomtom_service.cache.acquire("corridor-refresh", ttl=self.interval * 2, token=self._lease)
+                if self._lease is not None:
+                    for route_code in self.highways:
+                        result = await self.sample_corridor(route_code)
+                        if result["success"]:
+                            await tomtom_service.cache.set(
+                                self._key(route_code),
+                                {"fetched_at": time.time(), "result": result},
+                                self.interval * 2
+                            )
+                    logger.info(f"🛣️ Refreshed {len(self.highways)} highway corridors")
+            except Exception as e:
+                logger.error(f"Error refreshing highway corridors: {str(e)}")
+            await asyncio.sleep(self.interval)
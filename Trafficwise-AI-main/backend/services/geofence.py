@@ -0,0 +1,253 @@
+"""
+Area and route corridor subscriptions matched against incident refreshes
+"""
+
+import asyncio
+import itertools
+import logging
+import math
+import os
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from services.corridor_service import haversine_km
+from services.push_service import PushHub, push_hub
+from services.tomtom_service import tomtom_service
+
+logger = logging.getLogger(__name__)
+
+KM_PER_DEG_LAT = 110.574
+KM_PER_DEG_LON_EQUATOR = 111.320
+
+Cell = Tuple[int, int]
+
+class Subscription:
+    """A circle (``area``) or a buffered polyline (``corridor``) a user wants alerts for"""
+
+    def __init__(self, subscription_id: str, user_id: str, kind: str, points: List[Tuple[float, float]], radius_km: float, name: Optional[str] = None):
+        self.id = subscription_id
+        self.user_id = user_id
+        self.kind = kind
+        self.points = points
+        self.radius_km = radius_km
+        self.name = name
+        lats = [lat for lat, _ in points]
+        lons = [lon for _, lon in points]
+        pad_lat = radius_km / KM_PER_DEG_LAT
+        pad_lon = radius_km / (KM_PER_DEG_LON_EQUATOR * math.cos(math.radians(max(map(abs, lats)))))
+        # min_lon, min_lat, max_lon, max_lat
+        self.bbox = (min(lons) - pad_lon, min(lats) - pad_lat, max(lons) + pad_lon, max(lats) + pad_lat)
+
+    def distance_km(self, lat: float, lon: float) -> float:
+        """Distance from a point to the area centre or the nearest point of the corridor line"""
+        if len(self.points) == 1:
+            return haversine_km(lat, lon, *self.points[0])
+        # Segments are short enough for a local flat projection around the point
+        kx = KM_PER_DEG_LON_EQUATOR * math.cos(math.radians(lat))
+        best = math.inf
+        for (lat1, lon1), (lat2, lon2) in zip(self.points, self.points[1:]):
+            ax, ay = (lon1 - lon) * kx, (lat1 - lat) * KM_PER_DEG_LAT
+            bx, by = (lon2 - lon) * kx, (lat2 - lat) * KM_PER_DEG_LAT
+            dx, dy = bx - ax, by - ay
+            length2 = dx * dx + dy * dy
+            t = 0.0 if length2 == 0 else max(0.0, min(1.0, -(ax * dx + ay * dy) / length2))
+            best = min(best, math.hypot(ax + t * dx, ay + t * dy))
+        return best
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "type": self.kind,
+            "name": self.name,
+            "radius_km": self.radius_km,
+            "points": [[lat, lon] for lat, lon in self.points]
+        }
+
+class GridIndex:
+    """Uniform lat/lon grid from cell to the subscriptions that may cover it.
+
+    A subscription is registered in every cell within its radius of its
+    line, so a point lookup is one dict access plus an exact distance
+    check on the few candidates in that cell, however many subscriptions
+    there are elsewhere.
+    """
+
+    def __init__(self, cell_deg: float):
+        self.cell_deg = cell_deg
+        self._cells: Dict[Cell, Set[str]] = {}
+        self._cells_of: Dict[str, List[Cell]] = {}
+
+    def cell(self, lat: float, lon: float) -> Cell:
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def covered_cells(self, subscription: Subscription) -> Set[Cell]:
+        """Cells with any point within the subscription's radius of its line"""
+        # Sample the line at half a cell; a point near the line is then within radius + step / 2 of a sample
+        step_km = self.cell_deg * KM_PER_DEG_LAT / 2
+        samples = [subscription.points[0]]
+        for (lat1, lon1), (lat2, lon2) in zip(subscription.points, subscription.points[1:]):
+            steps = max(1, math.ceil(haversine_km(lat1, lon1, lat2, lon2) / step_km))
+            samples.extend(
+                (lat1 + (lat2 - lat1) * i / steps, lon1 + (lon2 - lon1) * i / steps)
+                for i in range(1, steps + 1)
+            )
+        reach_km = subscription.radius_km + (step_km / 2 if len(subscription.points) > 1 else 0.0)
+        cells = set()
+        for lat, lon in samples:
+            pad_lat = reach_km / KM_PER_DEG_LAT
+            pad_lon = reach_km / (KM_PER_DEG_LON_EQUATOR * math.cos(math.radians(lat)))
+            min_i, min_j = self.cell(lat - pad_lat, lon - pad_lon)
+            max_i, max_j = self.cell(lat + pad_lat, lon + pad_lon)
+            cells.update(itertools.product(range(min_i, max_i + 1), range(min_j, max_j + 1)))
+        return cells
+
+    def add(self, subscription: Subscription):
+        cells = list(self.covered_cells(subscription))
+        for cell in cells:
+            self._cells.setdefault(cell, set()).add(subscription.id)
+        self._cells_of[subscription.id] = cells
+
+    def remove(self, subscription_id: str):
+        for cell in self._cells_of.pop(subscription_id, []):
+            members = self._cells[cell]
+            members.discard(subscription_id)
+            if not members:
+                del self._cells[cell]
+
+    def candidates(self, lat: float, lon: float) -> Set[str]:
+        return self._cells.get(self.cell(lat, lon), set())
+
+    def __len__(self) -> int:
+        return len(self._cells)
+
+class GeofenceAlerts:
+    """Matches each city's new incidents against area and corridor subscriptions.
+
+    Runs as an incidents refresh listener, so matching happens once per
+    new cache entry in this worker. Only incidents that were not in the
+    city's previous refresh are matched, and each match is pushed to the
+    subscription's user through the push hub. Subscriptions live in the
+    worker that holds the user's connection; ``watch_loop`` keeps the
+    cities they cover refreshed there.
+    """
+
+    def __init__(self, hub: PushHub, cell_deg: float, max_per_user: int, poll_seconds: float):
+        self.hub = hub
+        self.max_per_user = max_per_user
+        self.poll_seconds = poll_seconds
+        self.index = GridIndex(cell_deg)
+        self._subscriptions: Dict[str, Subscription] = {}
+        self._by_user: Dict[str, Set[str]] = {}
+        self._cities_of: Dict[str, List[str]] = {}
+        self._incidents: Dict[str, List[Dict[str, Any]]] = {}
+        self._sequence = itertools.count(1)
+        self.alerts_sent = 0
+        tomtom_service.on_refresh("incidents", self._on_incidents)
+
+    def _covered_cities(self, subscription: Subscription) -> List[str]:
+        """Cities whose incident search box overlaps the subscription"""
+        min_lon, min_lat, max_lon, max_lat = subscription.bbox
+        cities = []
+        for city in tomtom_service.pakistan_cities:
+            c_min_lon, c_min_lat, c_max_lon, c_max_lat = tomtom_service.city_bbox(city)
+            if c_min_lon <= max_lon and min_lon <= c_max_lon and c_min_lat <= max_lat and min_lat <= c_max_lat:
+                cities.append(city)
+        return cities
+
+    def subscriptions(self, user_id: str) -> List[Dict[str, Any]]:
+        return [self._subscriptions[sid].to_dict() for sid in sorted(self._by_user.get(user_id, ()))]
+
+    async def subscribe(self, user_id: str, kind: str, points: List[Tuple[float, float]], radius_km: float, name: Optional[str] = None) -> Dict[str, Any]:
+        """Register a subscription and alert on incidents it already covers"""
+        if len(self._by_user.get(user_id, ())) >= self.max_per_user:
+            raise ValueError(f"At most {self.max_per_user} subscriptions per user")
+        subscription = Subscription(f"sub-{next(self._sequence)}", user_id, kind, points, radius_km, name)
+        cities = self._covered_cities(subscription)
+        if not cities:
+            raise ValueError("Subscription is outside every supported city's coverage")
+
+        self.index.add(subscription)
+        self._subscriptions[subscription.id] = subscription
+        self._by_user.setdefault(user_id, set()).add(subscription.id)
+        self._cities_of[subscription.id] = cities
+
+        for city in cities:
+            if city in self._incidents:
+                for incident in self._incidents[city]:
+                    self._check(subscription, city, incident)
+            else:
+                # First look at this city here; the listener matches everything, this subscription included
+                await tomtom_service.get_traffic_incidents(city)
+        return subscription.to_dict()
+
+    def unsubscribe(self, user_id: str, subscription_id: str) -> bool:
+        if subscription_id not in self._by_user.get(user_id, ()):
+            return False
+        self._by_user[user_id].discard(subscription_id)
+        if not self._by_user[user_id]:
+            del self._by_user[user_id]
+        self.index.remove(subscription_id)
+        del self._subscriptions[subscription_id]
+        del self._cities_of[subscription_id]
+        return True
+
+    def unsubscribe_user(self, user_id: str):
+        for subscription_id in list(self._by_user.get(user_id, ())):
+            self.unsubscribe(user_id, subscription_id)
+
+    def _check(self, subscription: Subscription, city: str, incident: Dict[str, Any]) -> bool:
+        position = incident.get("coordinates") or {}
+        if "lat" not in position:
+            return False
+        distance = subscription.distance_km(position["lat"], position["lon"])
+        if distance > subscription.radius_km:
+            return False
+        self.hub.publish(subscription.user_id, {
+            "type": "alert",
+            "subscription_id": subscription.id,
+            "name": subscription.name,
+            "city": city,
+            "distance_km": round(distance, 2),
+            "incident": incident
+        })
+        self.alerts_sent += 1
+        return True
+
+    def _on_incidents(self, city: str, data: Dict[str, Any]):
+        incidents = data.get("incidents", [])
+        previous = {incident["id"] for incident in self._incidents.get(city, [])}
+        self._incidents[city] = incidents
+        for incident in incidents:
+            if incident["id"] in previous:
+                continue
+            position = incident.get("coordinates") or {}
+            if "lat" not in position:
+                continue
+            for subscription_id in self.index.candidates(position["lat"], position["lon"]):
+                self._check(self._subscriptions[subscription_id], city, incident)
+
+    async def watch_loop(self):
+        """Keep the incidents of subscribed cities flowing into this worker"""
+        while True:
+            cities = {city for cities in self._cities_of.values() for city in cities}
+            try:
+                # Served from the shared cache when fresh, so this rarely reaches TomTom
+                await asyncio.gather(*(tomtom_service.get_traffic_incidents(city) for city in cities))
+            except Exception as e:
+                logger.error(f"Error refreshing incidents for subscriptions: {str(e)}")
+            await asyncio.sleep(self.poll_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscriptions": len(self._subscriptions),
+            "users": len(self._by_user),
+            "grid_cells": len(self.index),
+            "alerts_sent": self.alerts_sent
+        }
+
+# Initialize service (per worker process)
+geofence_alerts = GeofenceAlerts(
+    push_hub,
+    cell_deg=float(os.getenv("GEOFENCE_CELL_DEG", 0.05)),
+    max_per_user=int(os.getenv("GEOFENCE_MAX_PER_USER", 20)),
+    poll_seconds=float(os.getenv("GEOFENCE_POLL_SECONDS", 30))
+)
@@ -0,0 +1,134 @@
+"""
+Polyline encoding, simplification and polygon helpers for route and area geometry
+"""
+
+import math
+from typing import Iterable, List, Sequence, Set, Tuple
+
+EARTH_CIRCUMFERENCE_M = 40075016.686
+
+def encode_polyline(points: Iterable[Tuple[float, float]], precision: int = 5) -> str:
+    """Encode (lat, lon) points in the Google encoded polyline format"""
+    factor = 10 ** precision
+    output = []
+    previous_lat = previous_lon = 0
+    for lat, lon in points:
+        lat_int = int(round(lat * factor))
+        lon_int = int(round(lon * factor))
+        for delta in (lat_int - previous_lat, lon_int - previous_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                output.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            output.append(chr(value + 63))
+        previous_lat, previous_lon = lat_int, lon_int
+    return "".join(output)
+
+def decode_polyline(encoded: str, precision: int = 5) -> List[Tuple[float, float]]:
+    """Decode a Google encoded polyline into (lat, lon) points"""
+    factor = 10 ** precision
+    points = []
+    index = lat = lon = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1F) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        points.append((lat / factor, lon / factor))
+    return points
+
+def meters_per_pixel(zoom: int, lat: float) -> float:
+    """Ground resolution of a 256 px Web Mercator tile at a zoom level"""
+    return EARTH_CIRCUMFERENCE_M * math.cos(math.radians(lat)) / (256 * 2 ** zoom)
+
+def project(points: Sequence[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    """Project points to local planar metres (equirectangular around their mean latitude)"""
+    if not points:
+        return []
+    mean_lat = sum(lat for lat, _ in points) / len(points)
+    x_scale = 111320.0 * math.cos(math.radians(mean_lat))
+    return [(lon * x_scale, lat * 110540.0) for lat, lon in points]
+
+def _segment_distance(px: float, py: float, ax: float, ay: float, bx: float, by: float) -> float:
+    dx = bx - ax
+    dy = by - ay
+    if dx == 0 and dy == 0:
+        return math.hypot(px - ax, py - ay)
+    t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy)))
+    return math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+def simplify(projected: Sequence[Tuple[float, float]], tolerance_m: float, keep: Iterable[int] = ()) -> List[int]:
+    """Douglas-Peucker simplification returning the indices of kept points.
+
+    Indices in ``keep`` (e.g. traffic section boundaries) are always kept,
+    so data referring to them can be remapped onto the simplified line.
+    Iterative, so long routes cannot hit the recursion limit.
+    """
+    count = len(projected)
+    if count <= 2:
+        return list(range(count))
+
+    anchors: Set[int] = {0, count - 1}
+    anchors.update(index for index in keep if 0 <= index < count)
+    kept = set(anchors)
+
+    ordered = sorted(anchors)
+    stack = list(zip(ordered, ordered[1:]))
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        ax, ay = projected[start]
+        bx, by = projected[end]
+        max_distance = -1.0
+        max_index = start
+        for index in range(start + 1, end):
+            px, py = projected[index]
+            distance = _segment_distance(px, py, ax, ay, bx, by)
+            if distance > max_distance:
+                max_distance = distance
+                max_index = index
+        if max_distance > tolerance_m:
+            kept.add(max_index)
+            stack.append((start, max_index))
+            stack.append((max_index, end))
+
+    return sorted(kept)
+
+def convex_hull(points: Iterable[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    """Convex hull of (lat, lon) points, counter-clockwise in (lon, lat), without repeating the first point"""
+    unique = sorted(set((lon, lat) for lat, lon in points))
+    if len(unique) < 3:
+        return [(lat, lon) for lon, lat in unique]
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    # Andrew's monotone chain
+    lower, upper = [], []
+    for point in unique:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], point) <= 0:
+            lower.pop()
+        lower.append(point)
+    for point in reversed(unique):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], point) <= 0:
+            upper.pop()
+        upper.append(point)
+    return [(lat, lon) for lon, lat in lower[:-1] + upper[:-1]]
+
+def polygon_area_m2(ring: Sequence[Tuple[float, float]]) -> float:
+    """Area of a simple polygon of (lat, lon) points in square metres"""
+    projected = project(ring)
+    area = 0.0
+    for (x1, y1), (x2, y2) in zip(projected, projected[1:] + projected[:1]):
+        area += x1 * y2 - x2 * y1
+    return abs(area) / 2
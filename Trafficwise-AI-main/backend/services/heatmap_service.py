@@ -0,0 +1,299 @@
+"""
+Congestion heatmaps per city from sampled road flow
+"""
+
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import struct
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.rate_limit import TokenBucket
+from services.tomtom_service import tomtom_service
+
+logger = logging.getLogger(__name__)
+
+# Speed ratio colour stops: jammed, slow, free flowing
+COLOR_STOPS = np.array([0.0, 0.5, 1.0])
+COLOR_RGB = np.array([[220, 38, 38], [234, 179, 8], [34, 197, 94]], dtype=np.float32)
+
+# Binary format: one byte per cell, speed ratio * 250, this value where there is no data
+NO_DATA = 255
+
+MEDIA_TYPES = {"png": "image/png", "bin": "application/octet-stream"}
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    """Minimal PNG (8-bit RGBA, no filtering) for an (height, width, 4) uint8 array"""
+    height, width, _ = rgba.shape
+
+    def chunk(kind: bytes, payload: bytes) -> bytes:
+        return struct.pack(">I", len(payload)) + kind + payload + struct.pack(">I", zlib.crc32(kind + payload) & 0xFFFFFFFF)
+
+    # Each scanline starts with filter type 0
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(height, width * 4)
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(raw.tobytes(), 9))
+        + chunk(b"IEND", b"")
+    )
+
+class CityHeatmap:
+    """Decaying mean speed ratio per cell over a city's box.
+
+    ``ratio_sum`` and ``weight`` decay together with a half-life, so a
+    cell's mean follows recent samples and its weight shows how much
+    recent data it has. Row 0 is the southern edge.
+    """
+
+    def __init__(self, bbox: Tuple[float, float, float, float], size: int):
+        self.bbox = bbox
+        self.size = size
+        self.ratio_sum = np.zeros((size, size), dtype=np.float32)
+        self.weight = np.zeros((size, size), dtype=np.float32)
+        self.samples = 0
+        self.updated_at = time.time()
+
+    def cell_centre(self, row: int, col: int) -> Tuple[float, float]:
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        return (
+            min_lat + (row + 0.5) * (max_lat - min_lat) / self.size,
+            min_lon + (col + 0.5) * (max_lon - min_lon) / self.size
+        )
+
+    def decay(self, now: float, half_life: float):
+        factor = np.float32(0.5 ** ((now - self.updated_at) / half_life))
+        self.ratio_sum *= factor
+        self.weight *= factor
+        self.updated_at = now
+
+    def add_line(self, points: List[Tuple[float, float]], ratio: float):
+        """Count a speed ratio once in every cell a road segment passes through"""
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        line = np.asarray(points, dtype=np.float64)
+        if len(line) > 1:
+            # Sample each leg at about half a cell so no crossed cell is skipped
+            step = min(max_lat - min_lat, max_lon - min_lon) / self.size / 2
+            legs = np.diff(line, axis=0)
+            counts = np.maximum(np.ceil(np.abs(legs).max(axis=1) / step), 1).astype(int)
+            fractions = np.concatenate([np.arange(count) / count for count in counts])
+            starts = np.repeat(line[:-1], counts, axis=0)
+            line = np.vstack([starts + np.repeat(legs, counts, axis=0) * fractions[:, None], line[-1:]])
+        rows = np.floor((line[:, 0] - min_lat) / (max_lat - min_lat) * self.size).astype(int)
+        cols = np.floor((line[:, 1] - min_lon) / (max_lon - min_lon) * self.size).astype(int)
+        inside = (rows >= 0) & (rows < self.size) & (cols >= 0) & (cols < self.size)
+        cells = np.unique(rows[inside] * self.size + cols[inside])
+        self.ratio_sum.flat[cells] += ratio
+        self.weight.flat[cells] += 1.0
+        self.samples += 1
+
+    def sparsest_cells(self, count: int, rng: np.random.Generator) -> List[Tuple[int, int]]:
+        """Cells with the least recent data, ties broken at random"""
+        jittered = self.weight.ravel() + rng.random(self.size * self.size) * 1e-3
+        chosen = np.argpartition(jittered, count)[:count]
+        return [(int(index // self.size), int(index % self.size)) for index in chosen]
+
+    def mean_ratio(self) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.weight > 0.05, self.ratio_sum / self.weight, np.nan)
+
+    def render(self) -> Dict[str, bytes]:
+        """PNG and binary encodings, north at the top"""
+        ratio = np.flipud(self.mean_ratio())
+        weight = np.flipud(self.weight)
+        missing = np.isnan(ratio)
+        clipped = np.clip(np.nan_to_num(ratio), 0.0, 1.0)
+
+        rgba = np.zeros((self.size, self.size, 4), dtype=np.uint8)
+        for channel in range(3):
+            rgba[..., channel] = np.interp(clipped, COLOR_STOPS, COLOR_RGB[:, channel]).astype(np.uint8)
+        # More recent samples draw more opaque
+        rgba[..., 3] = np.where(missing, 0, 80 + 140 * np.minimum(weight, 1.0)).astype(np.uint8)
+
+        binary = np.where(missing, NO_DATA, np.round(clipped * 250)).astype(np.uint8)
+        return {"png": encode_png(rgba), "bin": binary.tobytes()}
+
+    def to_state(self) -> Dict[str, Any]:
+        return {
+            "bbox": list(self.bbox),
+            "size": self.size,
+            "samples": self.samples,
+            "updated_at": self.updated_at,
+            "ratio_sum": base64.b64encode(self.ratio_sum.tobytes()).decode(),
+            "weight": base64.b64encode(self.weight.tobytes()).decode()
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "CityHeatmap":
+        heatmap = cls(tuple(state["bbox"]), state["size"])
+        shape = (state["size"], state["size"])
+        heatmap.ratio_sum = np.frombuffer(base64.b64decode(state["ratio_sum"]), dtype=np.float32).reshape(shape).copy()
+        heatmap.weight = np.frombuffer(base64.b64decode(state["weight"]), dtype=np.float32).reshape(shape).copy()
+        heatmap.samples = state["samples"]
+        heatmap.updated_at = state["updated_at"]
+        return heatmap
+
+class HeatmapService:
+    """Builds each city's heatmap in the background and serves the encoded images.
+
+    Each round samples the least-covered cells of every city: TomTom
+    returns flow for the road nearest each point along with the road's
+    shape, and the ratio is added to every cell the road crosses. City
+    flow refreshes seen by this worker are added at the city centre for
+    free. After a round the grids and their PNG and binary encodings go
+    to the shared cache, so any worker can serve them and whichever
+    worker holds the lease next carries on from the same state.
+    """
+
+    def __init__(self):
+        self.size = int(os.getenv("HEATMAP_GRID_SIZE", 64))
+        self.interval = float(os.getenv("HEATMAP_INTERVAL_SECONDS", 60))
+        self.samples_per_round = int(os.getenv("HEATMAP_SAMPLES_PER_ROUND", 8))
+        self.half_life = float(os.getenv("HEATMAP_HALF_LIFE_SECONDS", 1800))
+        self.concurrency = int(os.getenv("HEATMAP_CONCURRENCY", 4))
+        self.budget = TokenBucket(rate=float(os.getenv("HEATMAP_CALLS_PER_MINUTE", 60)) / 60)
+        self.ttl = float(os.getenv("HEATMAP_CACHE_TTL", 21600))
+        self._grids: Dict[str, CityHeatmap] = {}
+        self._lease: Optional[str] = None
+        self._rng = np.random.default_rng()
+        # Decoded images per (city, fmt), reused until the cached version changes
+        self._encoded: Dict[Tuple[str, str], Tuple[float, bytes, str]] = {}
+        tomtom_service.on_refresh("flow", self._observe_flow)
+
+    def _key(self, city: str) -> str:
+        return f"heatmap:{city}"
+
+    def _grid(self, city: str) -> CityHeatmap:
+        grid = self._grids.get(city)
+        if grid is None:
+            grid = self._grids[city] = CityHeatmap(tomtom_service.city_bbox(city), self.size)
+        return grid
+
+    @staticmethod
+    def _ratio(data: Dict[str, Any]) -> Optional[float]:
+        if data.get("road_closure"):
+            return 0.0
+        free_flow = data.get("free_flow_speed") or 0
+        if free_flow <= 0:
+            return None
+        return min(data.get("current_speed", 0) / free_flow, 1.0)
+
+    def _observe_flow(self, city: str, data: Dict[str, Any]):
+        ratio = self._ratio(data)
+        coords = data.get("coordinates") or tomtom_service.pakistan_cities.get(city)
+        if ratio is None or coords is None or city not in self._grids:
+            # Only the worker building heatmaps keeps grids
+            return
+        grid = self._grids[city]
+        grid.decay(time.time(), self.half_life)
+        grid.add_line([(coords["lat"], coords["lon"])], ratio)
+
+    async def sample_city(self, city: str) -> int:
+        """Sample the sparsest cells of a city and update its grid; returns the samples added"""
+        grid = self._grid(city)
+        points = [grid.cell_centre(row, col) for row, col in grid.sparsest_cells(self.samples_per_round, self._rng)]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(lat: float, lon: float) -> Dict[str, Any]:
+            async with semaphore:
+                await self.budget.acquire()
+                return await tomtom_service.get_point_flow(lat, lon, include_geometry=True)
+
+        results = await asyncio.gather(*(fetch(lat, lon) for lat, lon in points))
+        grid.decay(time.time(), self.half_life)
+        added = 0
+        for (lat, lon), result in zip(points, results):
+            if not result.get("success"):
+                continue
+            ratio = self._ratio(result["data"])
+            if ratio is None:
+                continue
+            grid.add_line(result["data"].get("segment") or [(lat, lon)], ratio)
+            added += 1
+        return added
+
+    async def publish(self, city: str):
+        grid = self._grids[city]
+        encoded = grid.render()
+        data = {
+            "city": city,
+            "state": grid.to_state(),
+            "etags": {fmt: f'"{hashlib.sha1(body).hexdigest()[:20]}"' for fmt, body in encoded.items()},
+            "images": {fmt: base64.b64encode(body).decode() for fmt, body in encoded.items()}
+        }
+        await tomtom_service.cache.set(self._key(city), {"fetched_at": time.time(), "result": {"success": True, "data": data}}, self.ttl)
+
+    async def run_once(self):
+        for city in tomtom_service.pakistan_cities:
+            if city not in self._grids:
+                # Carry on from the grid another worker last published
+                entry = await tomtom_service.cache.get(self._key(city))
+                if entry is not None:
+                    self._grids[city] = CityHeatmap.from_state(entry["result"]["data"]["state"])
+            try:
+                await self.sample_city(city)
+                await self.publish(city)
+            except Exception as e:
+                logger.warning(f"⚠️ Heatmap update failed for {city}: {str(e)}")
+
+    async def refresh_loop(self):
+        """Update the heatmaps in whichever worker holds the lease"""
+        try:
+            while True:
+                try:
+                    # A round is paced by the call budget; the lease covers a round and the sleep
+                    # after it and is renewed every round, so the leader keeps it
+                    round_seconds = len(tomtom_service.pakistan_cities) * self.samples_per_round / self.budget.rate
+                    lease = await tomtom_service.cache.acquire(
+                        "heatmap", ttl=round_seconds + 2 * self.interval + tomtom_service.timeout, token=self._lease
+                    )
+                    if lease is None or lease != self._lease:
+                        # Newly leader, or not leader: another worker may have published since our grids were built
+                        self._grids.clear()
+                    self._lease = lease
+                    if lease is not None:
+                        await self.run_once()
+                except Exception as e:
+                    logger.error(f"Error updating heatmaps: {str(e)}")
+                await asyncio.sleep(self.interval)
+        finally:
+            # Hand over straight away on shutdown rather than after the lease expires
+            if self._lease is not None:
+                try:
+                    await tomtom_service.cache.release("heatmap", self._lease)
+                except Exception as e:
+                    logger.warning(f"⚠️ Could not release heatmap lease: {str(e)}")
+                self._lease = None
+
+    async def get_heatmap(self, city: str, fmt: str) -> Dict[str, Any]:
+        """Latest encoded heatmap of a city as ``png`` or ``bin``"""
+        city = city.lower()
+        entry = await tomtom_service.cache.get(self._key(city))
+        if entry is None:
+            return {"success": False, "error": f"No heatmap for {city} yet"}
+        cached = self._encoded.get((city, fmt))
+        if cached is None or cached[0] != entry["fetched_at"]:
+            data = entry["result"]["data"]
+            cached = (entry["fetched_at"], base64.b64decode(data["images"][fmt]), data["etags"][fmt])
+            self._encoded[(city, fmt)] = cached
+        state = entry["result"]["data"]["state"]
+        return {
+            "success": True,
+            "body": cached[1],
+            "etag": cached[2],
+            "media_type": MEDIA_TYPES[fmt],
+            "size": state["size"],
+            "bbox": state["bbox"],
+            "updated_at": state["updated_at"]
+        }
+
+# Initialize service
+heatmap_service = HeatmapService()
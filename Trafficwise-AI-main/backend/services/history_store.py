@@ -0,0 +1,285 @@
+"""
+History of city flow and incident snapshots, with streaming exports
+"""
+
+import asyncio
+import csv
+import io
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from services.tomtom_service import tomtom_service
+
+logger = logging.getLogger(__name__)
+
+# Exported columns per metric after the timestamp and city, with their SQL types
+METRICS = {
+    "flow": [
+        ("current_speed", "REAL"),
+        ("free_flow_speed", "REAL"),
+        ("speed_ratio", "REAL"),
+        ("current_travel_time", "INTEGER"),
+        ("free_flow_travel_time", "INTEGER"),
+        ("confidence", "REAL"),
+        ("road_closure", "INTEGER"),
+        ("traffic_level", "TEXT")
+    ],
+    "incidents": [
+        ("total", "INTEGER"),
+        ("major", "INTEGER"),
+        ("moderate", "INTEGER"),
+        ("minor", "INTEGER"),
+        ("info", "INTEGER"),
+        ("total_delay_seconds", "INTEGER"),
+        ("total_length_meters", "INTEGER")
+    ]
+}
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet"
+}
+
+class _ByteSink:
+    """Write-only file object whose contents are taken out after every chunk"""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+class HistoryStore:
+    """Flow and incident snapshots per city in a SQLite file shared by every worker.
+
+    Each snapshot is written once, by the worker that fetched it. Exports
+    read the range in keyset-paginated chunks on the thread pool and
+    encode each chunk before reading the next, so memory stays constant
+    and the event loop is never blocked, however long the export. They
+    read through per-thread connections of their own, which WAL lets run
+    alongside the writer, so a long export never holds up recording.
+    """
+
+    def __init__(self, path: str, retention_days: float, chunk_rows: int):
+        self.path = path
+        self.retention = retention_days * 86400
+        self.chunk_rows = chunk_rows
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid = None
+        self._lock = threading.Lock()
+        self._readers = threading.local()
+        # Per metric, so each table is pruned however writes interleave
+        self._writes = {metric: 0 for metric in METRICS}
+        tomtom_service.on_fetch("flow", self.record_flow)
+        tomtom_service.on_fetch("incidents", self.record_incidents)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._conn_pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._create_tables(conn)
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def _create_tables(conn: sqlite3.Connection):
+        for metric, columns in METRICS.items():
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {metric} (ts REAL NOT NULL, city TEXT NOT NULL, "
+                + ", ".join(f"{name} {kind}" for name, kind in columns) + ")"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {metric}_ts ON {metric} (ts)")
+
+    def _locked(self, func, *args):
+        with self._lock:
+            return func(self._connection(), *args)
+
+    def _read_connection(self) -> sqlite3.Connection:
+        if getattr(self._readers, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            # Exports may run before this process has recorded anything
+            self._create_tables(conn)
+            self._readers.conn = conn
+            self._readers.pid = os.getpid()
+        return self._readers.conn
+
+    def _read(self, func, *args):
+        return func(self._read_connection(), *args)
+
+    def _insert(self, conn: sqlite3.Connection, metric: str, row: Tuple[Any, ...]):
+        conn.execute(f"INSERT INTO {metric} VALUES ({', '.join('?' * len(row))})", row)
+        # Old rows are only ever read by exports; prune them now and then
+        self._writes[metric] += 1
+        if self._writes[metric] % 1000 == 0:
+            conn.execute(f"DELETE FROM {metric} WHERE ts < ?", (time.time() - self.retention,))
+
+    def _write_now(self, metric: str, row: Tuple[Any, ...]):
+        try:
+            self._locked(self._insert, metric, row)
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Could not record {metric} history for {row[1]}: {str(e)}")
+
+    def _write(self, metric: str, row: Tuple[Any, ...]):
+        # Fire and forget on the thread pool so fetches never wait on the disk
+        try:
+            asyncio.get_running_loop().run_in_executor(None, self._write_now, metric, row)
+        except RuntimeError:
+            self._write_now(metric, row)
+
+    def record_flow(self, city: str, data: Dict[str, Any], fetched_at: float):
+        free_flow = data.get("free_flow_speed") or 0
+        ratio = min(data.get("current_speed", 0) / free_flow, 1.0) if free_flow > 0 else None
+        self._write("flow", (
+            fetched_at,
+            city,
+            data.get("current_speed"),
+            data.get("free_flow_speed"),
+            0.0 if data.get("road_closure") else ratio,
+            data.get("current_travel_time"),
+            data.get("free_flow_travel_time"),
+            data.get("confidence"),
+            int(bool(data.get("road_closure"))),
+            data.get("traffic_level")
+        ))
+
+    def record_incidents(self, city: str, data: Dict[str, Any], fetched_at: float):
+        incidents = data.get("incidents", [])
+        severities = {"major": 0, "moderate": 0, "minor": 0, "info": 0}
+        for incident in incidents:
+            severity = incident.get("severity", "info")
+            severities[severity] = severities.get(severity, 0) + 1
+        self._write("incidents", (
+            fetched_at,
+            city,
+            len(incidents),
+            severities["major"],
+            severities["moderate"],
+            severities["minor"],
+            severities["info"],
+            sum(incident.get("delay") or 0 for incident in incidents),
+            sum(incident.get("length") or 0 for incident in incidents)
+        ))
+
+    @staticmethod
+    def _read_chunk(conn: sqlite3.Connection, metric: str, cities: Sequence[str], start: float, end: float, after: Tuple[float, int], limit: int) -> List[tuple]:
+        city_filter = f"AND city IN ({', '.join('?' * len(cities))}) " if cities else ""
+        columns = ", ".join(name for name, _ in METRICS[metric])
+        return conn.execute(
+            f"SELECT ts, rowid, city, {columns} FROM {metric} "
+            f"WHERE ts >= ? AND ts < ? AND (ts, rowid) > (?, ?) {city_filter}"
+            "ORDER BY ts, rowid LIMIT ?",
+            (start, end, after[0], after[1], *cities, limit)
+        ).fetchall()
+
+    async def export(self, metric: str, cities: Sequence[str], start: float, end: float, fmt: str) -> AsyncIterator[bytes]:
+        """Rows of a metric for the cities (all if empty) with ``start <= ts < end``, encoded chunk by chunk"""
+        loop = asyncio.get_running_loop()
+        encoder = _encoder(metric, fmt)
+        after = (start, -1)
+        while True:
+            rows = await loop.run_in_executor(
+                None, self._read, self._read_chunk, metric, list(cities), start, end, after, self.chunk_rows
+            )
+            if rows:
+                after = (rows[-1][0], rows[-1][1])
+            chunk = await loop.run_in_executor(None, encoder, [row[:1] + row[2:] for row in rows], not rows or len(rows) < self.chunk_rows)
+            if chunk:
+                yield chunk
+            if len(rows) < self.chunk_rows:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        def count(conn: sqlite3.Connection):
+            return {
+                metric: dict(zip(("rows", "oldest", "newest"), conn.execute(f"SELECT COUNT(*), MIN(ts), MAX(ts) FROM {metric}").fetchone()))
+                for metric in METRICS
+            }
+        return self._read(count)
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat().replace("+00:00", "Z")
+
+def _encoder(metric: str, fmt: str):
+    """``encode(rows, last) -> bytes`` for one export; called once per chunk, in order"""
+    names = ["timestamp", "city"] + [name for name, _ in METRICS[metric]]
+
+    if fmt == "csv":
+        state = {"header": True}
+
+        def encode_csv(rows: List[tuple], last: bool) -> bytes:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            if state.pop("header", False):
+                writer.writerow(names)
+            writer.writerows((_iso(row[0]),) + tuple(row[1:]) for row in rows)
+            return buffer.getvalue().encode()
+        return encode_csv
+
+    # Arrow and Parquet need the optional pyarrow package
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {"REAL": pa.float64(), "INTEGER": pa.int64(), "TEXT": pa.string()}
+    schema = pa.schema(
+        [("timestamp", pa.timestamp("ms", tz="UTC")), ("city", pa.string())]
+        + [(name, types[kind]) for name, kind in METRICS[metric]]
+    )
+    sink = _ByteSink()
+    writer = pa.ipc.new_stream(sink, schema) if fmt == "arrow" else pq.ParquetWriter(sink, schema, compression="zstd")
+
+    def encode_columnar(rows: List[tuple], last: bool) -> bytes:
+        if rows:
+            columns = list(zip(*rows))
+            arrays = [pa.array([int(ts * 1000) for ts in columns[0]], type=pa.int64()).cast(schema.field(0).type)]
+            arrays += [pa.array(list(values), type=field.type) for values, field in zip(columns[1:], list(schema)[1:])]
+            batch = pa.RecordBatch.from_arrays(arrays, schema=schema)
+            if fmt == "arrow":
+                writer.write_batch(batch)
+            else:
+                writer.write_table(pa.Table.from_batches([batch]))
+        if last:
+            writer.close()
+        return sink.drain()
+    return encode_columnar
+
+def columnar_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+# Initialize store (writes come from fetch listeners in every worker)
+history_store = HistoryStore(
+    path=os.getenv("HISTORY_PATH", os.path.join(tempfile.gettempdir(), "trafficwise_history.sqlite3")),
+    retention_days=float(os.getenv("HISTORY_RETENTION_DAYS", 90)),
+    chunk_rows=int(os.getenv("HISTORY_EXPORT_CHUNK_ROWS", 5000))
+)
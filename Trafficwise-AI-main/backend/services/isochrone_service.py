@@ -0,0 +1,170 @@
+"""
+Reachability polygons ("where can I get to in N minutes") from live road speeds
+"""
+
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Sequence, Tuple
+
+from services.geofence import KM_PER_DEG_LAT, KM_PER_DEG_LON_EQUATOR
+from services.geometry import convex_hull, polygon_area_m2
+from services.road_graph import RoadGraph, destination_point, road_graph, DETOUR_FACTOR
+
+# Points on the local-streets disc around the origin
+DISC_POINTS = 16
+
+# Half-width of the band drawn along highway stretches
+HIGHWAY_BAND_KM = 1.0
+
+def corridor_band(start: Tuple[float, float], end: Tuple[float, float], half_width_km: float) -> List[Tuple[float, float]]:
+    """Rectangle of (lat, lon) points around a straight stretch"""
+    kx = KM_PER_DEG_LON_EQUATOR * math.cos(math.radians((start[0] + end[0]) / 2))
+    dx, dy = (end[1] - start[1]) * kx, (end[0] - start[0]) * KM_PER_DEG_LAT
+    length = math.hypot(dx, dy) or 1.0
+    # Unit normal in km, back to degrees
+    offset_lat, offset_lon = dx / length * half_width_km / KM_PER_DEG_LAT, -dy / length * half_width_km / kx
+    return [
+        (start[0] + offset_lat, start[1] + offset_lon),
+        (end[0] + offset_lat, end[1] + offset_lon),
+        (end[0] - offset_lat, end[1] - offset_lon),
+        (start[0] - offset_lat, start[1] - offset_lon)
+    ]
+
+class IsochroneService:
+    """Isochrones over the road graph, cached per origin cell and time bucket.
+
+    Origins are snapped to the centre of a ``cell_deg`` grid cell and
+    conditions are taken once per ``bucket_seconds``, so nearby requests
+    in the same few minutes share one result. The origin reaches graph
+    nodes within ``max_snap_km`` over local streets at
+    ``access_speed_kmh``; a bounded Dijkstra then runs to the largest
+    requested time. Each polygon is the convex hull of the nodes reached
+    in time and the points part-way along the edges leaving them where
+    time runs out, one hull per city area, plus a disc for local streets
+    around the origin and narrow bands along the highway stretches driven.
+    """
+
+    def __init__(self, graph: RoadGraph, cell_deg: float, bucket_seconds: float, cache_size: int, access_speed_kmh: float, max_snap_km: float):
+        self.graph = graph
+        self.cell_deg = cell_deg
+        self.bucket_seconds = bucket_seconds
+        self.cache_size = cache_size
+        self.access_speed_kmh = access_speed_kmh
+        self.max_snap_km = max_snap_km
+        self._cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+
+    def _cell_centre(self, lat: float, lon: float) -> Tuple[Tuple[int, int], float, float]:
+        cell = (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+        return cell, (cell[0] + 0.5) * self.cell_deg, (cell[1] + 0.5) * self.cell_deg
+
+    async def get_isochrone(self, lat: float, lon: float, minutes: Sequence[int]) -> Dict[str, Any]:
+        """GeoJSON multipolygons of the area reachable from a point within each number of minutes"""
+        minutes = sorted(set(minutes), reverse=True)
+        cell, origin_lat, origin_lon = self._cell_centre(lat, lon)
+        bucket = int(time.time() // self.bucket_seconds)
+        key = (cell, tuple(minutes), bucket)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            return cached
+
+        started = time.perf_counter()
+        access = self.graph.nodes_within(origin_lat, origin_lon, self.max_snap_km)
+        if not access:
+            return {
+                "success": False,
+                "error": "Origin is outside the road graph coverage",
+                "message": f"No road within {self.max_snap_km:g} km of {lat},{lon}"
+            }
+
+        factors, coverage = await self.graph.speed_factors()
+        edge_minutes = self.graph.edge_minutes(factors)
+        sources = [(node, distance * DETOUR_FACTOR / self.access_speed_kmh * 60) for node, distance in access]
+        reached = self.graph.shortest_times(sources, edge_minutes, minutes[0])
+
+        nearest_access = min(access, key=lambda item: item[1])[0]
+        home = self.graph.node_city[nearest_access] or "origin"
+        features = [
+            self._feature(origin_lat, origin_lon, limit, reached, edge_minutes, home)
+            for limit in minutes
+        ]
+        result = {
+            "success": True,
+            "data": {
+                "type": "FeatureCollection",
+                "origin": {"lat": round(origin_lat, 6), "lon": round(origin_lon, 6)},
+                "conditions_bucket_start": bucket * self.bucket_seconds,
+                "live_coverage": round(coverage, 3),
+                "computed_in_ms": round((time.perf_counter() - started) * 1000, 2),
+                "features": features
+            }
+        }
+        self._cache[key] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def _feature(self, lat: float, lon: float, limit: float, reached: Dict[int, float], edge_minutes: List[float], home: str) -> Dict[str, Any]:
+        graph = self.graph
+        # Hull points per city area; the origin and its local-streets disc join the area it starts in
+        areas: Dict[str, List[Tuple[float, float]]] = {home: [(lat, lon)]}
+        disc_km = min(limit / 60 * self.access_speed_kmh / DETOUR_FACTOR, self.max_snap_km)
+        areas[home].extend(destination_point(lat, lon, index * 360 / DISC_POINTS, disc_km) for index in range(DISC_POINTS))
+        # Highway stretches driven, as (start, end) points
+        stretches: Dict[Tuple[int, int], Tuple[Tuple[float, float], Tuple[float, float]]] = {}
+
+        cities = set()
+        for node, time_at in reached.items():
+            if time_at > limit:
+                continue
+            position = (graph.lat[node], graph.lon[node])
+            area = graph.node_city[node] or home
+            areas.setdefault(area, []).append(position)
+            if graph.names[node]:
+                cities.add(graph.names[node])
+            for edge in graph.adjacency[node]:
+                target = graph.edge_to[edge]
+                duration = edge_minutes[edge]
+                if time_at + duration <= limit:
+                    end = (graph.lat[target], graph.lon[target])
+                else:
+                    # Time runs out part-way along this edge
+                    fraction = (limit - time_at) / duration
+                    end = (position[0] + (graph.lat[target] - position[0]) * fraction, position[1] + (graph.lon[target] - position[1]) * fraction)
+                if graph.groups[graph.edge_group[edge]][0] == "highway":
+                    key = (min(node, target), max(node, target)) if end == (graph.lat[target], graph.lon[target]) else (node, -1 - edge)
+                    stretches[key] = (position, end)
+                else:
+                    areas[area].append(end)
+
+        # Areas around cities, plus narrow bands along highways, so a long motorway run
+        # does not stretch a city's hull across the countryside
+        polygons = [convex_hull(points) for points in areas.values()]
+        polygons.extend(corridor_band(start, end, HIGHWAY_BAND_KM) for start, end in stretches.values())
+        polygons = [polygon for polygon in polygons if len(polygon) >= 3]
+        coordinates = []
+        for polygon in polygons:
+            ring = [[round(point_lon, 5), round(point_lat, 5)] for point_lat, point_lon in polygon]
+            ring.append(ring[0])
+            coordinates.append([ring])
+        return {
+            "type": "Feature",
+            "properties": {
+                "minutes": limit,
+                "area_km2": round(sum(polygon_area_m2(polygon) for polygon in polygons) / 1e6, 1),
+                "reachable_cities": sorted(cities)
+            },
+            "geometry": {"type": "MultiPolygon", "coordinates": coordinates}
+        }
+
+# Initialize service
+isochrone_service = IsochroneService(
+    road_graph,
+    cell_deg=float(os.getenv("ISOCHRONE_CELL_DEG", 0.01)),
+    bucket_seconds=float(os.getenv("ISOCHRONE_BUCKET_SECONDS", 300)),
+    cache_size=int(os.getenv("ISOCHRONE_CACHE_SIZE", 512)),
+    access_speed_kmh=float(os.getenv("ISOCHRONE_ACCESS_SPEED_KMH", 25)),
+    max_snap_km=float(os.getenv("ISOCHRONE_MAX_SNAP_KM", 30))
+)
@@ -0,0 +1,113 @@
+"""
+Incremental parsing of large JSON responses
+"""
+
+import json
+import re
+from typing import Any, AsyncIterator, List
+
+# Outside strings only these bytes change the parser state
+_STRUCTURAL = re.compile(rb'["\[\]{}]')
+# Inside strings only the closing quote or an escape matters
+_STRING_SPECIAL = re.compile(rb'["\\]')
+
+class JSONArrayStreamParser:
+    """Yield the elements of one array in a JSON document as bytes arrive.
+
+    Only the array stored under ``key`` in the top-level object is
+    extracted, e.g. ``{"incidents": [{...}, {...}]}``. Each element is
+    decoded with ``json.loads`` as soon as its closing bracket is seen, so
+    memory is bounded by the largest element plus one network chunk.
+    Elements must be objects or arrays.
+    """
+
+    def __init__(self, key: str):
+        self.key = key.encode()
+        self._buffer = bytearray()
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._string_start = 0
+        self._last_key = None
+        self._array_depth = None
+        self._item_start = None
+        self.done = False
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        """Consume a chunk and return the elements it completed"""
+        if self.done:
+            return []
+
+        self._buffer += chunk
+        buffer = self._buffer
+        items = []
+        pos = self._pos
+
+        while True:
+            if self._in_string:
+                match = _STRING_SPECIAL.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                index = match.start()
+                if buffer[index] == 0x5C:  # backslash
+                    if index + 1 >= len(buffer):
+                        # Escape split across chunks; resume at the backslash
+                        pos = index
+                        break
+                    pos = index + 2
+                    continue
+                self._in_string = False
+                if self._depth == 1 and self._array_depth is None:
+                    self._last_key = bytes(buffer[self._string_start + 1:index])
+                pos = index + 1
+                continue
+
+            match = _STRUCTURAL.search(buffer, pos)
+            if match is None:
+                pos = len(buffer)
+                break
+            index = match.start()
+            char = buffer[index]
+            pos = index + 1
+
+            if char == 0x22:  # "
+                self._in_string = True
+                self._string_start = index
+            elif char in (0x7B, 0x5B):  # { [
+                self._depth += 1
+                if self._array_depth is None:
+                    if char == 0x5B and self._depth == 2 and self._last_key == self.key:
+                        self._array_depth = 2
+                elif self._depth == self._array_depth + 1:
+                    self._item_start = index
+            else:  # } ]
+                self._depth -= 1
+                if self._array_depth is not None:
+                    if self._depth == self._array_depth and self._item_start is not None:
+                        items.append(json.loads(bytes(buffer[self._item_start:index + 1])))
+                        self._item_start = None
+                    elif self._depth < self._array_depth:
+                        self.done = True
+                        break
+
+        # Drop everything the parser no longer needs
+        keep_from = self._item_start if self._item_start is not None else pos
+        if self._in_string and self._item_start is None:
+            keep_from = min(keep_from, self._string_start)
+        del buffer[:keep_from]
+        pos -= keep_from
+        self._string_start -= keep_from
+        if self._item_start is not None:
+            self._item_start = 0
+        self._pos = pos
+        return items
+
+async def iter_json_array(chunks: AsyncIterator[bytes], key: str) -> AsyncIterator[Any]:
+    """Async-iterate the elements of ``key`` in a streamed JSON object"""
+    parser = JSONArrayStreamParser(key)
+    async for chunk in chunks:
+        for item in parser.feed(chunk):
+            yield item
+        if parser.done:
+            break
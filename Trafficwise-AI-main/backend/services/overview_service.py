@@ -0,0 +1,152 @@
+"""
+Country-wide traffic overview kept up to date as city data refreshes
+"""
+
+import asyncio
+import bisect
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.city_registry import CITIES
+from services.tomtom_service import tomtom_service
+
+logger = logging.getLogger(__name__)
+
+SEVERITIES = ("major", "moderate", "minor", "info")
+
+class NationalOverview:
+    """Running aggregates over every city's latest flow and incidents.
+
+    Each refresh replaces one city's contribution: its old terms are
+    subtracted from the running sums and its new ones added, and its
+    place in the speed ranking is moved with a binary search. The
+    response is built at most once per change, so reads cost the same
+    however many cities there are. The speed index is the
+    population-weighted mean of current / free-flow speed, scaled to 100.
+    """
+
+    def __init__(self, populations: Dict[str, int], worst_count: int, sync_seconds: float):
+        self.populations = populations
+        self.worst_count = worst_count
+        self.sync_seconds = sync_seconds
+        self.total_population = sum(populations.values())
+
+        # city -> (speed ratio, current speed, weight, updated_at)
+        self._flow: Dict[str, Tuple[float, float, float, float]] = {}
+        # city -> (counts per severity, total delay seconds, updated_at)
+        self._incidents: Dict[str, Tuple[Tuple[int, ...], int, float]] = {}
+        # (speed ratio, city), slowest first
+        self._ranking: List[Tuple[float, str]] = []
+
+        self._weight = 0.0
+        self._weighted_ratio = 0.0
+        self._weighted_speed = 0.0
+        self._severity_counts = [0] * len(SEVERITIES)
+        self._delay = 0
+        self._updates = 0
+        self._updated_at = 0.0
+        self._snapshot: Optional[Dict[str, Any]] = None
+
+        tomtom_service.on_refresh("flow", self.update_flow)
+        tomtom_service.on_refresh("incidents", self.update_incidents)
+
+    def update_flow(self, city: str, data: Dict[str, Any]):
+        free_flow = data.get("free_flow_speed") or 0
+        if free_flow <= 0 and not data.get("road_closure"):
+            return
+        ratio = 0.0 if data.get("road_closure") else min(data.get("current_speed", 0) / free_flow, 1.0)
+        weight = float(self.populations.get(city, 0))
+        now = time.time()
+
+        previous = self._flow.get(city)
+        if previous is not None:
+            self._weight -= previous[2]
+            self._weighted_ratio -= previous[0] * previous[2]
+            self._weighted_speed -= previous[1] * previous[2]
+            del self._ranking[bisect.bisect_left(self._ranking, (previous[0], city))]
+        self._flow[city] = (ratio, float(data.get("current_speed", 0)), weight, now)
+        self._weight += weight
+        self._weighted_ratio += ratio * weight
+        self._weighted_speed += data.get("current_speed", 0) * weight
+        bisect.insort(self._ranking, (ratio, city))
+        self._changed(now)
+
+    def update_incidents(self, city: str, data: Dict[str, Any]):
+        counts = [0] * len(SEVERITIES)
+        for incident in data.get("incidents", []):
+            severity = incident.get("severity", "info")
+            counts[SEVERITIES.index(severity) if severity in SEVERITIES else -1] += 1
+        delay = sum(incident.get("delay") or 0 for incident in data.get("incidents", []))
+        now = time.time()
+
+        previous = self._incidents.get(city)
+        if previous is not None:
+            for index, count in enumerate(previous[0]):
+                self._severity_counts[index] -= count
+            self._delay -= previous[1]
+        self._incidents[city] = (tuple(counts), delay, now)
+        for index, count in enumerate(counts):
+            self._severity_counts[index] += count
+        self._delay += delay
+        self._changed(now)
+
+    def _changed(self, now: float):
+        self._updated_at = now
+        self._snapshot = None
+        self._updates += 1
+        # Float sums drift after many add/subtract cycles; resum them now and then
+        if self._updates % 1000 == 0:
+            self._weight = sum(weight for _, _, weight, _ in self._flow.values())
+            self._weighted_ratio = sum(ratio * weight for ratio, _, weight, _ in self._flow.values())
+            self._weighted_speed = sum(speed * weight for _, speed, weight, _ in self._flow.values())
+
+    def get_overview(self) -> Dict[str, Any]:
+        if self._snapshot is None:
+            self._snapshot = self._build()
+        return self._snapshot
+
+    def _build(self) -> Dict[str, Any]:
+        speed_index = self._weighted_ratio / self._weight * 100 if self._weight > 0 else None
+        incidents = dict(zip(SEVERITIES, self._severity_counts))
+        worst = []
+        for ratio, city in self._ranking[:self.worst_count]:
+            city_incidents = self._incidents.get(city)
+            worst.append({
+                "city": city.title(),
+                "speed_ratio": round(ratio, 3),
+                "current_speed": self._flow[city][1],
+                "incidents": sum(city_incidents[0]) if city_incidents else None
+            })
+        return {
+            "success": True,
+            "data": {
+                "speed_index": round(speed_index, 1) if speed_index is not None else None,
+                "avg_speed": round(self._weighted_speed / self._weight, 1) if self._weight > 0 else None,
+                "population_coverage": round(self._weight / self.total_population, 3) if self.total_population else 0,
+                "cities_reporting": {"flow": len(self._flow), "incidents": len(self._incidents), "total": len(self.populations)},
+                "incidents": {"total": sum(self._severity_counts), "by_severity": incidents, "total_delay_seconds": self._delay},
+                "worst_cities": worst,
+                "updated_at": self._updated_at
+            }
+        }
+
+    async def sync_loop(self):
+        """Pick up city data other workers have fetched into the shared cache"""
+        while True:
+            try:
+                await asyncio.gather(*(
+                    tomtom_service.observe_cached(kind, city)
+                    for city in self.populations for kind in ("flow", "incidents")
+                ))
+            except Exception as e:
+                logger.error(f"Error syncing national overview: {str(e)}")
+            await asyncio.sleep(self.sync_seconds)
+
+# Initialize service (per worker process)
+national_overview = NationalOverview(
+    {city["name"].lower(): city["population"] for city in CITIES},
+    worst_count=int(os.getenv("OVERVIEW_WORST_CITIES", 5)),
+    sync_seconds=float(os.getenv("OVERVIEW_SYNC_SECONDS", 15))
+)
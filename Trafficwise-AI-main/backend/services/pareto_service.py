@@ -0,0 +1,142 @@
+"""
+Route trade-offs between travel time, tolls and distance over the road graph
+"""
+
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from services.road_graph import RoadGraph, road_graph
+
+class ParetoRouteService:
+    """Pareto-optimal routes between supported cities at current speeds.
+
+    No returned route is beaten by another on time, toll and distance at
+    once, so each one is the best choice for some trade-off. The search
+    is bounded by ``max_stretch`` times the fastest route's duration and
+    by ``max_labels_per_node``; results are cached per city pair and
+    ``bucket_seconds`` of conditions.
+    """
+
+    def __init__(self, graph: RoadGraph, max_stretch: float, epsilon: float, max_labels_per_node: int, bucket_seconds: float, cache_size: int):
+        self.graph = graph
+        self.max_stretch = max_stretch
+        self.epsilon = epsilon
+        self.max_labels_per_node = max_labels_per_node
+        self.bucket_seconds = bucket_seconds
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+
+    async def get_routes(self, from_city: str, to_city: str, max_routes: Optional[int] = None) -> Dict[str, Any]:
+        source = self.graph.city_nodes.get(from_city.lower())
+        target = self.graph.city_nodes.get(to_city.lower())
+        if source is None or target is None:
+            return {
+                "success": False,
+                "error": "City not supported",
+                "message": f"No road graph node for {from_city if source is None else to_city}"
+            }
+        if source == target:
+            return {
+                "success": False,
+                "error": "Same origin and destination",
+                "message": f"{from_city} to {to_city} is not a route"
+            }
+
+        bucket = int(time.time() // self.bucket_seconds)
+        key = (source, target, bucket)
+        result = self._cache.get(key)
+        if result is None:
+            result = await self._search(source, target, bucket)
+            self._cache[key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+
+        if not result["success"] or max_routes is None:
+            return result
+        data = dict(result["data"], routes=result["data"]["routes"][:max_routes])
+        return {"success": True, "data": data}
+
+    async def _search(self, source: int, target: int, bucket: int) -> Dict[str, Any]:
+        started = time.perf_counter()
+        factors, coverage = await self.graph.speed_factors()
+        edge_minutes = self.graph.edge_minutes(factors)
+        fastest = self.graph.shortest_times([(source, 0.0)], edge_minutes, float("inf")).get(target)
+        if fastest is None:
+            return {
+                "success": False,
+                "error": "No route found",
+                "message": f"{self.graph.names[target]} cannot be reached from {self.graph.names[source]} on the road graph"
+            }
+
+        paths = self.graph.pareto_paths(
+            source,
+            target,
+            edge_minutes,
+            fastest * self.max_stretch,
+            epsilon=self.epsilon,
+            max_labels_per_node=self.max_labels_per_node
+        )
+        paths.sort(key=lambda path: (path[0], path[1], path[2]))
+        cheapest = min(path[1] for path in paths)
+        shortest = min(path[2] for path in paths)
+        routes = []
+        for index, (minutes, toll, km, edges) in enumerate(paths):
+            tags = ["fastest"] if index == 0 else []
+            if toll == cheapest:
+                tags.append("cheapest")
+            if km == shortest:
+                tags.append("shortest")
+            routes.append({
+                "duration_minutes": round(minutes, 1),
+                "toll_rs": round(toll),
+                "distance_km": round(km, 1),
+                "best_for": tags,
+                "roads": self._roads(edges),
+                "via": self._via(source, edges)
+            })
+        return {
+            "success": True,
+            "data": {
+                "from_city": self.graph.names[source],
+                "to_city": self.graph.names[target],
+                "routes": routes,
+                "conditions_bucket_start": bucket * self.bucket_seconds,
+                "live_coverage": round(coverage, 3),
+                "computed_in_ms": round((time.perf_counter() - started) * 1000, 2)
+            }
+        }
+
+    def _roads(self, edges: List[int]) -> List[str]:
+        """Named roads in driving order, with unnamed stretches as the city streets they belong to"""
+        roads: List[str] = []
+        for edge in edges:
+            name = self.graph.edge_name[edge]
+            if name is None:
+                group = self.graph.groups[self.graph.edge_group[edge]]
+                name = f"{group[1].title()} city roads" if group[0] == "city" else "Local roads"
+            if not roads or roads[-1] != name:
+                roads.append(name)
+        return roads
+
+    def _via(self, source: int, edges: List[int]) -> List[Dict[str, Any]]:
+        """Named places passed through, with their positions"""
+        nodes = [source] + [self.graph.edge_to[edge] for edge in edges]
+        return [
+            {"name": self.graph.names[node], "lat": round(self.graph.lat[node], 5), "lon": round(self.graph.lon[node], 5)}
+            for node in nodes
+            if self.graph.names[node]
+        ]
+
+# Initialize service
+pareto_routes = ParetoRouteService(
+    road_graph,
+    max_stretch=float(os.getenv("PARETO_MAX_STRETCH", 1.6)),
+    epsilon=float(os.getenv("PARETO_EPSILON", 0.02)),
+    max_labels_per_node=int(os.getenv("PARETO_MAX_LABELS_PER_NODE", 8)),
+    bucket_seconds=float(os.getenv("PARETO_BUCKET_SECONDS", 300)),
+    cache_size=int(os.getenv("PARETO_CACHE_SIZE", 256))
+)
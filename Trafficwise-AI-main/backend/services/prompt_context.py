@@ -0,0 +1,161 @@
+"""
+Live traffic context for chat prompts, built only from already-cached data
+"""
+
+import logging
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.city_registry import city_registry
+from services.tomtom_service import tomtom_service, PAKISTAN_TZ
+from services.traffic_service import traffic_service
+
+logger = logging.getLogger(__name__)
+
+# Expert framing shared by every prompt; it never changes, so it is built once
+SYSTEM_PREFIX = """You are a traffic and urban planning expert for Pakistan.
+
+Consider Pakistani context including:
+- Local traffic patterns and peak hours (7-9 AM, 5-8 PM)
+- Public transport systems (Metro Bus, Orange Line, BRT)
+- Weather impacts (monsoon season July-Sept, fog Dec-Feb)
+- Cultural and religious events affecting traffic (Friday prayers, Ramadan, Eid)
+- Infrastructure challenges and ongoing development projects
+- Major cities: Karachi, Lahore, Islamabad, Rawalpindi, Faisalabad, Peshawar
+- Highway systems: Motorways (M-1, M-2, M-3), GT Road, National Highways
+
+Provide practical, actionable advice specific to Pakistani traffic conditions."""
+
+# Other names people use for supported cities and highways
+CITY_ALIASES = {"pindi": "rawalpindi", "isb": "islamabad", "khi": "karachi", "lhr": "lahore"}
+HIGHWAY_ALIASES = {"grand trunk road": "GT Road", "g.t. road": "GT Road", "gt road": "GT Road"}
+
+MAX_INCIDENT_NOTES = 2
+
+class PromptContextBuilder:
+    """Adds current conditions for the cities and highways a message mentions.
+
+    Mentions are found with one precompiled regex. Conditions come from the
+    shared cache only (whatever the dashboards and background refreshes
+    last stored), so a chat message never waits on TomTom. Static text per
+    city and highway is rendered once, and live summaries once per cache
+    entry version.
+    """
+
+    def __init__(self, max_entities: int = 4):
+        self.max_entities = max_entities
+
+        # Lower-cased mention -> ("city", key) or ("highway", route code)
+        self._mentions: Dict[str, Tuple[str, str]] = {}
+        for name in tomtom_service.pakistan_cities:
+            self._mentions[name] = ("city", name)
+        for alias, name in CITY_ALIASES.items():
+            self._mentions[alias] = ("city", name)
+        for highway in traffic_service.highways:
+            code = highway.route_code
+            self._mentions[code.lower()] = ("highway", code)
+            self._mentions[highway.name.lower()] = ("highway", code)
+            if code.startswith("M-"):
+                # "M2", "M 2" and "motorway 2" as well as "M-2"
+                number = code[2:]
+                for variant in (f"m{number}", f"m {number}", f"motorway {number}"):
+                    self._mentions[variant] = ("highway", code)
+        for alias, code in HIGHWAY_ALIASES.items():
+            self._mentions[alias] = ("highway", code)
+
+        # Longest first so "motorway m-2" wins over "m-2"
+        alternatives = sorted(self._mentions, key=len, reverse=True)
+        self._pattern = re.compile(r"(?<![\w-])(" + "|".join(re.escape(alias) for alias in alternatives) + r")(?![\w-])", re.IGNORECASE)
+
+        self._static = self._render_static()
+        self._summaries: Dict[str, Tuple[float, str]] = {}
+
+    def _render_static(self) -> Dict[Tuple[str, str], str]:
+        segments = {}
+        for city in traffic_service.cities:
+            segment = f"{city.city}: {city.info}."
+            if city.peak_hours:
+                segment += f" Peak hours {', '.join(city.peak_hours)}."
+            if city.alternative_routes:
+                segment += f" Alternatives: {', '.join(city.alternative_routes)}."
+            segments[("city", city.city.lower())] = segment
+        for highway in traffic_service.highways:
+            toll = "tolled" if highway.toll_required else "toll-free"
+            segments[("highway", highway.route_code)] = (
+                f"{highway.name} ({highway.route_code}): {highway.start_city} to {highway.end_city}, "
+                f"{highway.total_distance}, {toll}."
+            )
+        return segments
+
+    def find_mentions(self, message: str) -> List[Tuple[str, str]]:
+        """Cities and highways mentioned in a message, in order of first mention"""
+        found = []
+        for match in self._pattern.finditer(message):
+            entity = self._mentions[match.group(1).lower()]
+            if entity not in found:
+                found.append(entity)
+                if len(found) == self.max_entities:
+                    break
+        return found
+
+    async def build(self, message: str) -> str:
+        """Context block for the entities in a message, or "" if none are mentioned"""
+        lines = []
+        for kind, key in self.find_mentions(message):
+            try:
+                if kind == "city":
+                    live = [await self._summary(f"flow:{key}", self._describe_flow),
+                            await self._summary(f"incidents:{key}", self._describe_incidents)]
+                else:
+                    live = [await self._summary(f"corridor:{key}", lambda data: traffic_service.describe_corridor(data["status"]))]
+            except Exception as e:
+                logger.warning(f"⚠️ Live context unavailable for {key}: {str(e)}")
+                live = []
+            live = [part for part in live if part]
+            static = self._static.get((kind, key))
+            if static is None:
+                name = city_registry.get(key)["name"] if kind == "city" else key
+                static = f"{name}:"
+                if not live:
+                    live = ["No live data available right now."]
+            lines.append(" ".join([static] + live))
+        if not lines:
+            return ""
+        return "Current conditions (live data where available):\n" + "\n".join(f"- {line}" for line in lines)
+
+    async def _summary(self, key: str, describe) -> Optional[str]:
+        entry = await tomtom_service.cache.get(key)
+        if entry is None or not entry["result"].get("success"):
+            return None
+        cached = self._summaries.get(key)
+        if cached is not None and cached[0] == entry["fetched_at"]:
+            return cached[1]
+        as_of = datetime.fromtimestamp(entry["fetched_at"], PAKISTAN_TZ).strftime("%H:%M PKT")
+        text = f"{describe(entry['result']['data'])} (as of {as_of})."
+        self._summaries[key] = (entry["fetched_at"], text)
+        return text
+
+    @staticmethod
+    def _describe_flow(data: Dict[str, Any]) -> str:
+        if data.get("road_closure"):
+            return "Main road closed"
+        return (
+            f"Now {data.get('traffic_level', 'unknown')} traffic, "
+            f"{data.get('current_speed', 0)} km/h against {data.get('free_flow_speed', 0)} km/h free flow"
+        )
+
+    @staticmethod
+    def _describe_incidents(data: Dict[str, Any]) -> str:
+        incidents = data.get("incidents", [])
+        if not incidents:
+            return "No reported incidents"
+        major = [incident for incident in incidents if incident.get("severity") == "major"]
+        text = f"{len(incidents)} incident(s), {len(major)} major"
+        notes = [incident["description"] for incident in major if incident.get("description")][:MAX_INCIDENT_NOTES]
+        if notes:
+            text += ": " + "; ".join(notes)
+        return text
+
+# Initialize builder
+prompt_context = PromptContextBuilder()
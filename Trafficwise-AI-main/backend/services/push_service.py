@@ -0,0 +1,110 @@
+"""
+Push channel for alerts to connected clients
+"""
+
+import asyncio
+import hashlib
+import os
+import secrets
+import time
+from typing import Any, Dict, Optional, Set
+
+from services.shared_cache import SharedCache
+from services.tomtom_service import tomtom_service
+
+class PushConnection:
+    """Outgoing message queue of one client connection"""
+
+    def __init__(self, user_id: str, max_pending: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.dropped = 0
+
+    def put(self, message: Dict[str, Any]):
+        """Queue a message without waiting; a slow client loses its oldest messages"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+class PushHub:
+    """Connected clients by user id, in this worker process.
+
+    Publishing never waits on a client: each connection has a bounded
+    queue drained by its own sender, so one stalled socket cannot hold
+    up matching or other users.
+    """
+
+    def __init__(self, max_pending: int = 100):
+        self.max_pending = max_pending
+        self._connections: Dict[str, Set[PushConnection]] = {}
+        self.published = 0
+
+    def connect(self, user_id: str) -> PushConnection:
+        connection = PushConnection(user_id, self.max_pending)
+        self._connections.setdefault(user_id, set()).add(connection)
+        return connection
+
+    def disconnect(self, connection: PushConnection):
+        connections = self._connections.get(connection.user_id)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del self._connections[connection.user_id]
+
+    def is_connected(self, user_id: str) -> bool:
+        return user_id in self._connections
+
+    def publish(self, user_id: str, message: Dict[str, Any]) -> int:
+        """Queue a message for every connection of a user; returns how many were reached"""
+        connections = self._connections.get(user_id, ())
+        for connection in connections:
+            connection.put(message)
+        self.published += len(connections)
+        return len(connections)
+
+    def broadcast(self, message: Dict[str, Any]) -> int:
+        """Queue a message for every connection"""
+        return sum(self.publish(user_id, message) for user_id in list(self._connections))
+
+    def stats(self) -> Dict[str, Any]:
+        connections = [connection for group in self._connections.values() for connection in group]
+        return {
+            "users": len(self._connections),
+            "connections": len(connections),
+            "published": self.published,
+            "dropped": sum(connection.dropped for connection in connections)
+        }
+
+class PushSessions:
+    """Server-issued tokens that identify a push client.
+
+    The token is unguessable and the user id is derived from it, so a
+    client can only receive and manage its own alerts. Sessions live in
+    the shared cache, keyed by the user id rather than the token itself,
+    so a client may connect to any worker.
+    """
+
+    def __init__(self, cache: SharedCache, ttl: float):
+        self.cache = cache
+        self.ttl = ttl
+
+    @staticmethod
+    def _user_id(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()[:32]
+
+    async def issue(self) -> Dict[str, Any]:
+        token = secrets.token_urlsafe(32)
+        await self.cache.set(f"push-session:{self._user_id(token)}", {"issued_at": time.time()}, self.ttl)
+        return {"token": token, "expires_in": int(self.ttl)}
+
+    async def user_id(self, token: str) -> Optional[str]:
+        """User id of a valid session token, or None"""
+        user_id = self._user_id(token)
+        if await self.cache.get(f"push-session:{user_id}") is None:
+            return None
+        return user_id
+
+# Initialize hub (per worker process)
+push_hub = PushHub(max_pending=int(os.getenv("PUSH_MAX_PENDING", 100)))
+push_sessions = PushSessions(tomtom_service.cache, ttl=float(os.getenv("PUSH_SESSION_TTL", 86400)))
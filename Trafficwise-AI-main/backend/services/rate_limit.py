@@ -0,0 +1,42 @@
+"""
+Rate budgets for upstream API calls
+"""
+
+import asyncio
+import time
+
+class TokenBucket:
+    """Async token bucket: ``rate`` calls per second with bursts up to ``capacity``"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take tokens if available right now, without waiting"""
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens: float = 1.0):
+        """Wait until tokens are available, then take them"""
+        # Created lazily so the bucket can be built outside of a running loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # Waiters queue on the lock so tokens are handed out in arrival order
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= tokens
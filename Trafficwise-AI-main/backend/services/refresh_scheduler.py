@@ -0,0 +1,238 @@
+"""
+Adaptive, demand-driven refresh of city flow and incidents
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.city_registry import city_registry
+from services.rate_limit import TokenBucket
+from services.tomtom_service import tomtom_service, PAKISTAN_TZ
+from services.traffic_service import traffic_service
+
+logger = logging.getLogger(__name__)
+
+# Cities without listed peak hours use typical national rush hours
+DEFAULT_PEAK_HOURS = ["07:30-09:30", "17:00-19:30"]
+
+# Share of the urgency score from each signal; signals are normalised to 0..1
+DEMAND_WEIGHT = 0.4
+CHANGE_WEIGHT = 0.3
+PEAK_WEIGHT = 0.3
+
+def parse_windows(windows: List[str]) -> List[Tuple[int, int]]:
+    """"HH:MM-HH:MM" windows as (start, end) minutes after midnight"""
+    parsed = []
+    for window in windows:
+        start, end = window.split("-")
+        start_h, start_m = start.split(":")
+        end_h, end_m = end.split(":")
+        parsed.append((int(start_h) * 60 + int(start_m), int(end_h) * 60 + int(end_m)))
+    return parsed
+
+class CityActivity:
+    """Recent demand and data change for one city, as decaying averages"""
+
+    def __init__(self, peak_windows: List[Tuple[int, int]], demand_tau: float, alpha: float):
+        self.peak_windows = peak_windows
+        self.demand_tau = demand_tau
+        self.alpha = alpha
+        self.demand = 0.0  # requests per second, decayed with time constant demand_tau
+        self.demand_at = time.time()
+        self.volatility = 0.0  # mean change of the speed ratio between refreshes
+        self.churn = 0.0  # mean share of incidents that changed between refreshes
+        self.speed_ratio = None
+        self.incident_ids = None
+
+    def record_demand(self, now: float):
+        self.demand = self.demand_rate(now) + 1.0 / self.demand_tau
+        self.demand_at = now
+
+    def demand_rate(self, now: float) -> float:
+        return self.demand * math.exp(-(now - self.demand_at) / self.demand_tau)
+
+    def observe_flow(self, data: Dict[str, Any]):
+        free_flow = data.get("free_flow_speed") or 0
+        if data.get("road_closure"):
+            ratio = 0.0
+        elif free_flow > 0:
+            ratio = min(data.get("current_speed", 0) / free_flow, 1.0)
+        else:
+            return
+        if self.speed_ratio is not None:
+            self.volatility += self.alpha * (abs(ratio - self.speed_ratio) - self.volatility)
+        self.speed_ratio = ratio
+
+    def observe_incidents(self, data: Dict[str, Any]):
+        ids = {incident["id"] for incident in data.get("incidents", [])}
+        if self.incident_ids is not None:
+            changed = len(ids ^ self.incident_ids) / max(len(ids | self.incident_ids), 1)
+            self.churn += self.alpha * (changed - self.churn)
+        self.incident_ids = ids
+
+    def in_peak(self, now: float, lead_minutes: float) -> bool:
+        local = datetime.fromtimestamp(now, PAKISTAN_TZ)
+        minute = local.hour * 60 + local.minute
+        return any(start - lead_minutes <= minute < end for start, end in self.peak_windows)
+
+class RefreshScheduler:
+    """Proactively refreshes each city's flow and incidents at an adaptive interval.
+
+    Each (kind, city) gets an urgency between 0 and 1 from request demand,
+    how much its data changes between refreshes (speed volatility for flow,
+    incident churn for incidents) and whether it is inside a peak window.
+    The interval is interpolated geometrically from the slowest (urgency 0)
+    to the fastest (urgency 1) refresh. Due jobs run most-overdue first
+    while a shared token bucket allows, so the total stays within
+    ``CITY_REFRESH_CALLS_PER_MINUTE`` and the busiest cities get the
+    budget when it is short.
+
+    A job is due when its cache entry is older than its interval, so the
+    schedule lives in the shared cache and whichever worker holds the
+    lease can continue it. The leader keeps renewing its lease, so the
+    budget and the demand it sees stay in one worker instead of moving
+    between workers each tick; demand is therefore counted from that
+    worker's share of the requests.
+    """
+
+    def __init__(self):
+        self.min_interval = float(os.getenv("CITY_REFRESH_MIN_SECONDS", 30))
+        self.max_interval = float(os.getenv("CITY_REFRESH_MAX_SECONDS", 600))
+        self.tick = float(os.getenv("CITY_REFRESH_TICK_SECONDS", 5))
+        # Requests per minute (seen by this worker) at which demand counts fully
+        self.demand_reference = float(os.getenv("CITY_REFRESH_DEMAND_RPM", 10)) / 60
+        self._lease: Optional[str] = None
+        # Speed-ratio change and incident churn per refresh at which change counts fully
+        self.volatility_reference = float(os.getenv("CITY_REFRESH_VOLATILITY", 0.1))
+        self.churn_reference = float(os.getenv("CITY_REFRESH_CHURN", 0.3))
+        self.peak_lead_minutes = float(os.getenv("CITY_REFRESH_PEAK_LEAD_MINUTES", 15))
+        calls_per_second = float(os.getenv("CITY_REFRESH_CALLS_PER_MINUTE", 60)) / 60
+        # Room for at least the most expensive single refresh, or it could never run
+        largest_cost = max(tomtom_service.refresh_cost("incidents", city) for city in tomtom_service.pakistan_cities)
+        self.budget = TokenBucket(rate=calls_per_second, capacity=max(calls_per_second * self.tick, largest_cost))
+        # Incidents change more slowly than flow; keep the ratio of their cache TTLs
+        self.incidents_scale = tomtom_service.incidents_ttl / tomtom_service.flow_ttl
+
+        demand_tau = float(os.getenv("CITY_REFRESH_DEMAND_WINDOW_SECONDS", 600))
+        peak_hours = {city["city"].lower(): city.get("peak_hours") for city in traffic_service.cities_data}
+        self.activity = {
+            name: CityActivity(parse_windows(peak_hours.get(name) or DEFAULT_PEAK_HOURS), demand_tau, alpha=0.3)
+            for name in tomtom_service.pakistan_cities
+        }
+        tomtom_service.on_refresh("flow", self._observe_flow)
+        tomtom_service.on_refresh("incidents", self._observe_incidents)
+
+    def record_demand(self, city: str):
+        """Count a request for a city's data"""
+        activity = self.activity.get(city.lower())
+        if activity is not None:
+            activity.record_demand(time.time())
+
+    def _observe_flow(self, city: str, data: Dict[str, Any]):
+        if city in self.activity:
+            self.activity[city].observe_flow(data)
+
+    def _observe_incidents(self, city: str, data: Dict[str, Any]):
+        if city in self.activity:
+            self.activity[city].observe_incidents(data)
+
+    def urgency(self, kind: str, city: str, now: float) -> float:
+        activity = self.activity[city]
+        demand = min(activity.demand_rate(now) / self.demand_reference, 1.0)
+        if kind == "flow":
+            change = min(activity.volatility / self.volatility_reference, 1.0)
+        else:
+            change = min(activity.churn / self.churn_reference, 1.0)
+        peak = 1.0 if activity.in_peak(now, self.peak_lead_minutes) else 0.0
+        return DEMAND_WEIGHT * demand + CHANGE_WEIGHT * change + PEAK_WEIGHT * peak
+
+    def interval(self, kind: str, city: str, now: float, urgency: float = None) -> float:
+        """Seconds between refreshes of a city's ``flow`` or ``incidents`` right now"""
+        if urgency is None:
+            urgency = self.urgency(kind, city, now)
+        interval = self.max_interval * (self.min_interval / self.max_interval) ** urgency
+        return interval * self.incidents_scale if kind == "incidents" else interval
+
+    def status(self) -> List[Dict[str, Any]]:
+        """Current signals and intervals per city"""
+        now = time.time()
+        return [
+            {
+                "city": city["name"],
+                "demand_rpm": round(self.activity[key].demand_rate(now) * 60, 2),
+                "speed_volatility": round(self.activity[key].volatility, 4),
+                "incident_churn": round(self.activity[key].churn, 4),
+                "in_peak": self.activity[key].in_peak(now, self.peak_lead_minutes),
+                "flow_interval": round(self.interval("flow", key, now), 1),
+                "incidents_interval": round(self.interval("incidents", key, now), 1)
+            }
+            for city in city_registry.cities
+            for key in (city["name"].lower(),)
+        ]
+
+    async def _due_jobs(self, now: float) -> List[Tuple[float, float, str, str, float]]:
+        """(overdue ratio, urgency, kind, city, interval) for every job past its interval, most overdue first"""
+        jobs = [(kind, city) for city in self.activity for kind in ("flow", "incidents")]
+        entries = await asyncio.gather(*(tomtom_service.cache.get(f"{kind}:{city}") for kind, city in jobs))
+        due = []
+        for (kind, city), entry in zip(jobs, entries):
+            urgency = self.urgency(kind, city, now)
+            interval = self.interval(kind, city, now, urgency)
+            age = now - entry["fetched_at"] if entry else math.inf
+            if age >= interval:
+                due.append((age / interval, urgency, kind, city, interval))
+        # Missing entries are equally overdue; the most urgent of them go first
+        due.sort(reverse=True)
+        return due
+
+    async def run_once(self) -> int:
+        """Refresh the jobs that are due and fit in the budget; returns the number refreshed"""
+        now = time.time()
+        selected = []
+        for _, _, kind, city, interval in await self._due_jobs(now):
+            if not self.budget.try_acquire(tomtom_service.refresh_cost(kind, city)):
+                # Keep the budget for the most overdue job rather than filling it with cheaper ones
+                break
+            selected.append((kind, city, interval))
+
+        # Entries outlive their interval so on-demand reads keep hitting until the next refresh
+        results = await asyncio.gather(
+            *(tomtom_service.refresh_city(kind, city, interval * 2) for kind, city, interval in selected),
+            return_exceptions=True
+        )
+        for (kind, city, _), result in zip(selected, results):
+            if not isinstance(result, dict) or not result.get("success"):
+                logger.warning(f"⚠️ Scheduled {kind} refresh failed for {city}")
+        return len(selected)
+
+    async def refresh_loop(self):
+        """Run the scheduler in whichever worker holds the lease"""
+        try:
+            while True:
+                try:
+                    # Renewed every tick and covering a round of refreshes plus the sleep, so the
+                    # leader keeps it; another worker takes over only once the leader stops
+                    self._lease = await tomtom_service.cache.acquire(
+                        "city-refresh", ttl=2 * self.tick + tomtom_service.timeout, token=self._lease
+                    )
+                    if self._lease is not None:
+                        await self.run_once()
+                except Exception as e:
+                    logger.error(f"Error in city refresh scheduler: {str(e)}")
+                await asyncio.sleep(self.tick)
+        finally:
+            # Hand over straight away on shutdown rather than after the lease expires
+            if self._lease is not None:
+                try:
+                    await tomtom_service.cache.release("city-refresh", self._lease)
+                except Exception as e:
+                    logger.warning(f"⚠️ Could not release city refresh lease: {str(e)}")
+                self._lease = None
+
+# Initialize service
+refresh_scheduler = RefreshScheduler()
@@ -0,0 +1,382 @@
+"""
+Local road graph with live speeds for reachability and route search
+"""
+
+import asyncio
+import heapq
+import json
+import logging
+import math
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from services.city_registry import city_registry
+from services.corridor_service import haversine_km
+from services.tomtom_service import tomtom_service
+from services.traffic_service import traffic_service
+
+logger = logging.getLogger(__name__)
+
+# Synthetic arterial network around each city centre (spokes crossed by ring roads),
+# standing in for real streets until they are loaded from ROAD_GRAPH_FILE
+CITY_RING_KM = (3.0, 8.0, 15.0, 25.0)
+CITY_SPOKES = 8
+RADIAL_SPEED_KMH = 50.0
+RING_SPEED_KMH = 40.0
+MOTORWAY_SPEED_KMH = 110.0
+HIGHWAY_SPEED_KMH = 70.0
+
+# Straight lines between synthetic nodes are shorter than the roads they stand for
+DETOUR_FACTOR = 1.25
+
+# A jammed or closed road is slow rather than impassable, so search still finds a way round
+MIN_SPEED_FACTOR = 0.05
+
+# Nodes and file edges within this distance of a city belong to it (and take its live flow)
+CITY_AREA_KM = 50.0
+
+FIXED_GROUP = ("fixed",)
+
+def destination_point(lat: float, lon: float, bearing_deg: float, km: float) -> Tuple[float, float]:
+    """Point ``km`` away from (lat, lon) on an initial bearing"""
+    delta = km / 6371.0088
+    theta = math.radians(bearing_deg)
+    phi1, lambda1 = math.radians(lat), math.radians(lon)
+    phi2 = math.asin(math.sin(phi1) * math.cos(delta) + math.cos(phi1) * math.sin(delta) * math.cos(theta))
+    lambda2 = lambda1 + math.atan2(math.sin(theta) * math.sin(delta) * math.cos(phi1), math.cos(delta) - math.sin(phi1) * math.sin(phi2))
+    return math.degrees(phi2), math.degrees(lambda2)
+
+class RoadGraph:
+    """Directed road graph stored in flat arrays.
+
+    Each edge has a length, a free-flow speed, a toll and a live group
+    whose cached conditions scale its speed: ``("city", key)`` uses the
+    city's flow, ``("highway", route_code, from_km, to_km)`` the corridor
+    segments the edge spans and ``("fixed",)`` always runs at free flow.
+    Two-way roads are two edges.
+    """
+
+    def __init__(self):
+        self.lat: List[float] = []
+        self.lon: List[float] = []
+        self.names: List[Optional[str]] = []
+        self.node_city: List[Optional[str]] = []  # nearest supported city within CITY_AREA_KM
+        self.adjacency: List[List[int]] = []
+        self._node_at: Dict[Tuple[float, float], int] = {}
+        self.city_nodes: Dict[str, int] = {}
+
+        self.edge_to: List[int] = []
+        self.edge_km: List[float] = []
+        self.edge_speed: List[float] = []
+        self.edge_toll: List[float] = []
+        self.edge_group: List[int] = []
+        self.edge_name: List[Optional[str]] = []
+        self.groups: List[tuple] = []
+        self._group_index: Dict[tuple, int] = {}
+
+    def add_node(self, lat: float, lon: float, name: Optional[str] = None) -> int:
+        """Node at a position, reusing an existing node at the same point"""
+        key = (round(lat, 5), round(lon, 5))
+        node = self._node_at.get(key)
+        if node is None:
+            node = len(self.lat)
+            self._node_at[key] = node
+            self.lat.append(lat)
+            self.lon.append(lon)
+            self.names.append(name)
+            nearest = city_registry.nearest(lat, lon, CITY_AREA_KM)
+            self.node_city.append(nearest[0]["name"].lower() if nearest else None)
+            self.adjacency.append([])
+        elif name and not self.names[node]:
+            self.names[node] = name
+        return node
+
+    def add_edge(
+        self,
+        start: int,
+        end: int,
+        km: float,
+        speed_kmh: float,
+        toll: float = 0.0,
+        group: tuple = FIXED_GROUP,
+        name: Optional[str] = None,
+        oneway: bool = False
+    ):
+        group_index = self._group_index.get(group)
+        if group_index is None:
+            group_index = self._group_index[group] = len(self.groups)
+            self.groups.append(group)
+        for a, b in ((start, end),) if oneway else ((start, end), (end, start)):
+            self.adjacency[a].append(len(self.edge_to))
+            self.edge_to.append(b)
+            self.edge_km.append(km)
+            self.edge_speed.append(speed_kmh)
+            self.edge_toll.append(toll)
+            self.edge_group.append(group_index)
+            self.edge_name.append(name)
+
+    @property
+    def node_count(self) -> int:
+        return len(self.lat)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.edge_to)
+
+    def nodes_within(self, lat: float, lon: float, max_km: float) -> List[Tuple[int, float]]:
+        """(node, great-circle km) for every node within ``max_km`` of a point"""
+        return [
+            (node, distance)
+            for node in range(self.node_count)
+            for distance in (haversine_km(lat, lon, self.lat[node], self.lon[node]),)
+            if distance <= max_km
+        ]
+
+    def edge_minutes(self, factors: Sequence[float]) -> List[float]:
+        """Travel time of every edge in minutes for live speed factors per group"""
+        return [
+            km / (speed * factors[group]) * 60
+            for km, speed, group in zip(self.edge_km, self.edge_speed, self.edge_group)
+        ]
+
+    def shortest_times(self, sources: Sequence[Tuple[int, float]], minutes: Sequence[float], max_minutes: float) -> Dict[int, float]:
+        """Dijkstra from (node, start minutes) sources, settling only nodes reached within ``max_minutes``"""
+        best: Dict[int, float] = {}
+        heap = [(start, node) for node, start in sources if start <= max_minutes]
+        heapq.heapify(heap)
+        while heap:
+            time_at, node = heapq.heappop(heap)
+            if node in best:
+                continue
+            best[node] = time_at
+            for edge in self.adjacency[node]:
+                target = self.edge_to[edge]
+                arrival = time_at + minutes[edge]
+                if arrival <= max_minutes and target not in best:
+                    heapq.heappush(heap, (arrival, target))
+        return best
+
+    def pareto_paths(
+        self,
+        source: int,
+        target: int,
+        minutes: Sequence[float],
+        max_minutes: float,
+        epsilon: float = 0.0,
+        max_labels_per_node: int = 8
+    ) -> List[Tuple[float, float, float, List[int]]]:
+        """(minutes, toll, km, edges) of every path from ``source`` to ``target`` not beaten on all three.
+
+        A multi-label search: each node keeps the labels not dominated by
+        another label there, and labels are expanded fastest first. A label
+        is dropped when it arrives after ``max_minutes``, when a path
+        already found beats it, or when its node already holds
+        ``max_labels_per_node`` labels. One label dominates another when it
+        is within ``1 + epsilon`` of it on every criterion, so near-identical
+        detours do not multiply.
+        """
+        def dominates(a: int, b: int) -> bool:
+            slack = 1.0 + epsilon
+            return (
+                label_minutes[a] <= label_minutes[b] * slack
+                and label_toll[a] <= label_toll[b] * slack
+                and label_km[a] <= label_km[b] * slack
+            )
+
+        label_minutes, label_toll, label_km = [0.0], [0.0], [0.0]
+        label_node, label_parent, label_edge = [source], [-1], [-1]
+        alive = [True]
+        at_node: Dict[int, List[int]] = {source: [0]}
+        found: List[int] = []
+        heap = [(0.0, 0.0, 0.0, 0)]
+        while heap:
+            _, _, _, label = heapq.heappop(heap)
+            if not alive[label]:
+                continue
+            node = label_node[label]
+            if node == target:
+                found.append(label)
+                continue
+            for edge in self.adjacency[node]:
+                arrival = label_minutes[label] + minutes[edge]
+                if arrival > max_minutes:
+                    continue
+                new = len(label_node)
+                label_minutes.append(arrival)
+                label_toll.append(label_toll[label] + self.edge_toll[edge])
+                label_km.append(label_km[label] + self.edge_km[edge])
+                label_node.append(self.edge_to[edge])
+                label_parent.append(label)
+                label_edge.append(edge)
+                alive.append(False)
+
+                held = at_node.setdefault(self.edge_to[edge], [])
+                if any(dominates(other, new) for other in found) or any(dominates(other, new) for other in held):
+                    continue
+                kept = []
+                for other in held:
+                    if dominates(new, other):
+                        alive[other] = False
+                    else:
+                        kept.append(other)
+                held[:] = kept
+                if len(held) >= max_labels_per_node:
+                    continue
+                held.append(new)
+                alive[new] = True
+                heapq.heappush(heap, (arrival, label_toll[new], label_km[new], new))
+
+        paths = []
+        # A path found early can still be beaten by a later one within epsilon
+        for label in (label for label in found if alive[label]):
+            edges = []
+            step = label
+            while label_edge[step] >= 0:
+                edges.append(label_edge[step])
+                step = label_parent[step]
+            paths.append((label_minutes[label], label_toll[label], label_km[label], edges[::-1]))
+        return paths
+
+    async def speed_factors(self) -> Tuple[List[float], float]:
+        """Live speed factor per edge group from cached flow and corridor data, and the share of groups covered.
+
+        Only the shared cache is read; groups without cached data run at free flow.
+        """
+        cities = sorted({group[1] for group in self.groups if group[0] == "city"})
+        highways = sorted({group[1] for group in self.groups if group[0] == "highway"})
+        entries = await asyncio.gather(
+            *(tomtom_service.cache.get(f"flow:{city}") for city in cities),
+            *(traffic_service.corridors.get_snapshot(code) for code in highways),
+            return_exceptions=True
+        )
+        flow = {city: entry for city, entry in zip(cities, entries) if isinstance(entry, dict)}
+        corridors = {code: entry for code, entry in zip(highways, entries[len(cities):]) if isinstance(entry, dict)}
+
+        factors = []
+        covered = 0
+        for group in self.groups:
+            factor = None
+            if group[0] == "city" and group[1] in flow and flow[group[1]]["result"].get("success"):
+                factor = self._flow_factor(flow[group[1]]["result"]["data"])
+            elif group[0] == "highway" and group[1] in corridors:
+                factor = self._corridor_factor(corridors[group[1]], group[2], group[3])
+            if factor is None:
+                factors.append(1.0)
+            else:
+                covered += 1
+                factors.append(max(factor, MIN_SPEED_FACTOR))
+        live_groups = sum(1 for group in self.groups if group[0] != "fixed")
+        return factors, covered / live_groups if live_groups else 0.0
+
+    @staticmethod
+    def _flow_factor(data: Dict[str, Any]) -> Optional[float]:
+        if data.get("road_closure"):
+            return 0.0
+        free_flow = data.get("free_flow_speed") or 0
+        if free_flow <= 0:
+            return None
+        return min(data.get("current_speed", 0) / free_flow, 1.0)
+
+    @staticmethod
+    def _corridor_factor(snapshot: Dict[str, Any], from_km: float, to_km: float) -> Optional[float]:
+        """Length-weighted speed ratio of the corridor segments overlapping [from_km, to_km]"""
+        total = weighted = 0.0
+        for segment in snapshot.get("segments", []):
+            overlap = min(segment["to_km"], to_km) - max(segment["from_km"], from_km)
+            if overlap <= 0:
+                continue
+            ratio = 0.0 if segment.get("road_closure") else segment.get("speed_ratio")
+            if ratio is None:
+                continue
+            total += overlap
+            weighted += overlap * ratio
+        return weighted / total if total else None
+
+def _parse_km(text: str) -> Optional[float]:
+    try:
+        return float(text.lower().replace("km", "").replace(",", "").strip())
+    except (AttributeError, ValueError):
+        return None
+
+def build_road_graph(path: Optional[str] = None) -> RoadGraph:
+    """Graph of every supported city's arterial network joined by the major highways, plus edges from a file.
+
+    The optional JSON file has ``nodes`` (``{"id", "lat", "lon"}``) and
+    ``edges`` (``{"from", "to", "speed_kmh"}`` with optional ``km``, ``toll``,
+    ``name`` and ``oneway``); ``from`` and ``to`` may also be supported city names.
+    """
+    graph = RoadGraph()
+
+    for city in city_registry.cities:
+        key = city["name"].lower()
+        group = ("city", key)
+        centre = graph.add_node(city["lat"], city["lon"], city["name"])
+        graph.city_nodes[key] = centre
+        rings = []
+        for radius in CITY_RING_KM:
+            rings.append([
+                graph.add_node(*destination_point(city["lat"], city["lon"], spoke * 360 / CITY_SPOKES, radius))
+                for spoke in range(CITY_SPOKES)
+            ])
+        for spoke in range(CITY_SPOKES):
+            inner, inner_km = centre, 0.0
+            for ring, radius in zip(rings, CITY_RING_KM):
+                graph.add_edge(inner, ring[spoke], (radius - inner_km) * DETOUR_FACTOR, RADIAL_SPEED_KMH, group=group)
+                inner, inner_km = ring[spoke], radius
+        for ring, radius in zip(rings, CITY_RING_KM):
+            arc_km = 2 * math.pi * radius / CITY_SPOKES
+            for spoke in range(CITY_SPOKES):
+                graph.add_edge(ring[spoke], ring[(spoke + 1) % CITY_SPOKES], arc_km * DETOUR_FACTOR, RING_SPEED_KMH, group=group)
+
+    for highway in traffic_service.highways:
+        points = [(point["lat"], point["lon"]) for point in highway.waypoints]
+        legs = [haversine_km(*a, *b) for a, b in zip(points, points[1:])]
+        # Waypoints are coarse; scale legs so the highway has its published length
+        stated = _parse_km(highway.total_distance)
+        scale = stated / sum(legs) if stated and sum(legs) else DETOUR_FACTOR
+        speed = MOTORWAY_SPEED_KMH if highway.route_code.startswith("M-") else HIGHWAY_SPEED_KMH
+        along = 0.0
+        for (a, b), leg in zip(zip(points, points[1:]), legs):
+            # Corridor segments are measured along the unscaled waypoint line
+            group = ("highway", highway.route_code, along, along + leg)
+            toll = highway.toll_rs * leg / sum(legs)
+            graph.add_edge(graph.add_node(*a), graph.add_node(*b), leg * scale, speed, toll=toll, group=group, name=highway.name)
+            along += leg
+
+    if path:
+        _load_file(graph, path)
+    return graph
+
+def _load_file(graph: RoadGraph, path: str):
+    with open(path, encoding="utf-8") as f:
+        spec = json.load(f)
+    ids = {str(node["id"]): graph.add_node(node["lat"], node["lon"], node.get("name")) for node in spec.get("nodes", [])}
+
+    def resolve(ref: Any) -> int:
+        ref = str(ref)
+        if ref in ids:
+            return ids[ref]
+        if ref.lower() in graph.city_nodes:
+            return graph.city_nodes[ref.lower()]
+        raise ValueError(f"Unknown node {ref} in {path}")
+
+    for edge in spec.get("edges", []):
+        start, end = resolve(edge["from"]), resolve(edge["to"])
+        straight = haversine_km(graph.lat[start], graph.lon[start], graph.lat[end], graph.lon[end])
+        nearest = city_registry.nearest(
+            (graph.lat[start] + graph.lat[end]) / 2, (graph.lon[start] + graph.lon[end]) / 2, CITY_AREA_KM
+        )
+        graph.add_edge(
+            start,
+            end,
+            float(edge.get("km", straight * DETOUR_FACTOR)),
+            float(edge["speed_kmh"]),
+            toll=float(edge.get("toll", 0.0)),
+            group=("city", nearest[0]["name"].lower()) if nearest else FIXED_GROUP,
+            name=edge.get("name"),
+            oneway=bool(edge.get("oneway", False))
+        )
+    logger.info(f"🛣️ Loaded {len(ids)} nodes and {len(spec.get('edges', []))} edges from {path}")
+
+# Initialize graph
+road_graph = build_road_graph(os.getenv("ROAD_GRAPH_FILE"))
@@ -0,0 +1,294 @@
+"""
+Shared cache backends so that gunicorn workers share TomTom data
+instead of each worker fetching and holding its own copy
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+def new_token() -> str:
+    """A lease token unique to one acquire"""
+    return f"{os.getpid()}-{uuid.uuid4().hex}"
+
+class SharedCache:
+    """Interface shared by all cache backends.
+
+    Values are JSON-serialisable objects. Leases implement single-writer
+    election: only the caller holding ``acquire(key)`` refreshes that key,
+    the others wait for its result. Each acquire gets its own token, so two
+    coroutines of one worker exclude each other just as two workers do.
+    """
+
+    async def get(self, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any, ttl: float):
+        raise NotImplementedError
+
+    async def acquire(self, key: str, ttl: float, token: Optional[str] = None) -> Optional[str]:
+        """Try to take the write lease for ``key`` for ``ttl`` seconds.
+
+        Returns the lease token, or None if someone else holds the lease.
+        Passing the token of a lease still held renews it, so a long-lived
+        leader can keep its lease from one round to the next.
+        """
+        raise NotImplementedError
+
+    async def release(self, key: str, token: str):
+        """Give up a lease, if ``token`` still holds it"""
+        raise NotImplementedError
+
+class MemoryCache(SharedCache):
+    """Per-process cache, for single-worker development setups"""
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[float, Any]] = {}
+        self._leases: Dict[str, Tuple[float, str]] = {}
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del self._values[key]
+            return None
+        return entry[1]
+
+    async def set(self, key: str, value: Any, ttl: float):
+        self._values[key] = (time.time() + ttl, value)
+
+    async def acquire(self, key: str, ttl: float, token: Optional[str] = None) -> Optional[str]:
+        now = time.time()
+        expires_at, holder = self._leases.get(key, (0.0, None))
+        if expires_at > now and (token is None or holder != token):
+            return None
+        token = token or new_token()
+        self._leases[key] = (now + ttl, token)
+        return token
+
+    async def release(self, key: str, token: str):
+        if self._leases.get(key, (0.0, None))[1] == token:
+            del self._leases[key]
+
+class SQLiteCache(SharedCache):
+    """Cache in a local SQLite file shared by every worker on the host.
+
+    WAL mode lets readers proceed while one worker writes. Connections are
+    opened lazily per process, so the cache is safe to create before
+    gunicorn forks its workers.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._conn_pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._locked, func, *args)
+
+    def _locked(self, func, *args):
+        with self._lock:
+            return func(self._connection(), *args)
+
+    @staticmethod
+    def _get(conn: sqlite3.Connection, key: str, now: float) -> Optional[str]:
+        row = conn.execute("SELECT value FROM cache WHERE key = ? AND expires_at >= ?", (key, now)).fetchone()
+        return row[0] if row else None
+
+    def _set(self, conn: sqlite3.Connection, key: str, value: str, expires_at: float):
+        conn.execute(
+            "INSERT INTO cache (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+            (key, value, expires_at)
+        )
+        # Expired rows are only overwritten, never read; sweep them now and then
+        self._writes += 1
+        if self._writes % 500 == 0:
+            conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+
+    @staticmethod
+    def _acquire(conn: sqlite3.Connection, key: str, owner: str, now: float, ttl: float) -> bool:
+        # Taken over only once expired, or renewed by the token that holds it
+        cursor = conn.execute(
+            "INSERT INTO leases (key, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.expires_at < ? OR leases.owner = excluded.owner",
+            (key, owner, now + ttl, now)
+        )
+        return cursor.rowcount > 0
+
+    @staticmethod
+    def _release(conn: sqlite3.Connection, key: str, owner: str):
+        conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = await self._run(self._get, key, time.time())
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await self._run(self._set, key, json.dumps(value), time.time() + ttl)
+
+    async def acquire(self, key: str, ttl: float, token: Optional[str] = None) -> Optional[str]:
+        token = token or new_token()
+        return token if await self._run(self._acquire, key, token, time.time(), ttl) else None
+
+    async def release(self, key: str, token: str):
+        await self._run(self._release, key, token)
+
+class RedisError(Exception):
+    """Error reply from a Redis-protocol server"""
+
+class RedisCache(SharedCache):
+    """Cache on any server speaking the Redis protocol (RESP).
+
+    Only GET, SET (with PX/NX/XX) and DEL are used, so Redis, KeyDB, Dragonfly
+    or a small local stand-in all work.
+    """
+
+    def __init__(self, url: str, prefix: str = "trafficwise:"):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.prefix = prefix
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            if self.password:
+                await self._send("AUTH", self.password)
+            if self.db:
+                await self._send("SELECT", str(self.db))
+        except BaseException:
+            # Never leave a connection that is not authenticated or on the wrong db for the next command
+            self._writer.close()
+            self._reader = self._writer = None
+            raise
+
+    async def _send(self, *args: str) -> Any:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg.encode() if isinstance(arg, str) else arg
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        self._writer.write(b"".join(parts))
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def _read_reply(self) -> Any:
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RedisError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(payload)
+            if count < 0:
+                return None
+            return [await self._read_reply() for _ in range(count)]
+        raise RedisError(f"Unexpected reply type: {line!r}")
+
+    async def _command(self, *args: str) -> Any:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._writer is None or self._writer.is_closing():
+                await self._connect()
+            try:
+                return await self._send(*args)
+            except RedisError:
+                # An error reply was read in full; the connection is still in step
+                raise
+            except BaseException:
+                # Broken, or cancelled between sending and reading the reply: an unread
+                # reply would be taken as the next command's, so start a new connection
+                self._writer.close()
+                self._reader = self._writer = None
+                raise
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = await self._command("GET", self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await self._command("SET", self.prefix + key, json.dumps(value), "PX", str(int(ttl * 1000)))
+
+    async def acquire(self, key: str, ttl: float, token: Optional[str] = None) -> Optional[str]:
+        lease_key = self.prefix + "lease:" + key
+        if token is not None:
+            # Renew with XX so an expired lease is not recreated here; NX below takes it fresh
+            holder = await self._command("GET", lease_key)
+            if holder is not None and holder.decode() == token:
+                if await self._command("SET", lease_key, token, "XX", "PX", str(int(ttl * 1000))) == "OK":
+                    return token
+        token = token or new_token()
+        reply = await self._command("SET", lease_key, token, "NX", "PX", str(int(ttl * 1000)))
+        return token if reply == "OK" else None
+
+    async def release(self, key: str, token: str):
+        # GET + DEL rather than a Lua script keeps stand-in servers usable; a
+        # lease that expires in between is at worst released one refresh early
+        lease_key = self.prefix + "lease:" + key
+        holder = await self._command("GET", lease_key)
+        if holder is not None and holder.decode() == token:
+            await self._command("DEL", lease_key)
+
+def cache_from_env() -> SharedCache:
+    """Build the cache backend selected by CACHE_BACKEND (sqlite, redis or memory)"""
+    backend = os.getenv("CACHE_BACKEND", "sqlite").lower()
+
+    if backend == "redis":
+        cache = RedisCache(os.getenv("CACHE_URL", "redis://localhost:6379/0"))
+        # Not the URL itself: it may carry the password
+        logger.info(f"🗄️ Using Redis-protocol shared cache at {cache.host}:{cache.port}/{cache.db}")
+        return cache
+    if backend == "memory":
+        logger.info("🗄️ Using per-process memory cache")
+        return MemoryCache()
+
+    path = os.getenv("CACHE_PATH", os.path.join(tempfile.gettempdir(), "trafficwise_cache.sqlite3"))
+    logger.info(f"🗄️ Using SQLite shared cache at {path}")
+    return SQLiteCache(path)
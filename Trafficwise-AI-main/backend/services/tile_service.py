@@ -0,0 +1,336 @@
+"""
+Caching proxy for TomTom traffic flow and incident map tiles
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+
+import anyio
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+from services.tomtom_service import tomtom_service
+
+logger = logging.getLogger(__name__)
+
+# TomTom raster/vector traffic tile styles per layer
+TILE_STYLES = {
+    "flow": {"absolute", "relative", "relative0", "relative0-dark", "relative-delay", "reduced-sensitivity"},
+    "incidents": {"s0", "s0-dark", "s1", "s2", "s3", "night"}
+}
+DEFAULT_STYLES = {"flow": "relative0", "incidents": "s3"}
+CONTENT_TYPES = {"png": "image/png", "pbf": "application/vnd.mapbox-vector-tile"}
+
+def lat_lon_to_tile(lat: float, lon: float, zoom: int) -> Tuple[int, int]:
+    """Slippy-map tile containing a point"""
+    n = 2 ** zoom
+    lat_rad = math.radians(max(min(lat, 85.0511), -85.0511))
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+class TileFileResponse(FileResponse):
+    """FileResponse over a file already opened by the cache lookup.
+
+    The body is streamed from the open file, not reopened by path, so an
+    eviction between lookup and response cannot remove it. The file is
+    closed once sent.
+    """
+
+    def __init__(self, file: BinaryIO, **kwargs):
+        self.file = file
+        super().__init__(file.name, stat_result=os.fstat(file.fileno()), **kwargs)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            more_body = not self.send_header_only
+            chunk = b""
+            while more_body:
+                chunk = await anyio.to_thread.run_sync(self.file.read, self.chunk_size)
+                more_body = len(chunk) == self.chunk_size
+                if more_body:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": chunk, "more_body": False})
+        finally:
+            self.file.close()
+        if self.background is not None:
+            await self.background()
+
+class TileCache:
+    """Size-bounded LRU cache of tiles on disk.
+
+    Tile bodies are stored once per SHA-256 digest, so the many identical
+    tiles TomTom returns (empty flow tiles over open country) share one
+    file. A SQLite index maps tile keys to digests and tracks last access
+    for eviction; it is shared by every worker on the host, together with a
+    running total of the bytes on disk so a store only scans the index
+    when the cache is over its limit. Each process reconciles the total
+    with the index when it opens it.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._conn_pid != os.getpid():
+            os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+            conn = sqlite3.connect(
+                os.path.join(self.root, "index.sqlite3"), timeout=5.0, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tiles (tile_key TEXT PRIMARY KEY, digest TEXT NOT NULL, "
+                "size INTEGER NOT NULL, fetched_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS tiles_last_access ON tiles (last_access)")
+            conn.execute("CREATE INDEX IF NOT EXISTS tiles_digest ON tiles (digest)")
+            conn.execute("CREATE TABLE IF NOT EXISTS usage (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL)")
+            with self._transaction(conn):
+                # Disk usage counts each stored object once, however many tiles share it
+                total = conn.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM (SELECT digest, MAX(size) AS size FROM tiles GROUP BY digest)"
+                ).fetchone()[0]
+                conn.execute("INSERT OR REPLACE INTO usage (id, bytes) VALUES (0, ?)", (total,))
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    @contextmanager
+    def _transaction(conn: sqlite3.Connection):
+        # IMMEDIATE takes the write lock up front, so workers update the byte total one at a time
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._locked, func, *args)
+
+    def _locked(self, func, *args):
+        with self._lock:
+            return func(self._connection(), *args)
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def _lookup(self, conn: sqlite3.Connection, tile_key: str) -> Optional[Tuple[str, float, BinaryIO]]:
+        row = conn.execute("SELECT digest, fetched_at, last_access FROM tiles WHERE tile_key = ?", (tile_key,)).fetchone()
+        if row is None:
+            return None
+        digest, fetched_at, last_access = row
+        # Opened now rather than when responding: an open file stays readable if
+        # another worker evicts it in between
+        try:
+            file = open(self.object_path(digest), "rb")
+        except FileNotFoundError:
+            return None
+        now = time.time()
+        # Touching on every hit would turn reads into writes; a minute of LRU slack is fine
+        if now - last_access > 60:
+            conn.execute("UPDATE tiles SET last_access = ? WHERE tile_key = ?", (now, tile_key))
+        return digest, fetched_at, file
+
+    def _store(self, conn: sqlite3.Connection, tile_key: str, body: bytes) -> str:
+        digest = hashlib.sha256(body).hexdigest()
+        path = self.object_path(digest)
+        now = time.time()
+        evicted = 0
+        with self._transaction(conn):
+            added = 0
+            if conn.execute("SELECT 1 FROM tiles WHERE digest = ? LIMIT 1", (digest,)).fetchone() is None:
+                added = len(body)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(body)
+                os.replace(tmp_path, path)
+
+            previous = conn.execute("SELECT digest, size FROM tiles WHERE tile_key = ?", (tile_key,)).fetchone()
+            conn.execute(
+                "INSERT INTO tiles (tile_key, digest, size, fetched_at, last_access) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(tile_key) DO UPDATE SET digest = excluded.digest, size = excluded.size, "
+                "fetched_at = excluded.fetched_at, last_access = excluded.last_access",
+                (tile_key, digest, len(body), now, now)
+            )
+            if previous and previous[0] != digest:
+                added -= self._remove_if_orphaned(conn, previous[0], previous[1])
+            conn.execute("UPDATE usage SET bytes = bytes + ?", (added,))
+            total = conn.execute("SELECT bytes FROM usage").fetchone()[0]
+            if total > self.max_bytes:
+                evicted = self._evict(conn, total)
+        if evicted:
+            logger.info(f"🧹 Evicted {evicted} map tiles from disk cache")
+        return digest
+
+    def _remove_if_orphaned(self, conn: sqlite3.Connection, digest: str, size: int) -> int:
+        """Delete an object no tile refers to any more; returns the bytes freed"""
+        if conn.execute("SELECT 1 FROM tiles WHERE digest = ? LIMIT 1", (digest,)).fetchone() is not None:
+            return 0
+        try:
+            os.remove(self.object_path(digest))
+        except FileNotFoundError:
+            pass
+        return size
+
+    def _evict(self, conn: sqlite3.Connection, total: int) -> int:
+        # Evict down to 90% so that eviction does not run on every store
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for tile_key, digest, size in conn.execute("SELECT tile_key, digest, size FROM tiles ORDER BY last_access").fetchall():
+            if total <= target:
+                break
+            conn.execute("DELETE FROM tiles WHERE tile_key = ?", (tile_key,))
+            total -= self._remove_if_orphaned(conn, digest, size)
+            evicted += 1
+        conn.execute("UPDATE usage SET bytes = ?", (total,))
+        return evicted
+
+    async def lookup(self, tile_key: str) -> Optional[Tuple[str, float, BinaryIO]]:
+        """Digest, fetch time and open file of a cached tile, if its file is still present; the caller closes the file"""
+        return await self._run(self._lookup, tile_key)
+
+    async def store(self, tile_key: str, body: bytes) -> str:
+        return await self._run(self._store, tile_key, body)
+
+class TileService:
+    """Serves TomTom traffic tiles from the disk cache, fetching misses once"""
+
+    def __init__(self):
+        self.cache = TileCache(
+            root=os.getenv("TILE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "trafficwise_tiles")),
+            max_bytes=int(float(os.getenv("TILE_CACHE_MAX_MB", 512)) * 1024 * 1024)
+        )
+        self.ttl = float(os.getenv("TILE_TTL", 300))
+        self.prefetch_min_zoom = int(os.getenv("TILE_PREFETCH_MIN_ZOOM", 8))
+        self.prefetch_max_zoom = int(os.getenv("TILE_PREFETCH_MAX_ZOOM", 12))
+        self.prefetch_concurrency = int(os.getenv("TILE_PREFETCH_CONCURRENCY", 4))
+        # Concurrent misses for the same tile share a single upstream fetch
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._lease: Optional[str] = None
+
+    @staticmethod
+    def tile_key(layer: str, style: str, zoom: int, x: int, y: int, fmt: str) -> str:
+        return f"{layer}/{style}/{zoom}/{x}/{y}.{fmt}"
+
+    async def get_tile(self, layer: str, style: str, zoom: int, x: int, y: int, fmt: str) -> Dict:
+        """Return a tile, fetching it from TomTom when missing or stale.
+
+        A cache hit carries the tile's open ``file``, which the caller must
+        close (``TileFileResponse`` does); a fetched tile carries its ``body``.
+        """
+        tile_key = self.tile_key(layer, style, zoom, x, y, fmt)
+        entry = await self.cache.lookup(tile_key)
+        if entry is not None and time.time() - entry[1] < self.ttl:
+            digest, fetched_at, file = entry
+            return {**self._tile_result(digest, fetched_at, fmt), "file": file}
+        try:
+            if tile_key in self._in_flight:
+                return await asyncio.shield(self._in_flight[tile_key])
+
+            future = asyncio.get_running_loop().create_future()
+            self._in_flight[tile_key] = future
+            try:
+                result = await self._fetch(tile_key, layer, style, zoom, x, y, fmt)
+                if not result["success"] and entry is not None:
+                    # Serve the stale tile rather than a broken map; as bytes, since concurrent waiters share the result
+                    digest, fetched_at, file = entry
+                    body = await asyncio.get_running_loop().run_in_executor(None, file.read)
+                    result = {**self._tile_result(digest, fetched_at, fmt), "body": body}
+                future.set_result(result)
+                return result
+            except Exception as e:
+                future.set_exception(e)
+                raise
+            finally:
+                del self._in_flight[tile_key]
+                if not future.done():
+                    future.cancel()
+        finally:
+            if entry is not None:
+                entry[2].close()
+
+    async def _fetch(self, tile_key: str, layer: str, style: str, zoom: int, x: int, y: int, fmt: str) -> Dict:
+        response = await tomtom_service.get_map_tile(layer, style, zoom, x, y, fmt)
+        if response.status_code != 200:
+            return {
+                "success": False,
+                "error": f"TomTom API error: {response.status_code}",
+                "status_code": response.status_code
+            }
+        digest = await self.cache.store(tile_key, response.content)
+        return {**self._tile_result(digest, time.time(), fmt), "body": response.content}
+
+    def _tile_result(self, digest: str, fetched_at: float, fmt: str) -> Dict:
+        return {
+            "success": True,
+            "etag": f'"{digest}"',
+            "media_type": CONTENT_TYPES[fmt],
+            "max_age": max(int(self.ttl - (time.time() - fetched_at)), 0)
+        }
+
+    def pyramid(self, lat: float, lon: float, radius_deg: float = 0.18) -> Iterator[Tuple[int, int, int]]:
+        """Tiles covering a box around a point at every prefetch zoom level"""
+        for zoom in range(self.prefetch_min_zoom, self.prefetch_max_zoom + 1):
+            min_x, min_y = lat_lon_to_tile(lat + radius_deg, lon - radius_deg, zoom)
+            max_x, max_y = lat_lon_to_tile(lat - radius_deg, lon + radius_deg, zoom)
+            for x in range(min_x, max_x + 1):
+                for y in range(min_y, max_y + 1):
+                    yield zoom, x, y
+
+    async def prefetch(self, layers=("flow", "incidents")):
+        """Warm the cache with the tile pyramid around every supported city"""
+        semaphore = asyncio.Semaphore(self.prefetch_concurrency)
+        tiles = {
+            (layer, zoom, x, y)
+            for coords in tomtom_service.pakistan_cities.values()
+            for zoom, x, y in self.pyramid(coords["lat"], coords["lon"])
+            for layer in layers
+        }
+
+        async def fetch_one(layer, zoom, x, y):
+            async with semaphore:
+                try:
+                    result = await self.get_tile(layer, DEFAULT_STYLES[layer], zoom, x, y, "png")
+                    if "file" in result:
+                        result["file"].close()
+                except Exception as e:
+                    logger.warning(f"⚠️ Tile prefetch failed for {layer}/{zoom}/{x}/{y}: {str(e)}")
+
+        started = time.monotonic()
+        await asyncio.gather(*(fetch_one(*tile) for tile in tiles))
+        logger.info(f"🗺️ Prefetched {len(tiles)} map tiles in {time.monotonic() - started:.1f}s")
+
+    async def prefetch_loop(self):
+        """Keep the city tile pyramids fresh; only one worker does this at a time"""
+        while True:
+            try:
+                # Renewed each round, and held across the sleep, so the prefetch stays in one worker
+                self._lease = await tomtom_service.cache.acquire("tile-prefetch", ttl=self.ttl * 2, token=self._lease)
+                if self._lease is not None:
+                    await self.prefetch()
+            except Exception as e:
+                logger.error(f"Error prefetching map tiles: {str(e)}")
+            await asyncio.sleep(self.ttl)
+
+# Initialize service
+tile_service = TileService()
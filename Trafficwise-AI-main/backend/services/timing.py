@@ -0,0 +1,194 @@
+"""
+Per-request timing spans, Server-Timing header and sampled profiling
+"""
+
+import contextvars
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.responses import JSONResponse
+from starlette.datastructures import MutableHeaders
+
+logger = logging.getLogger(__name__)
+
+class RequestTimings:
+    """Spans recorded while serving a single request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # Each span is [name, start, end]; end stays None while the span is open
+        self.spans: List[list] = []
+
+    def open(self, name: str) -> list:
+        entry = [name, time.perf_counter(), None]
+        self.spans.append(entry)
+        return entry
+
+    def record(self, name: str, duration_ms: float):
+        """Record a phase that was measured elsewhere (e.g. time spent queued)"""
+        end = time.perf_counter()
+        self.spans.append([name, end - duration_ms / 1000, end])
+
+    def summary(self, now: Optional[float] = None) -> Dict[str, float]:
+        """Wall-clock milliseconds per span name.
+
+        Overlapping spans with the same name (concurrent upstream calls from
+        ``asyncio.gather``) are merged, so the figure is time actually waited.
+        """
+        now = now or time.perf_counter()
+        intervals: Dict[str, List[Tuple[float, float]]] = {}
+        for name, start, end in self.spans:
+            intervals.setdefault(name, []).append((start, end if end is not None else now))
+
+        result = {}
+        for name, items in intervals.items():
+            items.sort()
+            total = 0.0
+            current_start, current_end = items[0]
+            for start, end in items[1:]:
+                if start > current_end:
+                    total += current_end - current_start
+                    current_start, current_end = start, end
+                else:
+                    current_end = max(current_end, end)
+            total += current_end - current_start
+            result[name] = total * 1000
+        return result
+
+    def header(self) -> str:
+        """Format the spans as a Server-Timing header value"""
+        now = time.perf_counter()
+        entries = [f"{name};dur={duration:.1f}" for name, duration in self.summary(now).items()]
+        entries.append(f"total;dur={(now - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+_current_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+def current_timings() -> Optional[RequestTimings]:
+    """Timings of the request being served, if any"""
+    return _current_timings.get()
+
+@contextmanager
+def span(name: str):
+    """Record the enclosed block as a named phase of the current request.
+
+    Outside of a request (background jobs, scripts) this is a no-op.
+    """
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+
+    entry = timings.open(name)
+    try:
+        yield
+    finally:
+        entry[2] = time.perf_counter()
+
+class TimedJSONResponse(JSONResponse):
+    """JSON response that reports serialization and gzip/send time as spans"""
+
+    def render(self, content) -> bytes:
+        with span("serialize"):
+            return super().render(content)
+
+    async def __call__(self, scope, receive, send):
+        # GZipMiddleware compresses the body before the outer send sees the
+        # response start, so this span covers compression when it applies
+        with span("respond"):
+            await super().__call__(scope, receive, send)
+
+class SampledProfiler:
+    """Profile a random sample of requests and keep the slow ones on disk"""
+
+    def __init__(self, sample_rate: float, threshold_ms: float, output_dir: str):
+        self.sample_rate = sample_rate
+        self.threshold_ms = threshold_ms
+        self.output_dir = output_dir
+        self._active = False
+
+    def start(self) -> Optional[cProfile.Profile]:
+        # Only one profiler can run per thread, and the event loop serves every
+        # request on one thread, so at most one request is profiled at a time.
+        if self.sample_rate <= 0 or self._active or random.random() >= self.sample_rate:
+            return None
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already attached to this thread
+            return None
+        self._active = True
+        return profiler
+
+    def finish(self, profiler: cProfile.Profile, path: str, duration_ms: float):
+        profiler.disable()
+        self._active = False
+
+        if duration_ms < self.threshold_ms:
+            return
+
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            slug = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_") or "root"
+            filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{slug}-{int(duration_ms)}ms.prof"
+            profile_path = os.path.join(self.output_dir, filename)
+            profiler.dump_stats(profile_path)
+            logger.info(f"📈 Saved profile for slow request {path} ({duration_ms:.0f} ms) to {profile_path}")
+        except OSError as e:
+            logger.warning(f"⚠️ Could not save request profile: {str(e)}")
+
+class ServerTimingMiddleware:
+    """ASGI middleware that collects spans per request and emits Server-Timing.
+
+    Register it as the outermost middleware so that the header is added after
+    compression has happened.
+    """
+
+    def __init__(self, app, profiler: Optional[SampledProfiler] = None):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        profile = self.profiler.start() if self.profiler else None
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timings.header())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_timings.reset(token)
+            if profile is not None:
+                duration_ms = (time.perf_counter() - timings.started) * 1000
+                self.profiler.finish(profile, scope.get("path", ""), duration_ms)
+
+def profiler_from_env() -> Optional[SampledProfiler]:
+    """Build the request profiler from PROFILE_* environment variables"""
+    sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    if sample_rate <= 0:
+        return None
+
+    return SampledProfiler(
+        sample_rate=sample_rate,
+        threshold_ms=float(os.getenv("PROFILE_THRESHOLD_MS", "500")),
+        output_dir=os.getenv("PROFILE_DIR", "profiles")
+    )
@@ -1,42 +1,255 @@
 import os
 import httpx
 import asyncio
-from typing import Optional, Dict, List, Any
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, List, Any, AsyncIterator, Callable, Tuple
 from fastapi import HTTPException
 import logging
 
+from services.timing import span
+from services.city_registry import city_registry
+from services.shared_cache import cache_from_env
+from services.capture import capture_from_env
+from services.rate_limit import TokenBucket
+from services.json_stream import iter_json_array
+from services.geometry import encode_polyline, meters_per_pixel, project, simplify
+
 logger = logging.getLogger(__name__)
 
+# min_lon, min_lat, max_lon, max_lat
+PAKISTAN_BBOX = (60.87, 23.69, 77.84, 37.08)
+
+# Pakistan Standard Time (no daylight saving)
+PAKISTAN_TZ = timezone(timedelta(hours=5))
+
+def normalize_query(query: str) -> str:
+    """Search text as compared for caching and de-duplication"""
+    return " ".join(query.casefold().split()).strip(" .,;:")
+
 class TomTomService:
     def __init__(self):
+        # Upstream responses can be recorded, or replayed offline without calling TomTom
+        self.capture = capture_from_env()
+        
         self.api_key = os.getenv("TOMTOM_API_KEY")
         if not self.api_key:
-            raise ValueError("TomTom API key not found in environment variables")
+            if self.capture.mode != "replay":
+                raise ValueError("TomTom API key not found in environment variables")
+            self.api_key = "replay"
         
         self.base_url = "https://api.tomtom.com"
         self.timeout = 30.0
         
+        # Shared across gunicorn workers so each city is fetched once, not once per worker
+        self.cache = cache_from_env()
+        self.flow_ttl = float(os.getenv("FLOW_CACHE_TTL", 60))
+        self.incidents_ttl = float(os.getenv("INCIDENTS_CACHE_TTL", 120))
+        
+        # In-process indexes (clusters, alerts, ...) subscribe to data refreshes
+        self._listeners: Dict[str, List[Callable[[str, Dict[str, Any]], None]]] = {}
+        self._seen_versions: Dict[str, float] = {}
+        # Recorders (history, ...) hear each new result once, from the worker that fetched it
+        self._fetch_listeners: Dict[str, List[Callable[[str, Dict[str, Any], float], None]]] = {}
+        
+        # Large incident regions are split into tiles fetched concurrently
+        self.incident_tile_min_deg = float(os.getenv("INCIDENT_TILE_MIN_DEG", 0.18))
+        self.incident_tile_max_deg = float(os.getenv("INCIDENT_TILE_MAX_DEG", 0.9))  # TomTom caps box area at 10,000 km²
+        self.incident_target_tiles = int(os.getenv("INCIDENT_TARGET_TILES", 64))
+        self.incident_concurrency = int(os.getenv("INCIDENT_FETCH_CONCURRENCY", 8))
+        # Upper bound on the upstream calls one region request may make (all of Pakistan needs 285)
+        self.incident_max_tiles = int(os.getenv("INCIDENT_MAX_TILES", 300))
+        
+        # Route lines are simplified to about one pixel of error at each of these zooms
+        self.route_simplify_zooms = [int(zoom) for zoom in os.getenv("ROUTE_SIMPLIFY_ZOOMS", "6,9,12,15").split(",")]
+        self.route_simplify_px = float(os.getenv("ROUTE_SIMPLIFY_TOLERANCE_PX", 1.0))
+        
+        # Departure-time sweeps
+        self.sweep_concurrency = int(os.getenv("ROUTE_SWEEP_CONCURRENCY", 6))
+        self.sweep_cache_ttl = float(os.getenv("ROUTE_SWEEP_CACHE_TTL", 600))
+        self.sweep_max_candidates = int(os.getenv("ROUTE_SWEEP_MAX_CANDIDATES", 48))
+        
+        # Place search results change rarely; bulk searches share one upstream budget
+        self.search_ttl = float(os.getenv("SEARCH_CACHE_TTL", 21600))
+        self.search_budget = TokenBucket(rate=float(os.getenv("SEARCH_BULK_CALLS_PER_SECOND", 5)))
+        self.search_bulk_concurrency = int(os.getenv("SEARCH_BULK_CONCURRENCY", 8))
+        
         # Pakistan major cities coordinates
-        self.pakistan_cities = {
-            "karachi": {"lat": 24.8607, "lon": 67.0011, "zoom": 11},
-            "lahore": {"lat": 31.5204, "lon": 74.3587, "zoom": 11},
-            "islamabad": {"lat": 33.6844, "lon": 73.0479, "zoom": 11},
-            "rawalpindi": {"lat": 33.5651, "lon": 73.0169, "zoom": 12},
-            "faisalabad": {"lat": 31.4504, "lon": 73.1350, "zoom": 11},
-            "multan": {"lat": 30.1575, "lon": 71.5249, "zoom": 11},
-            "peshawar": {"lat": 34.0151, "lon": 71.5249, "zoom": 11},
-            "quetta": {"lat": 30.1798, "lon": 66.9750, "zoom": 11},
-            "sialkot": {"lat": 32.4945, "lon": 74.5229, "zoom": 12},
-            "gujranwala": {"lat": 32.1877, "lon": 74.1945, "zoom": 12},
-            "hyderabad": {"lat": 25.3960, "lon": 68.3578, "zoom": 11},
-            "bahawalpur": {"lat": 29.4000, "lon": 71.6833, "zoom": 11},
-            "sargodha": {"lat": 32.0836, "lon": 72.6711, "zoom": 11},
-            "sukkur": {"lat": 27.7058, "lon": 68.8574, "zoom": 11},
-            "larkana": {"lat": 27.5590, "lon": 68.2120, "zoom": 11}
-        }
+        self.pakistan_cities = city_registry.coordinates()
+
+    def _client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(timeout=self.timeout, transport=self.capture.transport())
+
+    async def _get(self, url: str, params: Dict[str, Any]) -> httpx.Response:
+        """GET a TomTom endpoint, recording the wait as the request's upstream span"""
+        async with self._client() as client:
+            with span("upstream"):
+                return await client.get(url, params=params)
+
+    def on_refresh(self, kind: str, callback: Callable[[str, Dict[str, Any]], None]):
+        """Call ``callback(city, data)`` whenever this worker sees new ``flow`` or ``incidents`` data"""
+        self._listeners.setdefault(kind, []).append(callback)
+
+    def on_fetch(self, kind: str, callback: Callable[[str, Dict[str, Any], float], None]):
+        """Call ``callback(city, data, fetched_at)`` whenever this worker fetches new ``flow`` or ``incidents`` data"""
+        self._fetch_listeners.setdefault(kind, []).append(callback)
+
+    def _observe(self, key: str, entry: Dict[str, Any]):
+        """Notify listeners once per cache entry version"""
+        kind, _, city = key.partition(":")
+        listeners = self._listeners.get(kind)
+        if not listeners or self._seen_versions.get(key) == entry["fetched_at"]:
+            return
+        self._seen_versions[key] = entry["fetched_at"]
+        
+        for callback in listeners:
+            try:
+                callback(city, entry["result"]["data"])
+            except Exception as e:
+                logger.error(f"Error in {kind} refresh listener for {city}: {str(e)}")
+
+    async def _fetch_entry(self, key: str, fetch) -> Dict[str, Any]:
+        result = await fetch()
+        entry = {"fetched_at": time.time(), "result": result}
+        if result.get("success"):
+            kind, _, city = key.partition(":")
+            for callback in self._fetch_listeners.get(kind, []):
+                try:
+                    callback(city, result["data"], entry["fetched_at"])
+                except Exception as e:
+                    logger.error(f"Error in {kind} fetch listener for {city}: {str(e)}")
+            self._observe(key, entry)
+        return entry
+
+    async def cached(self, key: str, ttl: float, fetch) -> Dict[str, Any]:
+        """Serve a result from the shared cache, refreshing it from a single worker on a miss.
+        
+        ``key`` is ``kind:name``; refresh listeners registered for ``kind`` see new results.
+        """
+        try:
+            with span("cache"):
+                entry = await self.cache.get(key)
+            if entry is not None:
+                self._observe(key, entry)
+                return entry["result"]
+            
+            lease = await self.cache.acquire(key, ttl=self.timeout)
+            if lease is None:
+                # Another worker is refreshing this key; wait for its result
+                deadline = time.monotonic() + self.timeout
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(0.1)
+                    entry = await self.cache.get(key)
+                    if entry is not None:
+                        self._observe(key, entry)
+                        return entry["result"]
+                logger.warning(f"⚠️ Timed out waiting for another worker to refresh {key}")
+                return (await self._fetch_entry(key, fetch))["result"]
+        except Exception as e:
+            logger.warning(f"⚠️ Shared cache unavailable for {key}: {str(e)}")
+            return (await self._fetch_entry(key, fetch))["result"]
+        
+        try:
+            entry = await self._fetch_entry(key, fetch)
+            if entry["result"].get("success"):
+                await self.cache.set(key, entry, ttl)
+            return entry["result"]
+        finally:
+            try:
+                await self.cache.release(key, lease)
+            except Exception as e:
+                logger.warning(f"⚠️ Could not release cache lease for {key}: {str(e)}")
 
     async def get_traffic_flow(self, city: str) -> Dict[str, Any]:
         """Get traffic flow data for a Pakistani city"""
+        return await self.cached(f"flow:{city.lower()}", self.flow_ttl, lambda: self._fetch_traffic_flow(city))
+
+    async def get_traffic_incidents(self, city: str) -> Dict[str, Any]:
+        """Get traffic incidents for a Pakistani city"""
+        return await self.cached(f"incidents:{city.lower()}", self.incidents_ttl, lambda: self._fetch_traffic_incidents(city))
+
+    async def refresh_city(self, kind: str, city: str, ttl: float) -> Dict[str, Any]:
+        """Fetch a city's ``flow`` or ``incidents`` now, bypassing the cache, and store the result for ``ttl`` seconds"""
+        fetch = {"flow": self._fetch_traffic_flow, "incidents": self._fetch_traffic_incidents}[kind]
+        key = f"{kind}:{city.lower()}"
+        entry = await self._fetch_entry(key, lambda: fetch(city))
+        if entry["result"].get("success"):
+            await self.cache.set(key, entry, ttl)
+        return entry["result"]
+
+    async def observe_cached(self, kind: str, city: str) -> bool:
+        """Pass a city's cached ``flow`` or ``incidents`` to this worker's refresh listeners, never calling TomTom"""
+        key = f"{kind}:{city.lower()}"
+        entry = await self.cache.get(key)
+        if entry is None:
+            return False
+        self._observe(key, entry)
+        return True
+
+    def city_bbox(self, city: str) -> Tuple[float, float, float, float]:
+        """Box searched for a city's incidents (approximately 20km radius)"""
+        coords = self.pakistan_cities[city.lower()]
+        offset = 0.18  # ~20km
+        return coords["lon"] - offset, coords["lat"] - offset, coords["lon"] + offset, coords["lat"] + offset
+
+    def refresh_cost(self, kind: str, city: str) -> int:
+        """Upstream calls made by one ``flow`` or ``incidents`` refresh of a city"""
+        # A city box is well inside TomTom's maximum, so either is a single call
+        return 1
+
+    async def get_point_flow(self, lat: float, lon: float, include_geometry: bool = False) -> Dict[str, Any]:
+        """Get traffic flow on the major road nearest to a point (not cached)
+        
+        With ``include_geometry`` the result also has the measured road ``segment`` as [lat, lon] points.
+        """
+        try:
+            # Zoom 10 snaps to motorways and highways rather than side streets
+            url = f"{self.base_url}/traffic/services/4/flowSegmentData/absolute/10/json"
+            params = {
+                "key": self.api_key,
+                "point": f"{lat},{lon}",
+                "unit": "KMPH"
+            }
+            
+            response = await self._get(url, params)
+            
+            if response.status_code == 200:
+                with span("parse"):
+                    segment = response.json().get("flowSegmentData", {})
+                data = {
+                    "current_speed": segment.get("currentSpeed", 0),
+                    "free_flow_speed": segment.get("freeFlowSpeed", 0),
+                    "confidence": segment.get("confidence", 0),
+                    "road_closure": segment.get("roadClosure", False),
+                    "road_class": segment.get("frc", "")
+                }
+                if include_geometry:
+                    data["segment"] = [
+                        [point["latitude"], point["longitude"]]
+                        for point in segment.get("coordinates", {}).get("coordinate", [])
+                    ]
+                return {
+                    "success": True,
+                    "data": data
+                }
+            else:
+                return {
+                    "success": False,
+                    "error": f"TomTom API error: {response.status_code}",
+                    "message": response.text
+                }
+                
+        except Exception as e:
+            logger.error(f"Error getting traffic flow at {lat},{lon}: {str(e)}")
+            return {
+                "success": False,
+                "error": "Internal server error",
+                "message": str(e)
+            }
+
+    async def _fetch_traffic_flow(self, city: str) -> Dict[str, Any]:
+        """Fetch traffic flow data for a Pakistani city from TomTom"""
         try:
             city_lower = city.lower()
             if city_lower not in self.pakistan_cities:
@@ -52,12 +265,13 @@ class TomTomService:
                 "unit": "KMPH"
             }
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(url, params=params)
-                
-                if response.status_code == 200:
+            response = await self._get(url, params)
+            
+            if response.status_code == 200:
+                with span("parse"):
                     data = response.json()
-                    
+                
+                with span("logic"):
                     # Process and format the traffic data
                     traffic_info = {
                         "city": city.title(),
@@ -70,7 +284,7 @@ class TomTomService:
                         "confidence": data.get("flowSegmentData", {}).get("confidence", 0),
                         "road_closure": data.get("flowSegmentData", {}).get("roadClosure", False)
                     }
-                    
+                
                     # Calculate traffic level
                     if traffic_info["current_speed"] > 0 and traffic_info["free_flow_speed"] > 0:
                         speed_ratio = traffic_info["current_speed"] / traffic_info["free_flow_speed"]
@@ -86,18 +300,18 @@ class TomTomService:
                     else:
                         traffic_info["traffic_level"] = "unknown"
                         traffic_info["traffic_color"] = "#6b7280"  # Gray
-                    
-                    return {
-                        "success": True,
-                        "data": traffic_info
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "error": f"TomTom API error: {response.status_code}",
-                        "message": response.text
-                    }
-                    
+                
+                return {
+                    "success": True,
+                    "data": traffic_info
+                }
+            else:
+                return {
+                    "success": False,
+                    "error": f"TomTom API error: {response.status_code}",
+                    "message": response.text
+                }
+                
         except Exception as e:
             logger.error(f"Error getting traffic flow for {city}: {str(e)}")
             return {
@@ -106,68 +320,25 @@ class TomTomService:
                 "message": str(e)
             }
 
-    async def get_traffic_incidents(self, city: str) -> Dict[str, Any]:
-        """Get traffic incidents for a Pakistani city"""
+    async def _fetch_traffic_incidents(self, city: str) -> Dict[str, Any]:
+        """Fetch traffic incidents for a Pakistani city from TomTom"""
         try:
             city_lower = city.lower()
             if city_lower not in self.pakistan_cities:
                 raise HTTPException(status_code=404, message=f"City {city} not supported")
             
-            coords = self.pakistan_cities[city_lower]
+            async with self._client() as client:
+                incidents = [incident async for incident in self._stream_incident_tile(client, self.city_bbox(city))]
             
-            # Create bounding box around city (approximately 20km radius)
-            lat_offset = 0.18  # ~20km
-            lon_offset = 0.18  # ~20km
-            
-            bbox = f"{coords['lon'] - lon_offset},{coords['lat'] - lat_offset},{coords['lon'] + lon_offset},{coords['lat'] + lat_offset}"
-            
-            # TomTom Traffic Incidents API
-            url = f"{self.base_url}/traffic/services/5/incidentDetails/s3/{bbox}/10/-1/json"
-            params = {
-                "key": self.api_key,
-                "language": "en-US",
-                "categoryFilter": "0,1,2,3,4,5,6,7,8,9,10,11"  # All incident types
+            return {
+                "success": True,
+                "data": {
+                    "city": city.title(),
+                    "total_incidents": len(incidents),
+                    "incidents": incidents
+                }
             }
-            
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(url, params=params)
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    incidents = []
-                    
-                    for incident in data.get("incidents", []):
-                        incident_info = {
-                            "id": incident.get("id", ""),
-                            "type": incident.get("iconCategory", 0),
-                            "description": incident.get("description", ""),
-                            "coordinates": {
-                                "lat": incident.get("geometry", {}).get("coordinates", [0, 0])[1],
-                                "lon": incident.get("geometry", {}).get("coordinates", [0, 0])[0]
-                            },
-                            "start_time": incident.get("startTime", ""),
-                            "end_time": incident.get("endTime", ""),
-                            "delay": incident.get("delay", 0),
-                            "length": incident.get("length", 0),
-                            "severity": self._get_incident_severity(incident.get("iconCategory", 0))
-                        }
-                        incidents.append(incident_info)
-                    
-                    return {
-                        "success": True,
-                        "data": {
-                            "city": city.title(),
-                            "total_incidents": len(incidents),
-                            "incidents": incidents
-                        }
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "error": f"TomTom API error: {response.status_code}",
-                        "message": response.text
-                    }
-                    
         except Exception as e:
             logger.error(f"Error getting traffic incidents for {city}: {str(e)}")
             return {
@@ -176,7 +347,169 @@ class TomTomService:
                 "message": str(e)
             }
 
-    async def get_route_traffic(self, origin: str, destination: str) -> Dict[str, Any]:
+    def region_tiles(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> int:
+        """Upstream calls needed for a region's incidents"""
+        return len(self._split_bbox(min_lon, min_lat, max_lon, max_lat))
+
+    def _region_key(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> str:
+        # Rounded so map views that differ by a few metres share an entry
+        return "region:" + ",".join(f"{value:.2f}" for value in (min_lon, min_lat, max_lon, max_lat))
+
+    async def get_region_incidents(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> Dict[str, Any]:
+        """Get traffic incidents for an arbitrary region, e.g. the whole country"""
+        return await self.cached(
+            self._region_key(min_lon, min_lat, max_lon, max_lat),
+            self.incidents_ttl,
+            lambda: self._fetch_region_incidents(min_lon, min_lat, max_lon, max_lat)
+        )
+
+    async def get_cached_region_incidents(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> Optional[Dict[str, Any]]:
+        """A region's cached incidents, if any, without calling TomTom"""
+        entry = await self.cache.get(self._region_key(min_lon, min_lat, max_lon, max_lat))
+        return entry["result"] if entry else None
+
+    async def _fetch_region_incidents(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> Dict[str, Any]:
+        try:
+            errors = []
+            incidents = [
+                incident async for incident in self.stream_region_incidents(
+                    min_lon, min_lat, max_lon, max_lat, errors=errors
+                )
+            ]
+            
+            return {
+                "success": True,
+                "data": {
+                    "bbox": [min_lon, min_lat, max_lon, max_lat],
+                    "total_incidents": len(incidents),
+                    "incidents": incidents,
+                    "failed_tiles": len(errors)
+                }
+            }
+                
+        except Exception as e:
+            logger.error(f"Error getting traffic incidents for region {min_lon},{min_lat},{max_lon},{max_lat}: {str(e)}")
+            return {
+                "success": False,
+                "error": "Internal server error",
+                "message": str(e)
+            }
+
+    def _split_bbox(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> List[Tuple[float, float, float, float]]:
+        """Split a region into a grid of tiles that can be fetched concurrently"""
+        width = max_lon - min_lon
+        height = max_lat - min_lat
+        
+        # Aim for about incident_target_tiles tiles, within TomTom's maximum box size
+        side = math.sqrt(width * height / self.incident_target_tiles)
+        side = min(max(side, self.incident_tile_min_deg), self.incident_tile_max_deg)
+        columns = max(1, math.ceil(round(width / side, 6)))
+        rows = max(1, math.ceil(round(height / side, 6)))
+        step_lon = width / columns
+        step_lat = height / rows
+        
+        return [
+            (
+                min_lon + column * step_lon, min_lat + row * step_lat,
+                min_lon + (column + 1) * step_lon, min_lat + (row + 1) * step_lat
+            )
+            for row in range(rows)
+            for column in range(columns)
+        ]
+
+    async def stream_region_incidents(
+        self,
+        min_lon: float,
+        min_lat: float,
+        max_lon: float,
+        max_lat: float,
+        errors: Optional[List[str]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Yield de-duplicated incidents for a region as its tiles are fetched concurrently.
+        
+        Failed tiles are logged and appended to ``errors`` when given.
+        Regions needing more than ``INCIDENT_MAX_TILES`` calls raise ValueError.
+        """
+        tiles = self._split_bbox(min_lon, min_lat, max_lon, max_lat)
+        if len(tiles) > self.incident_max_tiles:
+            raise ValueError(f"Region needs {len(tiles)} incident tiles, more than the limit of {self.incident_max_tiles}")
+        # Bounded so slow consumers apply backpressure to the tile fetchers
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1000)
+        semaphore = asyncio.Semaphore(self.incident_concurrency)
+        tile_done = object()
+        
+        async with self._client() as client:
+            async def fetch_tile(bbox):
+                try:
+                    async with semaphore:
+                        async for incident in self._stream_incident_tile(client, bbox):
+                            await queue.put(incident)
+                except asyncio.CancelledError:
+                    # Only cancelled once the consumer has stopped reading; a sentinel
+                    # put here could wait forever on a full queue
+                    raise
+                except Exception as e:
+                    logger.warning(f"⚠️ Incident tile {bbox} failed: {str(e)}")
+                    if errors is not None:
+                        errors.append(str(e))
+                await queue.put(tile_done)
+            
+            tasks = [asyncio.create_task(fetch_tile(bbox)) for bbox in tiles]
+            try:
+                # Incidents on tile borders are returned by both neighbours
+                seen = set()
+                remaining = len(tasks)
+                while remaining:
+                    incident = await queue.get()
+                    if incident is tile_done:
+                        remaining -= 1
+                        continue
+                    key = incident["id"] or (incident["coordinates"]["lat"], incident["coordinates"]["lon"], incident["description"])
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    yield incident
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _stream_incident_tile(self, client: httpx.AsyncClient, bbox: Tuple[float, float, float, float]) -> AsyncIterator[Dict[str, Any]]:
+        """Stream one incident tile, parsing incidents as the body arrives"""
+        bbox_param = ",".join(f"{value:.5f}" for value in bbox)
+        
+        # TomTom Traffic Incidents API
+        url = f"{self.base_url}/traffic/services/5/incidentDetails/s3/{bbox_param}/10/-1/json"
+        params = {
+            "key": self.api_key,
+            "language": "en-US",
+            "categoryFilter": "0,1,2,3,4,5,6,7,8,9,10,11"  # All incident types
+        }
+        
+        with span("upstream"):
+            async with client.stream("GET", url, params=params) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise ValueError(f"TomTom API error: {response.status_code}")
+                
+                async for incident in iter_json_array(response.aiter_bytes(), "incidents"):
+                    yield self._format_incident(incident)
+
+    def _format_incident(self, incident: Dict[str, Any]) -> Dict[str, Any]:
+        """Map a TomTom incident to our response format"""
+        return {
+            "id": incident.get("id", ""),
+            "type": incident.get("iconCategory", 0),
+            "description": incident.get("description", ""),
+            "coordinates": self._incident_position(incident.get("geometry", {})),
+            "start_time": incident.get("startTime", ""),
+            "end_time": incident.get("endTime", ""),
+            "delay": incident.get("delay", 0),
+            "length": incident.get("length", 0),
+            "severity": self._get_incident_severity(incident.get("iconCategory", 0))
+        }
+
+    async def get_route_traffic(self, origin: str, destination: str, include_geometry: bool = True) -> Dict[str, Any]:
         """Get route with traffic information between two points in Pakistan"""
         try:
             # TomTom Routing API with traffic
@@ -189,14 +522,19 @@ class TomTomService:
                 "departure": "now",
                 "computeTravelTimeFor": "all"
             }
+            if include_geometry:
+                params["sectionType"] = "traffic"
+            else:
+                params["routeRepresentation"] = "summaryOnly"
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(url, params=params)
-                
-                if response.status_code == 200:
+            response = await self._get(url, params)
+            
+            if response.status_code == 200:
+                with span("parse"):
                     data = response.json()
+                with span("logic"):
                     routes = []
-                    
+                
                     for route in data.get("routes", []):
                         route_info = {
                             "summary": {
@@ -208,7 +546,7 @@ class TomTomService:
                             },
                             "legs": []
                         }
-                        
+                    
                         for leg in route.get("legs", []):
                             leg_info = {
                                 "distance": leg.get("summary", {}).get("lengthInMeters", 0),
@@ -217,33 +555,276 @@ class TomTomService:
                             }
                             route_info["legs"].append(leg_info)
                         
-                        routes.append(route_info)
+                        if include_geometry:
+                            route_info["geometry"] = self._route_geometry(route)
                     
-                    return {
-                        "success": True,
-                        "data": {
-                            "origin": origin,
-                            "destination": destination,
-                            "routes": routes
-                        }
+                        routes.append(route_info)
+                
+                return {
+                    "success": True,
+                    "data": {
+                        "origin": origin,
+                        "destination": destination,
+                        "routes": routes
                     }
-                else:
+                }
+            else:
+                return {
+                    "success": False,
+                    "error": f"TomTom API error: {response.status_code}",
+                    "message": response.text
+                }
+                
+        except Exception as e:
+            logger.error(f"Error getting route traffic from {origin} to {destination}: {str(e)}")
+            return {
+                "success": False,
+                "error": "Internal server error",
+                "message": str(e)
+            }
+
+    def _route_geometry(self, route: Dict[str, Any]) -> Dict[str, Any]:
+        """Encoded route line with traffic sections and simplified copies per zoom level"""
+        # Section point indices count across all legs, so keep every leg's points
+        points = [
+            (point["latitude"], point["longitude"])
+            for leg in route.get("legs", [])
+            for point in leg.get("points", [])
+        ]
+        sections = [
+            {
+                "start": section.get("startPointIndex", 0),
+                "end": section.get("endPointIndex", 0),
+                "category": section.get("simpleCategory", ""),
+                "delay": section.get("delayInSeconds", 0),
+                "magnitude": section.get("magnitudeOfDelay", 0),
+                "speed": section.get("effectiveSpeedInKmh")
+            }
+            for section in route.get("sections", [])
+            if section.get("sectionType") == "TRAFFIC"
+        ]
+        
+        geometry = {
+            "encoding": "polyline5",
+            "polyline": encode_polyline(points),
+            "point_count": len(points),
+            "sections": sections,
+            "levels": []
+        }
+        if len(points) < 3:
+            return geometry
+        
+        projected = project(points)
+        mean_lat = sum(lat for lat, _ in points) / len(points)
+        boundaries = {index for section in sections for index in (section["start"], section["end"])}
+        for zoom in self.route_simplify_zooms:
+            tolerance = meters_per_pixel(zoom, mean_lat) * self.route_simplify_px
+            kept = simplify(projected, tolerance, keep=boundaries)
+            new_index = {old: new for new, old in enumerate(kept)}
+            geometry["levels"].append({
+                "zoom": zoom,
+                "polyline": encode_polyline(points[index] for index in kept),
+                "point_count": len(kept),
+                "sections": [
+                    dict(section, start=new_index[section["start"]], end=new_index[section["end"]])
+                    for section in sections
+                    if section["start"] in new_index and section["end"] in new_index
+                ]
+            })
+        return geometry
+
+    async def get_departure_sweep(
+        self,
+        origin: str,
+        destination: str,
+        window_start: Optional[datetime] = None,
+        window_hours: float = 3.0,
+        step_minutes: int = 15
+    ) -> Dict[str, Any]:
+        """Evaluate a route over a window of departure times and find the best one"""
+        try:
+            now = datetime.now(PAKISTAN_TZ)
+            start = window_start or now
+            if start.tzinfo is None:
+                start = start.replace(tzinfo=PAKISTAN_TZ)
+            # TomTom only predicts future departures
+            start = max(start, now)
+            
+            # Align candidates to the step so that overlapping sweeps share cache entries
+            step = timedelta(minutes=step_minutes)
+            epoch = datetime(2000, 1, 1, tzinfo=PAKISTAN_TZ)
+            first = epoch + ((start - epoch) // step + 1) * step
+            count = min(int(window_hours * 60 // step_minutes) + 1, self.sweep_max_candidates)
+            candidates = [first + i * step for i in range(count)]
+            
+            semaphore = asyncio.Semaphore(self.sweep_concurrency)
+            
+            async def evaluate(depart_at: datetime) -> Dict[str, Any]:
+                key = f"route-at:{origin}:{destination}:{depart_at.isoformat()}"
+                async with semaphore:
+                    return await self.cached(
+                        key, self.sweep_cache_ttl,
+                        lambda: self._fetch_route_summary(origin, destination, depart_at)
+                    )
+            
+            results = await asyncio.gather(*(evaluate(depart_at) for depart_at in candidates))
+            
+            with span("logic"):
+                curve = []
+                for depart_at, result in zip(candidates, results):
+                    if result.get("success"):
+                        curve.append(dict(result["data"], departure_time=depart_at.isoformat()))
+                
+                if not curve:
                     return {
                         "success": False,
-                        "error": f"TomTom API error: {response.status_code}",
-                        "message": response.text
+                        "error": results[0].get("error", "No departure times could be evaluated") if results else "Empty departure window",
+                        "message": results[0].get("message", "") if results else ""
                     }
-                    
+                
+                best = min(curve, key=lambda point: point["travel_time"])
+                worst = max(curve, key=lambda point: point["travel_time"])
+            
+            return {
+                "success": True,
+                "data": {
+                    "origin": origin,
+                    "destination": destination,
+                    "step_minutes": step_minutes,
+                    "curve": curve,
+                    "best_departure": best,
+                    "time_saved_vs_worst": worst["travel_time"] - best["travel_time"],
+                    "time_saved_vs_first": curve[0]["travel_time"] - best["travel_time"],
+                    "failed_candidates": len(candidates) - len(curve)
+                }
+            }
+                
         except Exception as e:
-            logger.error(f"Error getting route traffic from {origin} to {destination}: {str(e)}")
+            logger.error(f"Error sweeping departures from {origin} to {destination}: {str(e)}")
+            return {
+                "success": False,
+                "error": "Internal server error",
+                "message": str(e)
+            }
+
+    async def _fetch_route_summary(self, origin: str, destination: str, depart_at: datetime) -> Dict[str, Any]:
+        """Fetch the predicted travel time for a single departure time"""
+        try:
+            url = f"{self.base_url}/routing/1/calculateRoute/{origin}:{destination}/json"
+            params = {
+                "key": self.api_key,
+                "traffic": "true",
+                "routeType": "fastest",
+                "travelMode": "car",
+                "departAt": depart_at.isoformat(timespec="seconds"),
+                "computeTravelTimeFor": "all",
+                "routeRepresentation": "summaryOnly"
+            }
+        
+            response = await self._get(url, params)
+        
+            if response.status_code != 200:
+                return {
+                    "success": False,
+                    "error": f"TomTom API error: {response.status_code}",
+                    "message": response.text
+                }
+        
+            with span("parse"):
+                data = response.json()
+            routes = data.get("routes", [])
+            if not routes:
+                return {
+                    "success": False,
+                    "error": "No route found",
+                    "message": ""
+                }
+        
+            summary = routes[0].get("summary", {})
+            return {
+                "success": True,
+                "data": {
+                    "travel_time": summary.get("travelTimeInSeconds", 0),
+                    "traffic_delay": summary.get("trafficDelayInSeconds", 0),
+                    "no_traffic_travel_time": summary.get("noTrafficTravelTimeInSeconds", 0),
+                    "distance": summary.get("lengthInMeters", 0),
+                    "arrival_time": summary.get("arrivalTime", "")
+                }
+            }
+                
+        except Exception as e:
+            logger.error(f"Error getting route summary from {origin} to {destination} at {depart_at}: {str(e)}")
             return {
                 "success": False,
                 "error": "Internal server error",
                 "message": str(e)
             }
 
-    async def search_places(self, query: str, city: str) -> Dict[str, Any]:
+    async def search_places(self, query: str, city: str, limit: int = 20) -> Dict[str, Any]:
         """Search for places in Pakistani cities"""
+        return await self.cached(self._search_key(query, city, limit), self.search_ttl, lambda: self._fetch_places(query, city, limit))
+
+    def _search_key(self, query: str, city: str, limit: int) -> str:
+        return f"search:{city.lower()}:{limit}:{normalize_query(query)}"
+
+    async def search_places_bulk(self, queries: List[Tuple[str, str]], limit: int = 5) -> AsyncIterator[Dict[str, Any]]:
+        """Search many ``(query, city)`` pairs, yielding one result per pair as it completes.
+        
+        Pairs with the same normalized query and city are searched once. Cached
+        results are yielded first; misses are fetched concurrently within the
+        bulk search rate budget. Each result carries the ``index`` of its pair.
+        """
+        groups: Dict[str, List[int]] = {}
+        for index, (query, city) in enumerate(queries):
+            if city.lower() not in self.pakistan_cities:
+                yield {"index": index, "query": query, "success": False, "error": f"City {city} not supported"}
+                continue
+            groups.setdefault(self._search_key(query, city, limit), []).append(index)
+        
+        def lines(key: str, result: Dict[str, Any], cached: bool):
+            for index in groups[key]:
+                yield {"index": index, "query": queries[index][0], "cached": cached, **result}
+        
+        keys = list(groups)
+        try:
+            entries = await asyncio.gather(*(self.cache.get(key) for key in keys))
+        except Exception as e:
+            logger.warning(f"⚠️ Shared cache unavailable for bulk search: {str(e)}")
+            entries = [None] * len(keys)
+        misses = []
+        for key, entry in zip(keys, entries):
+            if entry is None:
+                misses.append(key)
+            else:
+                for line in lines(key, entry["result"], True):
+                    yield line
+        
+        semaphore = asyncio.Semaphore(self.search_bulk_concurrency)
+        
+        async def fetch(key: str) -> Tuple[str, Dict[str, Any]]:
+            query, city = queries[groups[key][0]]
+            async with semaphore:
+                await self.search_budget.acquire()
+                result = await self._fetch_places(query, city, limit)
+            if result.get("success"):
+                try:
+                    await self.cache.set(key, {"fetched_at": time.time(), "result": result}, self.search_ttl)
+                except Exception as e:
+                    logger.warning(f"⚠️ Could not cache search result for {key}: {str(e)}")
+            return key, result
+        
+        tasks = [asyncio.create_task(fetch(key)) for key in misses]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                key, result = await next_done
+                for line in lines(key, result, False):
+                    yield line
+        finally:
+            # The client may disconnect mid-stream
+            for task in tasks:
+                task.cancel()
+
+    async def _fetch_places(self, query: str, city: str, limit: int) -> Dict[str, Any]:
         try:
             city_lower = city.lower()
             if city_lower not in self.pakistan_cities:
@@ -258,18 +839,19 @@ class TomTomService:
                 "lat": coords["lat"],
                 "lon": coords["lon"],
                 "radius": 20000,  # 20km radius
-                "limit": 20,
+                "limit": limit,
                 "countrySet": "PK",  # Pakistan only
                 "language": "en-US"
             }
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(url, params=params)
-                
-                if response.status_code == 200:
+            response = await self._get(url, params)
+            
+            if response.status_code == 200:
+                with span("parse"):
                     data = response.json()
+                with span("logic"):
                     places = []
-                    
+                
                     for result in data.get("results", []):
                         place_info = {
                             "id": result.get("id", ""),
@@ -285,23 +867,23 @@ class TomTomService:
                             "url": result.get("poi", {}).get("url", "")
                         }
                         places.append(place_info)
-                    
-                    return {
-                        "success": True,
-                        "data": {
-                            "query": query,
-                            "city": city.title(),
-                            "total_results": len(places),
-                            "places": places
-                        }
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "error": f"TomTom API error: {response.status_code}",
-                        "message": response.text
+                
+                return {
+                    "success": True,
+                    "data": {
+                        "query": query,
+                        "city": city.title(),
+                        "total_results": len(places),
+                        "places": places
                     }
-                    
+                }
+            else:
+                return {
+                    "success": False,
+                    "error": f"TomTom API error: {response.status_code}",
+                    "message": response.text
+                }
+                
         except Exception as e:
             logger.error(f"Error searching places for '{query}' in {city}: {str(e)}")
             return {
@@ -310,6 +892,21 @@ class TomTomService:
                 "message": str(e)
             }
 
+    async def get_map_tile(self, layer: str, style: str, zoom: int, x: int, y: int, fmt: str = "png") -> httpx.Response:
+        """Fetch a raw traffic flow or incident map tile from TomTom"""
+        url = f"{self.base_url}/traffic/map/4/tile/{layer}/{style}/{zoom}/{x}/{y}.{fmt}"
+        params = {"key": self.api_key}
+        if fmt == "png":
+            params["tileSize"] = 256
+        return await self._get(url, params)
+
+    def _incident_position(self, geometry: Dict[str, Any]) -> Dict[str, float]:
+        """Representative point of an incident; line incidents use their first point"""
+        coordinates = geometry.get("coordinates") or [0, 0]
+        if isinstance(coordinates[0], list):
+            coordinates = coordinates[0]
+        return {"lat": coordinates[1], "lon": coordinates[0]}
+
     def _get_incident_severity(self, icon_category: int) -> str:
         """Map TomTom incident categories to severity levels"""
         severity_map = {
@@ -330,7 +927,7 @@ class TomTomService:
 
     def get_supported_cities(self) -> List[str]:
         """Get list of supported Pakistani cities"""
-        return [city.title() for city in self.pakistan_cities.keys()]
+        return city_registry.names()
 
 # Initialize service
 tomtom_service = TomTomService()
\ No newline at end of file
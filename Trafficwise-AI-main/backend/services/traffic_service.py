@@ -2,9 +2,86 @@
 Traffic Service for managing Pakistani cities traffic data and route suggestions
 """
 
-from typing import List, Dict, Any
+from types import MappingProxyType
+from typing import List, Dict, Any, Optional, Sequence
 import asyncio
-from models.traffic_models import TrafficData, TrafficLevel, RouteData, HighwayData
+from models.traffic_models import TrafficData, TrafficLevel, RouteData, RouteOption, HighwayData
+from services.corridor_service import CorridorMonitor
+from services.city_registry import city_registry
+
+# Common routes between major cities
+ROUTE_MAP = {
+    ("lahore", "islamabad"): [
+        {
+            "route_type": "motorway",
+            "name": "M-2 Motorway",
+            "distance": "367 km",
+            "duration": "3.5 hours",
+            "traffic_level": TrafficLevel.MODERATE,
+            "toll_cost": "Rs. 890",
+            "recommended": True
+        },
+        {
+            "route_type": "highway",
+            "name": "Grand Trunk Road",
+            "distance": "375 km",
+            "duration": "5-6 hours",
+            "traffic_level": TrafficLevel.HEAVY,
+            "toll_cost": "Free",
+            "recommended": False
+        }
+    ],
+    ("islamabad", "peshawar"): [
+        {
+            "route_type": "motorway",
+            "name": "M-1 Motorway",
+            "distance": "155 km",
+            "duration": "2 hours",
+            "traffic_level": TrafficLevel.LIGHT,
+            "toll_cost": "Rs. 420",
+            "recommended": True
+        }
+    ],
+    ("karachi", "lahore"): [
+        {
+            "route_type": "motorway",
+            "name": "National Highway + M-2",
+            "distance": "1200 km",
+            "duration": "18-20 hours",
+            "traffic_level": TrafficLevel.MODERATE,
+            "toll_cost": "Rs. 2500",
+            "recommended": True
+        }
+    ]
+}
+
+# Same for every city pair, so it is shared rather than rebuilt per request; read-only so no caller can change it for the others
+ROUTE_RECOMMENDATIONS = MappingProxyType({
+    "best_time_to_travel": "Early morning (5-7 AM) or late evening (9-11 PM)",
+    "avoid_times": (
+        "7-9 AM (Morning rush)",
+        "5-7 PM (Evening rush)",
+        "12-2 PM Friday (Jumma prayers)"
+    ),
+    "weather_considerations": (
+        "Check weather during monsoon season (July-September)",
+        "Fog possible in winter months (December-February)",
+        "Avoid travel during dust storms"
+    ),
+    "safety_tips": (
+        "Keep fuel tank at least half full",
+        "Carry emergency kit and first aid",
+        "Have emergency contact numbers",
+        "Follow speed limits",
+        "Take breaks every 2 hours"
+    ),
+    "estimated_fuel_cost": "Calculate based on current petrol/diesel prices",
+    "alternative_transport": (
+        "Daewoo Bus Service",
+        "Pakistan Railways",
+        "Domestic flights for long distances"
+    )
+})
 
 class TrafficService:
     def __init__(self):
@@ -12,8 +89,6 @@ class TrafficService:
         self.cities_data = [
             {
                 "city": "Lahore",
-                "lat": 31.582045,
-                "lon": 74.329376,
                 "traffic_level": TrafficLevel.HEAVY,
                 "color": "red",
                 "info": "Cultural capital - Heavy traffic during peak hours (7-9 AM, 5-8 PM)",
@@ -22,8 +97,6 @@ class TrafficService:
             },
             {
                 "city": "Karachi",
-                "lat": 24.8607,
-                "lon": 67.0011,
                 "traffic_level": TrafficLevel.VERY_HEAVY,
                 "color": "darkred",
                 "info": "Economic hub - Severe congestion on main arteries",
@@ -32,8 +105,6 @@ class TrafficService:
             },
             {
                 "city": "Islamabad",
-                "lat": 33.6844,
-                "lon": 73.0479,
                 "traffic_level": TrafficLevel.MODERATE,
                 "color": "green",
                 "info": "Capital city - Well-planned roads, moderate traffic",
@@ -42,8 +113,6 @@ class TrafficService:
             },
             {
                 "city": "Rawalpindi",
-                "lat": 33.5651,
-                "lon": 73.0169,
                 "traffic_level": TrafficLevel.HEAVY,
                 "color": "orange",
                 "info": "Twin city - Connected to Islamabad, busy commercial area",
@@ -52,8 +121,6 @@ class TrafficService:
             },
             {
                 "city": "Faisalabad",
-                "lat": 31.4187,
-                "lon": 73.0790,
                 "traffic_level": TrafficLevel.MODERATE,
                 "color": "blue",
                 "info": "Industrial city - Traffic concentrated in textile areas",
@@ -62,8 +129,6 @@ class TrafficService:
             },
             {
                 "city": "Peshawar",
-                "lat": 34.0151,
-                "lon": 71.5249,
                 "traffic_level": TrafficLevel.MODERATE,
                 "color": "purple",
                 "info": "Historic city - Congestion in old city areas",
@@ -72,8 +137,6 @@ class TrafficService:
             },
             {
                 "city": "Multan",
-                "lat": 30.1575,
-                "lon": 71.5249,
                 "traffic_level": TrafficLevel.LIGHT,
                 "color": "cadetblue",
                 "info": "City of Saints - Manageable traffic flow",
@@ -92,9 +155,10 @@ class TrafficService:
                 "total_distance": "155 km",
                 "traffic_level": TrafficLevel.LIGHT,
                 "toll_required": True,
+                "toll_rs": 420,
                 "waypoints": [
-                    {"lat": 33.6844, "lon": 73.0479},  # Islamabad
-                    {"lat": 34.0151, "lon": 71.5249}   # Peshawar
+                    city_registry.position("Islamabad"),
+                    city_registry.position("Peshawar")
                 ],
                 "current_conditions": "Clear - Good driving conditions"
             },
@@ -106,9 +170,10 @@ class TrafficService:
                 "total_distance": "367 km",
                 "traffic_level": TrafficLevel.MODERATE,
                 "toll_required": True,
+                "toll_rs": 890,
                 "waypoints": [
-                    {"lat": 33.6844, "lon": 73.0479},  # Islamabad
-                    {"lat": 31.582045, "lon": 74.329376}  # Lahore
+                    city_registry.position("Islamabad"),
+                    city_registry.position("Lahore")
                 ],
                 "current_conditions": "Moderate traffic - Expected travel time 3.5 hours"
             },
@@ -120,20 +185,44 @@ class TrafficService:
                 "total_distance": "1800 km",
                 "traffic_level": TrafficLevel.HEAVY,
                 "toll_required": False,
+                "toll_rs": 0,
                 "waypoints": [
-                    {"lat": 24.8607, "lon": 67.0011},   # Karachi
-                    {"lat": 30.1575, "lon": 71.5249},   # Multan
-                    {"lat": 31.582045, "lon": 74.329376}, # Lahore
-                    {"lat": 33.6844, "lon": 73.0479},   # Islamabad
-                    {"lat": 34.0151, "lon": 71.5249}    # Peshawar
+                    city_registry.position(city)
+                    for city in ("Karachi", "Multan", "Lahore", "Islamabad", "Peshawar")
                 ],
                 "current_conditions": "Heavy traffic expected - Consider motorways for faster travel"
             }
         ]
+        
+        # Positions come from the city registry so every service agrees on them
+        for city in self.cities_data:
+            city.update(city_registry.position(city["city"]))
+        
+        # Validated once into frozen records that every request shares
+        self.cities = tuple(TrafficData(**city) for city in self.cities_data)
+        self.highways = tuple(HighwayData(**highway) for highway in self.highways_data)
+        self._cities_by_name = {city.city.casefold(): city for city in self.cities}
+        self._available_cities = tuple(city.city for city in self.cities)
+        
+        # Route options per (from, to, avoid_congestion), in both directions
+        self._route_options = {}
+        for (first, second), options in ROUTE_MAP.items():
+            routes = tuple(RouteOption(**option) for option in options)
+            uncongested = tuple(route for route in routes if route.traffic_level != TrafficLevel.VERY_HEAVY)
+            for pair in ((first, second), (second, first)):
+                self._route_options.setdefault(pair + (False,), routes)
+                self._route_options.setdefault(pair + (True,), uncongested)
+        
+        # Live per-segment flow along each highway, refreshed in the background
+        self.corridors = CorridorMonitor(self.highways_data)
     
-    async def get_cities_traffic_data(self) -> List[TrafficData]:
+    async def get_cities_traffic_data(self) -> Sequence[TrafficData]:
         """Get traffic data for all major Pakistani cities"""
-        return [TrafficData(**city) for city in self.cities_data]
+        return self.cities
+    
+    def get_city(self, name: str) -> Optional[TrafficData]:
+        """Static data for a city by case-insensitive name, or None"""
+        return self._cities_by_name.get(name.casefold())
     
     async def get_route_suggestions(
         self, 
@@ -144,140 +233,86 @@ class TrafficService:
         """Get route suggestions between cities"""
         
         # Find cities in our data
-        from_city_data = next((city for city in self.cities_data if city["city"].lower() == from_city.lower()), None)
-        to_city_data = next((city for city in self.cities_data if city["city"].lower() == to_city.lower()), None)
+        from_city_data = self.get_city(from_city)
+        to_city_data = self.get_city(to_city)
         
         if not from_city_data or not to_city_data:
             return {
                 "error": f"City data not found for {from_city} or {to_city}",
-                "available_cities": [city["city"] for city in self.cities_data]
+                "available_cities": self._available_cities
             }
         
         # Generate route based on common Pakistani routes
-        routes = await self._generate_routes(from_city, to_city, avoid_congestion)
+        routes = self._generate_routes(from_city, to_city, avoid_congestion)
         
         return {
             "from_city": from_city,
             "to_city": to_city,
             "routes": routes,
-            "recommendations": await self._get_route_recommendations(from_city, to_city)
+            "recommendations": ROUTE_RECOMMENDATIONS
         }
     
     async def get_highway_data(self) -> List[HighwayData]:
-        """Get major highway information for Pakistan"""
-        return [HighwayData(**highway) for highway in self.highways_data]
+        """Get major highway information for Pakistan, with live corridor conditions when available"""
+        snapshots = await asyncio.gather(
+            *(self.corridors.get_snapshot(highway.route_code) for highway in self.highways),
+            return_exceptions=True
+        )
+        
+        highways = []
+        for highway, snapshot in zip(self.highways, snapshots):
+            if isinstance(snapshot, dict):
+                status = snapshot["status"]
+                # Snapshots are trusted output of the corridor monitor, so skip re-validation
+                highway = highway.model_copy(update={
+                    "traffic_level": TrafficLevel(status["traffic_level"]) if status["traffic_level"] else highway.traffic_level,
+                    "current_conditions": self.describe_corridor(status),
+                    "segments": snapshot["segments"],
+                    "corridor_status": status,
+                    "last_updated": snapshot["updated_at"]
+                })
+            highways.append(highway)
+        return highways
     
-    async def _generate_routes(
+    def describe_corridor(self, status: Dict[str, Any]) -> str:
+        """Human-readable summary of a corridor snapshot"""
+        if status["traffic_level"] is None:
+            return "Live conditions unavailable"
+        
+        parts = [f"{status['traffic_level']} traffic"]
+        if status["closed_segments"]:
+            parts.append(f"{status['closed_segments']} closed segment(s)")
+        if status["congested_segments"]:
+            parts.append(f"{status['congested_segments']} congested segment(s)")
+        if status["estimated_delay_minutes"] >= 1:
+            parts.append(f"about {status['estimated_delay_minutes']:.0f} min delay")
+        return " - ".join(parts)
+    
+    def _generate_routes(
         self, 
         from_city: str, 
         to_city: str, 
         avoid_congestion: bool
-    ) -> List[Dict[str, Any]]:
+    ) -> Sequence[RouteOption]:
         """Generate possible routes between cities"""
         
-        routes = []
-        
-        # Define common routes between major cities
-        route_map = {
-            ("lahore", "islamabad"): [
-                {
-                    "route_type": "motorway",
-                    "name": "M-2 Motorway",
-                    "distance": "367 km",
-                    "duration": "3.5 hours",
-                    "traffic_level": TrafficLevel.MODERATE,
-                    "toll_cost": "Rs. 890",
-                    "recommended": True
-                },
-                {
-                    "route_type": "highway",
-                    "name": "Grand Trunk Road",
-                    "distance": "375 km",
-                    "duration": "5-6 hours",
-                    "traffic_level": TrafficLevel.HEAVY,
-                    "toll_cost": "Free",
-                    "recommended": False
-                }
-            ],
-            ("islamabad", "peshawar"): [
-                {
-                    "route_type": "motorway",
-                    "name": "M-1 Motorway",
-                    "distance": "155 km",
-                    "duration": "2 hours",
-                    "traffic_level": TrafficLevel.LIGHT,
-                    "toll_cost": "Rs. 420",
-                    "recommended": True
-                }
-            ],
-            ("karachi", "lahore"): [
-                {
-                    "route_type": "motorway",
-                    "name": "National Highway + M-2",
-                    "distance": "1200 km",
-                    "duration": "18-20 hours",
-                    "traffic_level": TrafficLevel.MODERATE,
-                    "toll_cost": "Rs. 2500",
-                    "recommended": True
-                }
-            ]
-        }
-        
         # Get routes for the city pair
-        key1 = (from_city.lower(), to_city.lower())
-        key2 = (to_city.lower(), from_city.lower())
-        
-        if key1 in route_map:
-            routes = route_map[key1]
-        elif key2 in route_map:
-            # Reverse the route
-            routes = route_map[key2]
-        else:
-            # Generate a generic route
-            routes = [
-                {
-                    "route_type": "highway",
-                    "name": f"{from_city} to {to_city} via National Highway",
-                    "distance": "Estimated",
-                    "duration": "Variable",
-                    "traffic_level": TrafficLevel.MODERATE,
-                    "toll_cost": "Variable",
-                    "recommended": True
-                }
-            ]
+        routes = self._route_options.get((from_city.casefold(), to_city.casefold(), avoid_congestion))
+        if routes is not None:
+            return routes
         
-        # Filter based on congestion preference
-        if avoid_congestion:
-            routes = [route for route in routes if route["traffic_level"] != TrafficLevel.VERY_HEAVY]
-        
-        return routes
-    
-    async def _get_route_recommendations(self, from_city: str, to_city: str) -> Dict[str, Any]:
-        """Get recommendations for the route"""
-        
-        return {
-            "best_time_to_travel": "Early morning (5-7 AM) or late evening (9-11 PM)",
-            "avoid_times": [
-                "7-9 AM (Morning rush)",
-                "5-7 PM (Evening rush)",
-                "12-2 PM Friday (Jumma prayers)"
-            ],
-            "weather_considerations": [
-                "Check weather during monsoon season (July-September)",
-                "Fog possible in winter months (December-February)",
-                "Avoid travel during dust storms"
-            ],
-            "safety_tips": [
-                "Keep fuel tank at least half full",
-                "Carry emergency kit and first aid",
-                "Have emergency contact numbers",
-                "Follow speed limits",
-                "Take breaks every 2 hours"
-            ],
-            "estimated_fuel_cost": "Calculate based on current petrol/diesel prices",
-            "alternative_transport": [
-                "Daewoo Bus Service",
-                "Pakistan Railways",
-                "Domestic flights for long distances"
-            ]
-        }
\ No newline at end of file
+        # Generate a generic route; fields are fixed here, so skip validation
+        return (
+            RouteOption.model_construct(
+                route_type="highway",
+                name=f"{from_city} to {to_city} via National Highway",
+                distance="Estimated",
+                duration="Variable",
+                traffic_level=TrafficLevel.MODERATE,
+                toll_cost="Variable",
+                recommended=True
+            ),
+        )
+
+# Initialize service
+traffic_service = TrafficService()
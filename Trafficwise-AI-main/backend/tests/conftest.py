@@ -0,0 +1,12 @@
+"""
+Shared test setup; run from the backend directory with ``python -m pytest``
+"""
+
+import os
+import sys
+
+# Services are configured from the environment when first imported
+os.environ.setdefault("TOMTOM_API_KEY", "test")
+os.environ["CACHE_BACKEND"] = "memory"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
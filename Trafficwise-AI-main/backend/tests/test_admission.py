@@ -0,0 +1,163 @@
+"""
+Tests for chat admission control
+"""
+
+import asyncio
+
+import pytest
+
+from services.admission import AdmissionQueue, AdmissionRejected
+
+def make_queue(**overrides):
+    settings = dict(
+        max_concurrent=2,
+        max_per_key=1,
+        max_queue=4,
+        max_wait=1.0,
+        short_prompt_chars=10,
+        long_prompt_penalty=60.0
+    )
+    settings.update(overrides)
+    return AdmissionQueue(**settings)
+
+class Holder:
+    """Holds an admission slot until released"""
+
+    def __init__(self, queue, key, prompt_chars=1, started=None):
+        self.release = asyncio.Event()
+        self.admitted = asyncio.Event()
+        self.task = asyncio.create_task(self._run(queue, key, prompt_chars, started))
+
+    async def _run(self, queue, key, prompt_chars, started):
+        async with queue.admit(key, prompt_chars):
+            if started is not None:
+                started.append(self)
+            self.admitted.set()
+            await self.release.wait()
+
+    async def finish(self):
+        self.release.set()
+        await self.task
+
+@pytest.mark.asyncio
+async def test_admits_up_to_the_global_and_per_key_caps():
+    queue = make_queue()
+    first = Holder(queue, "a")
+    same_key = Holder(queue, "a")
+    other_key = Holder(queue, "b")
+    await asyncio.sleep(0)
+
+    assert first.admitted.is_set() and other_key.admitted.is_set()
+    assert not same_key.admitted.is_set()
+    assert queue.stats()["active"] == 2 and queue.stats()["queued"] == 1
+
+    await first.finish()
+    await asyncio.wait_for(same_key.admitted.wait(), 1.0)
+    await same_key.finish()
+    await other_key.finish()
+    assert queue.stats()["active"] == 0 and queue.admitted == 3
+
+@pytest.mark.asyncio
+async def test_blocked_key_lets_the_next_in_line_go_first():
+    queue = make_queue(max_concurrent=2)
+    started = []
+    busy = Holder(queue, "a", started=started)
+    await asyncio.sleep(0)
+    waiting_a = Holder(queue, "a", started=started)
+    await asyncio.sleep(0)
+    waiting_b = Holder(queue, "b", started=started)
+    await asyncio.sleep(0)
+
+    assert started == [busy, waiting_b]
+    await busy.finish()
+    await asyncio.wait_for(waiting_a.admitted.wait(), 1.0)
+    await waiting_a.finish()
+    await waiting_b.finish()
+
+@pytest.mark.asyncio
+async def test_short_prompts_overtake_recent_long_ones():
+    queue = make_queue(max_concurrent=1, max_per_key=5)
+    started = []
+    busy = Holder(queue, "a", started=started)
+    await asyncio.sleep(0)
+    long_prompt = Holder(queue, "a", prompt_chars=1000, started=started)
+    await asyncio.sleep(0)
+    short_prompt = Holder(queue, "a", prompt_chars=5, started=started)
+    await asyncio.sleep(0)
+
+    await busy.finish()
+    await asyncio.wait_for(short_prompt.admitted.wait(), 1.0)
+    await short_prompt.finish()
+    await asyncio.wait_for(long_prompt.admitted.wait(), 1.0)
+    await long_prompt.finish()
+    assert started == [busy, short_prompt, long_prompt]
+
+@pytest.mark.asyncio
+async def test_full_queue_and_long_waits_are_rejected():
+    queue = make_queue(max_concurrent=1, max_queue=1, max_wait=0.05)
+    busy = Holder(queue, "a")
+    await asyncio.sleep(0)
+    waiting = Holder(queue, "b")
+    await asyncio.sleep(0)
+
+    with pytest.raises(AdmissionRejected) as error:
+        async with queue.admit("c", 1):
+            pass
+    assert error.value.retry_after >= 1
+
+    with pytest.raises(AdmissionRejected):
+        await waiting.task
+    assert queue.rejected == 2
+    await busy.finish()
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_gives_back_its_place():
+    queue = make_queue(max_concurrent=1)
+    busy = Holder(queue, "a")
+    await asyncio.sleep(0)
+    waiting = Holder(queue, "b")
+    await asyncio.sleep(0)
+
+    waiting.task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting.task
+    await busy.finish()
+    assert queue.stats()["active"] == 0 and queue.stats()["queued"] == 0
+
+@pytest.mark.asyncio
+async def test_no_wait_takes_a_free_slot_at_once():
+    queue = make_queue()
+    async with queue.admit("a", 1, wait=False) as waited:
+        assert waited == 0.0
+        assert queue.stats()["active"] == 1
+    assert queue.stats()["active"] == 0 and queue.admitted == 1
+
+@pytest.mark.asyncio
+async def test_no_wait_is_skipped_when_the_key_is_busy():
+    queue = make_queue()
+    busy = Holder(queue, "a")
+    await asyncio.sleep(0)
+
+    with pytest.raises(AdmissionRejected):
+        async with queue.admit("a", 1, wait=False):
+            pass
+    assert queue.skipped == 1 and queue.rejected == 0
+    await busy.finish()
+
+@pytest.mark.asyncio
+async def test_no_wait_never_goes_ahead_of_waiting_requests():
+    queue = make_queue(max_concurrent=2, max_per_key=1)
+    busy = Holder(queue, "a")
+    await asyncio.sleep(0)
+    waiting = Holder(queue, "a")
+    await asyncio.sleep(0)
+
+    # A slot is free for key "b", but someone is already in line
+    with pytest.raises(AdmissionRejected):
+        async with queue.admit("b", 1, wait=False):
+            pass
+    assert queue.skipped == 1
+
+    await busy.finish()
+    await asyncio.wait_for(waiting.admitted.wait(), 1.0)
+    await waiting.finish()
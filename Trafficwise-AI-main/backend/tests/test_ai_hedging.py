@@ -0,0 +1,117 @@
+"""
+Tests for hedged AI provider calls and the latency samples behind them
+"""
+
+import asyncio
+
+import pytest
+
+from models.ai_models import AIServiceType
+from services.ai_services import AIService, LatencyTracker
+
+GEMINI = AIServiceType.GOOGLE_GEMINI
+OPENAI = AIServiceType.OPENAI
+
+def test_percentile_needs_enough_samples():
+    tracker = LatencyTracker(window=10, min_samples=3)
+    tracker.record(GEMINI, 1.0)
+    tracker.record(GEMINI, 2.0)
+    assert tracker.percentile(GEMINI, 0.5) is None
+
+    tracker.record(GEMINI, 3.0)
+    assert tracker.percentile(GEMINI, 0.5) == 2.0
+    assert tracker.percentile(GEMINI, 0.99) == 3.0
+    assert tracker.percentile(OPENAI, 0.5) is None
+
+def test_percentile_uses_only_the_recent_window():
+    tracker = LatencyTracker(window=5, min_samples=1)
+    for seconds in [100.0] * 5 + [1.0] * 5:
+        tracker.record(GEMINI, seconds)
+    assert tracker.percentile(GEMINI, 0.95) == 1.0
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setenv("GOOGLE_GEMINI_API_KEY", "server-gemini")
+    monkeypatch.setenv("OPENAI_API_KEY", "server-openai")
+    service = AIService()
+    service.latency = LatencyTracker(min_samples=3)
+    service.hedge_default_delay = 0.05
+    service.hedge_min_delay = 0.01
+    service.hedge_max_delay = 0.2
+    return service
+
+def fake_calls(service, monkeypatch, delays, answers=None):
+    """Replace provider calls with sleeps; returns the list of services called"""
+    calls = []
+    answers = answers or {}
+
+    async def call(message, service_type, api_key=None, config=None):
+        calls.append(service_type)
+        await asyncio.sleep(delays[service_type])
+        return answers.get(service_type, f"answer from {service_type.value}")
+
+    monkeypatch.setattr(service, "_call", call)
+    return calls
+
+def test_hedge_delay_defaults_then_follows_the_clamped_percentile(service):
+    assert service.hedge_delay(GEMINI) == 0.05
+
+    for seconds in (0.1, 0.1, 0.1):
+        service.latency.record(GEMINI, seconds)
+    assert service.hedge_delay(GEMINI) == 0.1
+
+    for seconds in (5.0, 5.0, 5.0, 5.0):
+        service.latency.record(GEMINI, seconds)
+    assert service.hedge_delay(GEMINI) == service.hedge_max_delay
+
+    for seconds in [0.001] * 50:
+        service.latency.record(OPENAI, seconds)
+    assert service.hedge_delay(OPENAI) == service.hedge_min_delay
+
+@pytest.mark.asyncio
+async def test_fast_primary_is_not_hedged(service, monkeypatch):
+    calls = fake_calls(service, monkeypatch, {GEMINI: 0.0, OPENAI: 0.0})
+
+    assert await service.respond("hi", GEMINI, "server-gemini") == ("answer from google_gemini", GEMINI)
+    assert calls == [GEMINI]
+
+@pytest.mark.asyncio
+async def test_slow_primary_loses_to_secondary_and_is_recorded_as_censored(service, monkeypatch):
+    calls = fake_calls(service, monkeypatch, {GEMINI: 1.0, OPENAI: 0.0})
+
+    assert await service.respond("hi", GEMINI, "server-gemini") == ("answer from openai", OPENAI)
+    assert calls == [GEMINI, OPENAI]
+
+    # Let the cancelled primary run its cleanup
+    await asyncio.sleep(0)
+    samples = list(service.latency._samples[GEMINI])
+    assert len(samples) == 1 and samples[0] >= service.hedge_default_delay
+
+@pytest.mark.asyncio
+async def test_quick_primary_failure_hedges_without_waiting(service, monkeypatch):
+    service.hedge_default_delay = 5.0
+    calls = fake_calls(service, monkeypatch, {GEMINI: 0.0, OPENAI: 0.0}, answers={GEMINI: "❌ quota exceeded"})
+
+    response = await asyncio.wait_for(service.respond("hi", GEMINI, "server-gemini"), timeout=1.0)
+    assert response == ("answer from openai", OPENAI)
+    assert calls == [GEMINI, OPENAI]
+    # Failures say nothing about how long a good answer takes
+    assert GEMINI not in service.latency._samples
+
+@pytest.mark.asyncio
+async def test_primary_error_is_returned_when_both_fail(service, monkeypatch):
+    fake_calls(service, monkeypatch, {GEMINI: 0.0, OPENAI: 0.0}, answers={GEMINI: "❌ gemini down", OPENAI: "❌ openai down"})
+
+    assert await service.respond("hi", GEMINI, "server-gemini") == ("❌ gemini down", GEMINI)
+
+@pytest.mark.asyncio
+async def test_user_keys_are_never_hedged(service, monkeypatch):
+    calls = fake_calls(service, monkeypatch, {GEMINI: 0.2, OPENAI: 0.0})
+
+    assert await service.respond("hi", GEMINI, "users-own-key") == ("answer from google_gemini", GEMINI)
+    assert calls == [GEMINI]
+
+@pytest.mark.asyncio
+async def test_without_a_second_key_the_offline_responder_hedges(service, monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY")
+    assert service._secondary(GEMINI) == (AIServiceType.OFFLINE, None)
@@ -0,0 +1,116 @@
+"""
+Tests for the EWMA baselines and anomaly detection
+"""
+
+import math
+import random
+import statistics
+
+import pytest
+
+from services import anomaly_service as anomaly_module
+from services.anomaly_service import AnomalyDetector, Baseline
+from services.push_service import PushHub
+
+def test_first_value_sets_the_mean():
+    baseline = Baseline()
+    baseline.update(0.7, now=100.0, half_life=3600)
+    assert (baseline.mean, baseline.var, baseline.samples) == (0.7, 0.0, 1)
+
+def test_early_samples_are_a_plain_running_mean():
+    baseline = Baseline()
+    values = [0.2, 0.4, 0.9, 0.5]
+    # Refreshes a second apart barely decay anything; the running mean weight takes over
+    for second, value in enumerate(values):
+        baseline.update(value, now=float(second), half_life=3600)
+
+    assert baseline.mean == pytest.approx(statistics.mean(values))
+    assert baseline.var == pytest.approx(statistics.pvariance(values))
+
+def test_a_half_life_gap_weighs_the_new_value_by_half():
+    baseline = Baseline()
+    for second in range(100):
+        baseline.update(1.0, now=float(second), half_life=10_000)
+    baseline.update(0.0, now=99.0 + 10_000, half_life=10_000)
+
+    assert baseline.mean == pytest.approx(0.5)
+    assert baseline.var == pytest.approx(0.25)
+
+def test_baseline_tracks_a_stationary_series():
+    rng = random.Random(47)
+    baseline = Baseline()
+    for step in range(5000):
+        baseline.update(rng.gauss(0.6, 0.05), now=step * 60.0, half_life=6 * 3600)
+
+    assert baseline.mean == pytest.approx(0.6, abs=0.01)
+    assert math.sqrt(baseline.var) == pytest.approx(0.05, rel=0.15)
+
+def test_zscore_uses_the_minimum_std():
+    baseline = Baseline()
+    baseline.update(0.8, now=0.0, half_life=3600)
+    assert baseline.zscore(0.5, min_std=0.1) == pytest.approx(-3.0)
+
+class RecordingHub(PushHub):
+    def __init__(self):
+        super().__init__()
+        self.broadcasts = []
+
+    def broadcast(self, message):
+        self.broadcasts.append(message)
+        return 0
+
+@pytest.fixture
+def detector(monkeypatch):
+    monkeypatch.setattr(anomaly_module.tomtom_service, "on_refresh", lambda kind, listener: None)
+    return AnomalyDetector(RecordingHub(), half_life_seconds=3600, threshold=3.0, min_samples=5)
+
+def warm_up(detector, city, metric, values):
+    for step, value in enumerate(values):
+        detector.observe(city, metric, value, now=step * 60.0)
+
+def test_nothing_is_flagged_before_the_baseline_warms_up(detector):
+    warm_up(detector, "lahore", "speed_ratio", [0.9, 0.9, 0.9, 0.1])
+    assert detector.active() == []
+    assert detector.hub.broadcasts == []
+
+def test_slowdowns_are_flagged_and_cleared(detector):
+    warm_up(detector, "lahore", "speed_ratio", [0.8, 0.82, 0.79, 0.81, 0.8])
+
+    detector.observe("lahore", "speed_ratio", 0.3, now=600.0)
+    [active] = detector.active()
+    assert (active["city"], active["metric"], active["value"]) == ("lahore", "speed_ratio", 0.3)
+    # Spread is below the floor, so the score is against the minimum std
+    assert active["z"] == pytest.approx((0.3 - 0.8) / anomaly_module.METRICS["speed_ratio"][1], abs=0.2)
+    [raised] = detector.hub.broadcasts
+    assert raised["active"] and raised["baseline"] == pytest.approx(0.8, abs=0.01)
+
+    # Staying anomalous does not broadcast again; recovering does
+    detector.observe("lahore", "speed_ratio", 0.3, now=660.0)
+    detector.observe("lahore", "speed_ratio", 0.8, now=720.0)
+    assert [message["active"] for message in detector.hub.broadcasts] == [True, False]
+    assert detector.anomalies_raised == 1
+
+def test_only_the_bad_direction_counts(detector):
+    warm_up(detector, "lahore", "speed_ratio", [0.5] * 5)
+    detector.observe("lahore", "speed_ratio", 1.0, now=600.0)
+    warm_up(detector, "karachi", "incidents", [10.0] * 5)
+    detector.observe("karachi", "incidents", 0.0, now=600.0)
+    assert detector.active() == []
+
+    detector.observe("karachi", "incidents", 30.0, now=660.0)
+    assert [(state["city"], state["metric"]) for state in detector.active()] == [("karachi", "incidents")]
+
+def test_status_waits_for_both_metrics(detector):
+    warm_up(detector, "lahore", "speed_ratio", [0.8] * 6)
+    assert detector.status("Lahore") is None
+
+    warm_up(detector, "lahore", "incidents", [2.0] * 6)
+    status = detector.status("Lahore")
+    assert status["speed_ratio"]["baseline"] == 0.8 and not status["speed_ratio"]["anomalous"]
+    assert status["incidents"]["z"] == 0.0
+
+def test_refresh_listeners_score_closures_as_stopped(detector):
+    warm_up(detector, "lahore", "speed_ratio", [0.8] * 5)
+    detector._on_flow("lahore", {"road_closure": True, "free_flow_speed": 100})
+    assert detector._latest["lahore"]["speed_ratio"]["value"] == 0.0
+    assert detector._latest["lahore"]["speed_ratio"]["anomalous"]
@@ -0,0 +1,103 @@
+"""
+Tests for recording upstream responses and replaying them
+"""
+
+import os
+import zipfile
+
+import httpx
+import pytest
+
+from services.capture import Capture, CaptureArchive, RecordingTransport, ReplayTransport, capture_from_env, request_key
+
+BASE = "https://api.tomtom.com/traffic/services/4/flowSegmentData/absolute/10/json"
+
+def upstream(responses):
+    """Mock upstream answering each path with the next of its bodies"""
+    served = {}
+
+    def handler(request):
+        bodies = responses[request.url.path]
+        index = served.get(request.url.path, 0)
+        served[request.url.path] = index + 1
+        return httpx.Response(200, headers={"content-type": "application/json", "x-other": "dropped"}, content=bodies[index % len(bodies)])
+
+    return httpx.MockTransport(handler)
+
+async def record(path, responses, urls):
+    archive = CaptureArchive(path, flush_every=1000)
+    transport = RecordingTransport(archive)
+    transport._inner = upstream(responses)
+    async with httpx.AsyncClient(transport=transport) as client:
+        for url in urls:
+            (await client.get(url)).raise_for_status()
+    archive.flush()
+
+def test_request_key_ignores_the_api_key_and_parameter_order():
+    first = httpx.Request("GET", BASE, params={"point": "31.5,74.3", "unit": "KMPH", "key": "secret-1"})
+    second = httpx.Request("GET", BASE, params={"unit": "KMPH", "key": "secret-2", "point": "31.5,74.3"})
+    other = httpx.Request("GET", BASE, params={"point": "24.8,67.0", "unit": "KMPH"})
+
+    assert request_key(first) == request_key(second)
+    assert request_key(first) != request_key(other)
+
+@pytest.mark.asyncio
+async def test_replay_serves_recorded_responses_in_order(tmp_path):
+    path = str(tmp_path / "capture.zip")
+    url = f"{BASE}?point=31.5,74.3&key=very-secret"
+    path_only = "/traffic/services/4/flowSegmentData/absolute/10/json"
+    await record(path, {path_only: [b'{"n": 1}', b'{"n": 2}']}, [url, url])
+
+    with open(path, "rb") as f:
+        assert b"very-secret" not in f.read()
+
+    async with httpx.AsyncClient(transport=ReplayTransport([path], latency_scale=0)) as client:
+        replies = [await client.get(f"{BASE}?point=31.5,74.3&key=other") for _ in range(3)]
+    assert [reply.json()["n"] for reply in replies] == [1, 2, 1]
+    assert replies[0].headers["content-type"] == "application/json"
+    assert "x-other" not in replies[0].headers
+
+@pytest.mark.asyncio
+async def test_replay_falls_back_to_the_path_then_404(tmp_path):
+    path = str(tmp_path / "capture.zip")
+    path_only = "/traffic/services/4/flowSegmentData/absolute/10/json"
+    await record(path, {path_only: [b'{"n": 1}']}, [f"{BASE}?point=31.5,74.3"])
+
+    async with httpx.AsyncClient(transport=ReplayTransport([path], latency_scale=0)) as client:
+        assert (await client.get(f"{BASE}?point=1,2")).json() == {"n": 1}
+        assert (await client.get("https://api.tomtom.com/search/2/search/x.json")).status_code == 404
+
+@pytest.mark.asyncio
+async def test_streams_closed_early_are_still_recorded(tmp_path):
+    path = str(tmp_path / "capture.zip")
+    archive = CaptureArchive(path, flush_every=1000)
+    transport = RecordingTransport(archive)
+    transport._inner = upstream({"/big": [b"x" * 100_000]})
+
+    async with httpx.AsyncClient(transport=transport) as client:
+        async with client.stream("GET", "https://example.com/big") as response:
+            async for _ in response.aiter_bytes():
+                break
+    archive.flush()
+
+    with zipfile.ZipFile(path) as saved:
+        assert len(saved.infolist()) == 1
+
+def test_capture_opens_archives_per_process(tmp_path):
+    capture = Capture("record", str(tmp_path / "capture-{pid}.zip"), 1.0)
+    transport = capture.transport()
+    assert transport.archive.path == str(tmp_path / f"capture-{os.getpid()}.zip")
+    assert capture.transport().archive is transport.archive
+
+    # An archive opened by a parent process is not reused after fork
+    capture._pid = -1
+    assert capture.transport().archive is not transport.archive
+
+def test_capture_configuration_errors(tmp_path, monkeypatch):
+    assert Capture("off", "unused", 1.0).transport() is None
+    with pytest.raises(ValueError):
+        Capture("replay", str(tmp_path / "missing-{pid}.zip"), 1.0)
+
+    monkeypatch.setenv("TOMTOM_CAPTURE_MODE", "sideways")
+    with pytest.raises(ValueError):
+        capture_from_env()
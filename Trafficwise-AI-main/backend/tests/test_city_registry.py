@@ -0,0 +1,73 @@
+"""
+Tests for the city registry and its nearest-city KD-tree
+"""
+
+import math
+import random
+
+import pytest
+from pydantic import ValidationError
+
+from models.traffic_models import NearestCitiesRequest
+from services.city_registry import CITIES, KDTree, city_registry, chord_to_km, km_to_chord, unit_vector
+from services.corridor_service import haversine_km
+
+def brute_force_nearest(points, point):
+    distances = [math.dist(candidate, point) for candidate in points]
+    best = min(range(len(points)), key=distances.__getitem__)
+    return best, distances[best]
+
+def test_kdtree_matches_brute_force():
+    rng = random.Random(35)
+    points = [unit_vector(rng.uniform(-80, 80), rng.uniform(-180, 180)) for _ in range(500)]
+    tree = KDTree(points)
+
+    for _ in range(300):
+        query = unit_vector(rng.uniform(-90, 90), rng.uniform(-180, 180))
+        index, distance = tree.nearest(query)
+        expected_index, expected_distance = brute_force_nearest(points, query)
+        assert distance == pytest.approx(expected_distance)
+        assert index == expected_index or math.dist(points[index], query) == pytest.approx(expected_distance)
+
+def test_kdtree_respects_max_distance():
+    tree = KDTree([unit_vector(0, 0), unit_vector(0, 10)])
+    query = unit_vector(0, 4)
+    assert tree.nearest(query)[0] == 0
+    assert tree.nearest(query, max_distance=km_to_chord(100)) == (-1, math.inf)
+
+def test_empty_kdtree_finds_nothing():
+    assert KDTree([]).nearest(unit_vector(0, 0)) == (-1, math.inf)
+
+@pytest.mark.parametrize("km", [0.0, 1.0, 250.0, 5000.0])
+def test_chord_and_km_round_trip(km):
+    assert chord_to_km(km_to_chord(km)) == pytest.approx(km, abs=1e-6)
+
+def test_nearest_city_and_great_circle_distance():
+    city, distance = city_registry.nearest(31.55, 74.34)
+    assert city["name"] == "Lahore"
+    assert distance == pytest.approx(haversine_km(31.55, 74.34, 31.5204, 74.3587), rel=1e-3)
+
+def test_every_city_is_its_own_nearest():
+    for city in CITIES:
+        found, distance = city_registry.nearest(city["lat"], city["lon"])
+        assert found is city
+        assert distance == pytest.approx(0.0, abs=1e-6)
+
+def test_nearest_outside_radius_is_none():
+    # Roughly the middle of the Arabian Sea
+    assert city_registry.nearest(15.0, 62.0, max_distance_km=200) is None
+    assert city_registry.nearest(15.0, 62.0) is not None
+
+def test_nearest_many_keeps_order():
+    results = city_registry.nearest_many([(33.7, 73.05), (24.9, 67.0), (0.0, 0.0)], max_distance_km=50)
+    assert [result[0]["name"] if result else None for result in results] == ["Islamabad", "Karachi", None]
+
+def test_lookup_by_name_is_case_insensitive():
+    assert city_registry.get("LAHORE")["name"] == "Lahore"
+    assert city_registry.get("Atlantis") is None
+    assert city_registry.position("karachi") == {"lat": 24.8607, "lon": 67.0011}
+
+@pytest.mark.parametrize("max_distance_km", [0, -5])
+def test_batch_request_rejects_non_positive_radius(max_distance_km):
+    with pytest.raises(ValidationError):
+        NearestCitiesRequest(points=[(31.5, 74.3)], max_distance_km=max_distance_km)
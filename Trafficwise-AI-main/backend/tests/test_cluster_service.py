@@ -0,0 +1,76 @@
+"""
+Tests for zoom-aware incident clustering
+"""
+
+import random
+
+import pytest
+
+from services.cluster_service import IncidentClusterIndex, world_pixel
+
+PAKISTAN = (60.87, 23.69, 77.84, 37.08)
+
+def incident(incident_id, lat, lon, severity="minor"):
+    return {"id": incident_id, "coordinates": {"lat": lat, "lon": lon}, "severity": severity}
+
+def random_incidents(count, seed=30):
+    rng = random.Random(seed)
+    severities = ["info", "minor", "moderate", "major"]
+    return [incident(str(index), rng.uniform(24, 36), rng.uniform(62, 77), rng.choice(severities)) for index in range(count)]
+
+def test_world_pixel_doubles_with_each_zoom():
+    x0, y0 = world_pixel(31.5, 74.3, 5)
+    x1, y1 = world_pixel(31.5, 74.3, 6)
+    assert (x1, y1) == pytest.approx((2 * x0, 2 * y0))
+    assert world_pixel(0.0, -180.0, 0) == (0.0, 128.0)
+
+def test_every_zoom_accounts_for_every_incident():
+    index = IncidentClusterIndex(max_zoom=12)
+    incidents = random_incidents(300)
+    index.update_city("all", {"incidents": incidents})
+
+    for zoom in range(13):
+        assert sum(cluster["count"] for cluster in index.query(*PAKISTAN, zoom)) == len(incidents)
+
+def test_coarser_levels_have_fewer_clusters():
+    index = IncidentClusterIndex(max_zoom=12)
+    index.update_city("all", {"incidents": random_incidents(300)})
+    counts = [len(index.query(*PAKISTAN, zoom)) for zoom in range(13)]
+    assert counts == sorted(counts)
+    assert counts[0] == 1 and counts[-1] == 300
+
+def test_cluster_has_centroid_and_worst_severity():
+    index = IncidentClusterIndex(max_zoom=10)
+    index.update_city("lahore", {"incidents": [
+        incident("a", 31.50, 74.30, "minor"),
+        incident("b", 31.52, 74.34, "major"),
+        incident("c", 31.54, 74.32, "info")
+    ]})
+
+    [cluster] = index.query(*PAKISTAN, 5)
+    assert cluster["count"] == 3
+    assert (cluster["lat"], cluster["lon"]) == pytest.approx((31.52, 74.32))
+    assert cluster["severity"] == "major"
+    assert "incident" not in cluster
+
+def test_single_incidents_carry_their_details():
+    index = IncidentClusterIndex(max_zoom=10)
+    index.update_city("lahore", {"incidents": [incident("a", 31.5, 74.3)]})
+    [cluster] = index.query(*PAKISTAN, 10)
+    assert cluster["incident"]["id"] == "a"
+
+def test_query_returns_only_cells_in_the_viewport():
+    index = IncidentClusterIndex(max_zoom=12)
+    index.update_city("lahore", {"incidents": [incident("l", 31.52, 74.36)]})
+    index.update_city("karachi", {"incidents": [incident("k", 24.86, 67.00)]})
+
+    clusters = index.query(74.0, 31.0, 75.0, 32.0, 10)
+    assert [cluster["incident"]["id"] for cluster in clusters] == ["l"]
+
+def test_city_update_replaces_only_that_city():
+    index = IncidentClusterIndex(max_zoom=8)
+    index.update_city("lahore", {"incidents": [incident("l1", 31.5, 74.3), incident("l2", 31.6, 74.4)]})
+    index.update_city("karachi", {"incidents": [incident("k", 24.86, 67.0)]})
+    index.update_city("lahore", {"incidents": []})
+
+    assert sum(cluster["count"] for cluster in index.query(*PAKISTAN, 0)) == 1
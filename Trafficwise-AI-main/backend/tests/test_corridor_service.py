@@ -0,0 +1,60 @@
+"""
+Tests for corridor sampling and segment summaries
+"""
+
+import json
+
+import pytest
+
+from models.traffic_models import TrafficLevel
+from services.corridor_service import CorridorMonitor, haversine_km, sample_polyline, traffic_level_for_ratio
+
+WAYPOINTS = [{"lat": 33.6844, "lon": 73.0479}, {"lat": 34.0151, "lon": 71.5249}]
+
+def flow(current, free_flow, closed=False):
+    return {"success": True, "data": {"current_speed": current, "free_flow_speed": free_flow, "road_closure": closed}}
+
+def test_samples_are_evenly_spaced_and_end_at_the_last_waypoint():
+    samples = sample_polyline(WAYPOINTS, spacing_km=10)
+    length = haversine_km(WAYPOINTS[0]["lat"], WAYPOINTS[0]["lon"], WAYPOINTS[1]["lat"], WAYPOINTS[1]["lon"])
+
+    assert [km for _, _, km in samples[:-1]] == [10.0 * index for index in range(len(samples) - 1)]
+    assert samples[-1][:2] == (WAYPOINTS[1]["lat"], WAYPOINTS[1]["lon"])
+    assert samples[-1][2] == pytest.approx(length)
+
+@pytest.mark.parametrize("ratio, level", [
+    (None, None),
+    (0.9, TrafficLevel.LIGHT),
+    (0.6, TrafficLevel.MODERATE),
+    (0.3, TrafficLevel.HEAVY),
+    (0.1, TrafficLevel.VERY_HEAVY)
+])
+def test_traffic_level_for_ratio(ratio, level):
+    assert traffic_level_for_ratio(ratio) == level
+
+def test_summary_holds_plain_values_and_counts_congestion():
+    monitor = CorridorMonitor([{"route_code": "M-1", "waypoints": WAYPOINTS}])
+    samples = [(33.7, 73.0, 0.0), (33.8, 72.5, 50.0), (33.9, 72.0, 100.0)]
+    results = [flow(100, 100), flow(20, 100), {"success": False}]
+
+    summary = monitor._summarise("M-1", samples, results)
+
+    # Memory-cache snapshots are served as they are, so they must already match their JSON form
+    assert json.loads(json.dumps(summary)) == summary
+    levels = [segment["traffic_level"] for segment in summary["segments"]]
+    assert levels == ["Light", "Very Heavy", None]
+    assert all(type(level) is str for level in levels[:2] + [summary["status"]["traffic_level"]])
+    status = summary["status"]
+    assert status["congested_segments"] == 1
+    assert status["worst_segment"] == 1
+    assert status["coverage"] == pytest.approx(0.75)
+    # Length-weighted: (25 km at 1.0 + 50 km at 0.2) / 75 km
+    assert status["speed_ratio"] == pytest.approx(0.467)
+    assert status["traffic_level"] == TrafficLevel.HEAVY.value
+
+def test_closed_segments_count_as_stopped():
+    monitor = CorridorMonitor([{"route_code": "M-1", "waypoints": WAYPOINTS}])
+    summary = monitor._summarise("M-1", [(33.7, 73.0, 0.0), (33.8, 72.5, 10.0)], [flow(0, 100, closed=True), flow(0, 100, closed=True)])
+
+    assert summary["status"]["closed_segments"] == 2
+    assert summary["status"]["traffic_level"] == TrafficLevel.VERY_HEAVY.value
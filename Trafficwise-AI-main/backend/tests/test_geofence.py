@@ -0,0 +1,116 @@
+"""
+Tests for geofence subscriptions, their grid index and incident matching
+"""
+
+import random
+
+import pytest
+
+from services import geofence
+from services.corridor_service import haversine_km
+from services.geofence import GeofenceAlerts, GridIndex, Subscription
+
+LAHORE = (31.5204, 74.3587)
+# Islamabad to Lahore, roughly along the M-2
+CORRIDOR = [(33.6844, 73.0479), (32.9, 73.3), (31.5204, 74.3587)]
+
+class FakeHub:
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, user_id, message):
+        self.messages.append((user_id, message))
+
+def incident(incident_id, lat, lon):
+    return {"id": incident_id, "coordinates": {"lat": lat, "lon": lon}}
+
+def test_area_distance_is_great_circle_to_the_centre():
+    area = Subscription("s", "u", "area", [LAHORE], 5.0)
+    assert area.distance_km(31.55, 74.36) == pytest.approx(haversine_km(31.55, 74.36, *LAHORE))
+
+def test_corridor_distance_is_to_the_nearest_point_of_the_line():
+    corridor = Subscription("s", "u", "corridor", [(31.0, 73.0), (31.0, 74.0)], 2.0)
+    # Due north of the middle of an east-west segment
+    assert corridor.distance_km(31.01, 73.5) == pytest.approx(1.106, abs=0.01)
+    # Beyond the end, the distance is to the end point
+    assert corridor.distance_km(31.0, 74.1) == pytest.approx(haversine_km(31.0, 74.1, 31.0, 74.0), rel=0.01)
+
+@pytest.mark.parametrize("points, radius_km", [([LAHORE], 3.0), (CORRIDOR, 2.0)])
+def test_grid_candidates_include_every_point_in_range(points, radius_km):
+    index = GridIndex(cell_deg=0.05)
+    subscription = Subscription("s", "u", "corridor", points, radius_km)
+    index.add(subscription)
+
+    rng = random.Random(42)
+    min_lon, min_lat, max_lon, max_lat = subscription.bbox
+    inside = 0
+    for _ in range(5000):
+        lat, lon = rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon)
+        if subscription.distance_km(lat, lon) <= radius_km:
+            inside += 1
+            assert "s" in index.candidates(lat, lon)
+    assert inside > 0
+
+def test_grid_remove_drops_empty_cells():
+    index = GridIndex(cell_deg=0.05)
+    index.add(Subscription("a", "u", "area", [LAHORE], 3.0))
+    index.add(Subscription("b", "u", "area", [LAHORE], 1.0))
+    cells = len(index)
+
+    index.remove("b")
+    assert len(index) == cells
+    index.remove("a")
+    assert len(index) == 0
+    assert index.candidates(*LAHORE) == set()
+
+@pytest.fixture
+def alerts(monkeypatch):
+    monkeypatch.setattr(geofence.tomtom_service, "on_refresh", lambda kind, listener: None)
+    alerts = GeofenceAlerts(FakeHub(), cell_deg=0.05, max_per_user=2, poll_seconds=30)
+    # Seen incidents, so subscribing matches against them rather than fetching
+    alerts._on_incidents("lahore", {"incidents": [incident("old", 31.521, 74.359)]})
+    return alerts
+
+@pytest.mark.asyncio
+async def test_subscribe_alerts_on_incidents_already_seen(alerts):
+    subscription = await alerts.subscribe("user-1", "area", [LAHORE], 2.0, name="home")
+
+    assert subscription["id"] == "sub-1"
+    [(user_id, message)] = alerts.hub.messages
+    assert user_id == "user-1"
+    assert message["subscription_id"] == "sub-1" and message["incident"]["id"] == "old"
+
+@pytest.mark.asyncio
+async def test_only_new_incidents_in_range_are_pushed(alerts):
+    await alerts.subscribe("user-1", "area", [LAHORE], 2.0)
+    alerts.hub.messages.clear()
+
+    alerts._on_incidents("lahore", {"incidents": [
+        incident("old", 31.521, 74.359),
+        incident("near", 31.53, 74.36),
+        incident("far", 31.7, 74.5),
+        {"id": "unplaced"}
+    ]})
+    assert [message["incident"]["id"] for _, message in alerts.hub.messages] == ["near"]
+    assert alerts.alerts_sent == 2
+
+@pytest.mark.asyncio
+async def test_unsubscribed_users_get_no_alerts(alerts):
+    subscription = await alerts.subscribe("user-1", "area", [LAHORE], 2.0)
+    assert not alerts.unsubscribe("user-2", subscription["id"])
+    assert alerts.unsubscribe("user-1", subscription["id"])
+    alerts.hub.messages.clear()
+
+    alerts._on_incidents("lahore", {"incidents": [incident("near", 31.53, 74.36)]})
+    assert alerts.hub.messages == []
+    assert alerts.stats()["subscriptions"] == 0 and alerts.stats()["grid_cells"] == 0
+
+@pytest.mark.asyncio
+async def test_subscription_limits(alerts):
+    with pytest.raises(ValueError):
+        await alerts.subscribe("user-1", "area", [(10.0, 10.0)], 2.0)
+
+    await alerts.subscribe("user-1", "area", [LAHORE], 2.0)
+    await alerts.subscribe("user-1", "area", [LAHORE], 1.0)
+    with pytest.raises(ValueError):
+        await alerts.subscribe("user-1", "area", [LAHORE], 3.0)
@@ -0,0 +1,74 @@
+"""
+Tests for polyline encoding, Douglas-Peucker simplification and polygon helpers
+"""
+
+import math
+import random
+
+import pytest
+
+from services.geometry import convex_hull, decode_polyline, encode_polyline, polygon_area_m2, project, simplify, _segment_distance
+
+def test_encode_matches_reference_polyline():
+    # Example from Google's encoded polyline algorithm documentation
+    points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    assert encode_polyline(points) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+def test_round_trip_within_precision():
+    rng = random.Random(7)
+    points = [(rng.uniform(23.7, 37.0), rng.uniform(60.9, 77.8)) for _ in range(200)]
+    for precision in (5, 6):
+        decoded = decode_polyline(encode_polyline(points, precision), precision)
+        assert len(decoded) == len(points)
+        for (lat, lon), (decoded_lat, decoded_lon) in zip(points, decoded):
+            assert abs(lat - decoded_lat) <= 0.5 / 10 ** precision + 1e-12
+            assert abs(lon - decoded_lon) <= 0.5 / 10 ** precision + 1e-12
+
+def test_empty_polyline():
+    assert encode_polyline([]) == ""
+    assert decode_polyline("") == []
+
+def test_straight_line_keeps_only_endpoints():
+    points = [(31.5, 74.0 + step * 0.01) for step in range(50)]
+    assert simplify(project(points), tolerance_m=1.0) == [0, 49]
+
+def test_short_lines_are_kept_whole():
+    assert simplify([], 10.0) == []
+    assert simplify([(0.0, 0.0), (5.0, 5.0)], 10.0) == [0, 1]
+
+def test_corner_is_kept():
+    line = [(0.0, 0.0), (50.0, 1.0), (100.0, 0.0), (100.0, 100.0)]
+    assert simplify(line, tolerance_m=5.0) == [0, 2, 3]
+
+def test_keep_indices_survive_simplification():
+    line = [(float(x), 0.0) for x in range(20)]
+    assert simplify(line, tolerance_m=1.0, keep=[5, 12, 99]) == [0, 5, 12, 19]
+
+@pytest.mark.parametrize("tolerance", [1.0, 25.0, 200.0])
+def test_dropped_points_stay_within_tolerance(tolerance):
+    rng = random.Random(tolerance)
+    line = [(x * 10.0, rng.uniform(-100.0, 100.0)) for x in range(300)]
+    kept = simplify(line, tolerance)
+
+    assert kept[0] == 0 and kept[-1] == len(line) - 1
+    for start, end in zip(kept, kept[1:]):
+        for index in range(start + 1, end):
+            assert _segment_distance(*line[index], *line[start], *line[end]) <= tolerance
+
+def test_zigzag_keeps_every_point():
+    line = [(float(x), 100.0 * (x % 2)) for x in range(500)]
+    assert simplify(line, tolerance_m=1.0) == list(range(500))
+
+def test_convex_hull_drops_interior_points():
+    square = [(0.0, 0.0), (0.0, 1.0), (1.0, 1.0), (1.0, 0.0)]
+    hull = convex_hull(square + [(0.5, 0.5), (0.2, 0.7), (0.0, 0.5)])
+    assert sorted(hull) == sorted(square)
+
+def test_convex_hull_of_too_few_points():
+    assert convex_hull([(1.0, 2.0), (1.0, 2.0)]) == [(1.0, 2.0)]
+
+def test_polygon_area_of_a_small_square():
+    side_deg = 0.01
+    square = [(31.0, 74.0), (31.0, 74.0 + side_deg), (31.0 + side_deg, 74.0 + side_deg), (31.0 + side_deg, 74.0)]
+    expected = (side_deg * 110540.0) * (side_deg * 111320.0 * math.cos(math.radians(31.005)))
+    assert polygon_area_m2(square) == pytest.approx(expected, rel=1e-3)
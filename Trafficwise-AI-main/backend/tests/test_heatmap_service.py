@@ -0,0 +1,134 @@
+"""
+Tests for heatmap grids and the lease that picks the worker building them
+"""
+
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from services import heatmap_service as heatmap_module
+from services.heatmap_service import CityHeatmap, HeatmapService
+from services.shared_cache import MemoryCache
+
+BBOX = (74.0, 31.0, 75.0, 32.0)
+
+def test_decay_halves_the_weight_every_half_life():
+    grid = CityHeatmap(BBOX, 8)
+    grid.add_line([(31.55, 74.55)], 0.5)
+    grid.decay(grid.updated_at + 60, half_life=60)
+
+    assert grid.weight.sum() == pytest.approx(0.5)
+    assert np.nanmax(grid.mean_ratio()) == pytest.approx(0.5)
+
+def test_a_line_counts_once_in_every_cell_it_crosses():
+    grid = CityHeatmap(BBOX, 8)
+    # West to east along one row, through all eight columns
+    grid.add_line([(31.55, 74.01), (31.55, 74.99)], 1.0)
+
+    assert grid.weight[4].tolist() == [1.0] * 8
+    assert grid.weight.sum() == 8.0
+
+def test_points_outside_the_box_are_ignored():
+    grid = CityHeatmap(BBOX, 8)
+    grid.add_line([(30.0, 70.0)], 1.0)
+    assert grid.weight.sum() == 0.0
+
+def test_sparsest_cells_skip_covered_ones():
+    grid = CityHeatmap(BBOX, 2)
+    for row, col in ((0, 0), (0, 1), (1, 0)):
+        grid.add_line([grid.cell_centre(row, col)], 1.0)
+    assert grid.sparsest_cells(1, np.random.default_rng(0)) == [(1, 1)]
+
+def test_state_round_trip():
+    grid = CityHeatmap(BBOX, 8)
+    grid.add_line([(31.2, 74.2), (31.8, 74.7)], 0.3)
+    restored = CityHeatmap.from_state(grid.to_state())
+
+    assert np.array_equal(restored.ratio_sum, grid.ratio_sum)
+    assert np.array_equal(restored.weight, grid.weight)
+    assert restored.render() == grid.render()
+
+@pytest.fixture
+def service(monkeypatch):
+    cache = MemoryCache()
+    monkeypatch.setattr(heatmap_module.tomtom_service, "cache", cache)
+    monkeypatch.setattr(heatmap_module.tomtom_service, "on_refresh", lambda kind, listener: None)
+    service = HeatmapService()
+    service.interval = 0.01
+    return service
+
+async def run_rounds(service, rounds):
+    """Run the refresh loop for a few rounds with ``run_once`` recording the grids it finds"""
+    seen = []
+
+    async def run_once():
+        seen.append(dict(service._grids))
+        service._grids.setdefault("lahore", f"grid built in round {len(seen)}")
+
+    service.run_once = run_once
+    task = asyncio.create_task(service.refresh_loop())
+    deadline = time.monotonic() + 2.0
+    while len(seen) < rounds and time.monotonic() < deadline:
+        await asyncio.sleep(0.005)
+    return task, seen
+
+async def stop(task):
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+@pytest.mark.asyncio
+async def test_leader_keeps_its_lease_and_grids_across_rounds(service):
+    cache = heatmap_module.tomtom_service.cache
+    task, seen = await run_rounds(service, 3)
+
+    assert len(seen) == 3
+    assert seen[0] == {}
+    assert seen[1] == seen[2] == {"lahore": "grid built in round 1"}
+    assert await cache.acquire("heatmap", ttl=60) is None
+
+    await stop(task)
+    # Released on shutdown so another worker takes over at once
+    assert service._lease is None
+    assert await cache.acquire("heatmap", ttl=60) is not None
+
+@pytest.mark.asyncio
+async def test_losing_the_lease_drops_grids_and_stops_building(service):
+    cache = heatmap_module.tomtom_service.cache
+    service._lease = "lease-that-expired"
+    service._grids["lahore"] = "stale grid"
+    other = await cache.acquire("heatmap", ttl=60)
+
+    task = asyncio.create_task(service.refresh_loop())
+    await asyncio.sleep(0.05)
+    assert service._grids == {}
+    assert service._lease is None
+
+    # Once the other worker lets go, this one starts from what was published, not its old grids
+    await cache.release("heatmap", other)
+    await stop(task)
+    service._grids["lahore"] = "stale grid"
+    task, seen = await run_rounds(service, 1)
+    assert seen == [{}]
+    await stop(task)
+
+@pytest.mark.asyncio
+async def test_run_once_carries_on_from_the_published_grid(service, monkeypatch):
+    monkeypatch.setattr(heatmap_module.tomtom_service, "pakistan_cities", {"lahore": {"lat": 31.5, "lon": 74.4}})
+    published = CityHeatmap(BBOX, service.size)
+    published.add_line([(31.5, 74.5)], 0.25)
+    await heatmap_module.tomtom_service.cache.set(
+        "heatmap:lahore", {"fetched_at": 1.0, "result": {"success": True, "data": {"state": published.to_state()}}}, 60
+    )
+
+    async def sample_city(city):
+        return 0
+
+    monkeypatch.setattr(service, "sample_city", sample_city)
+    await service.run_once()
+
+    assert service._grids["lahore"].samples == published.samples
+    assert np.array_equal(service._grids["lahore"].weight, published.weight)
+    heatmap = await service.get_heatmap("Lahore", "bin")
+    assert heatmap["success"] and len(heatmap["body"]) == service.size * service.size
@@ -0,0 +1,104 @@
+"""
+Tests for recording history and streaming it back out
+"""
+
+import asyncio
+import csv
+import io
+import time
+
+import pytest
+
+from services import history_store as history_module
+from services.history_store import HistoryStore
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(history_module.tomtom_service, "on_fetch", lambda kind, listener: None)
+    return HistoryStore(str(tmp_path / "history.sqlite3"), retention_days=1, chunk_rows=3)
+
+def flow(current, free_flow=100):
+    return {"current_speed": current, "free_flow_speed": free_flow, "road_closure": False, "traffic_level": "Light"}
+
+async def record_flow(store, city, data, fetched_at):
+    """Record and wait for the write; off the event loop the store writes synchronously"""
+    await asyncio.get_running_loop().run_in_executor(None, store.record_flow, city, data, fetched_at)
+
+async def export_csv(store, metric, cities=(), start=0.0, end=float("inf")):
+    body = b"".join([chunk async for chunk in store.export(metric, list(cities), start, end, "csv")])
+    return list(csv.reader(io.StringIO(body.decode())))
+
+@pytest.mark.asyncio
+async def test_export_pages_through_rows_with_equal_timestamps(store):
+    # More rows than one chunk share a timestamp, so paging must not skip or repeat any
+    for index in range(8):
+        store._write_now("flow", (1000.0 if index < 5 else 1000.0 + index, "lahore", index, 100, None, None, None, None, 0, None))
+
+    rows = await export_csv(store, "flow")
+    assert rows[0][:3] == ["timestamp", "city", "current_speed"]
+    assert [row[2] for row in rows[1:]] == [str(float(index)) for index in range(8)]
+    assert rows[1][0] == "1970-01-01T00:16:40Z"
+
+@pytest.mark.asyncio
+async def test_export_filters_by_city_and_range(store):
+    await record_flow(store, "lahore", flow(50), 1000.0)
+    await record_flow(store, "karachi", flow(60), 1001.0)
+    await record_flow(store, "lahore", flow(70), 1002.0)
+
+    rows = await export_csv(store, "flow", cities=["lahore"], start=1000.0, end=1002.0)
+    assert [(row[1], row[4]) for row in rows[1:]] == [("lahore", "0.5")]
+
+@pytest.mark.asyncio
+async def test_empty_export_still_has_a_header(store):
+    assert await export_csv(store, "incidents") == [["timestamp", "city", "total", "major", "moderate", "minor", "info", "total_delay_seconds", "total_length_meters"]]
+
+def test_incident_snapshots_are_counted_by_severity(store):
+    store.record_incidents("lahore", {"incidents": [
+        {"severity": "major", "delay": 120, "length": 500},
+        {"severity": "minor", "delay": None},
+        {}
+    ]}, 1000.0)
+
+    conn = store._read_connection()
+    assert conn.execute("SELECT * FROM incidents").fetchall() == [(1000.0, "lahore", 3, 1, 0, 1, 1, 120, 500)]
+
+def test_each_table_is_pruned_on_its_own_count(store):
+    old = time.time() - 2 * 86400
+    store._write_now("flow", (old, "lahore") + (None,) * 8)
+    store._write_now("incidents", (old, "lahore") + (0,) * 7)
+
+    # Many incident writes must not trigger, or postpone, pruning of flow
+    store._writes["incidents"] = 500
+    store._writes["flow"] = 998
+    store.record_flow("lahore", flow(50), time.time())
+    assert store.stats()["flow"]["rows"] == 2
+    store.record_flow("lahore", flow(50), time.time())
+
+    stats = store.stats()
+    assert stats["flow"]["rows"] == 2 and stats["flow"]["oldest"] > old
+    assert stats["incidents"]["rows"] == 1
+
+@pytest.mark.asyncio
+async def test_exports_do_not_wait_for_the_writer_lock(store):
+    await record_flow(store, "lahore", flow(50), 1000.0)
+    with store._lock:
+        rows = await asyncio.wait_for(export_csv(store, "flow"), timeout=5)
+        assert store.stats()["flow"]["rows"] == 1
+    assert len(rows) == 2
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+async def test_columnar_exports_round_trip(store, fmt):
+    pa = pytest.importorskip("pyarrow")
+    for index in range(7):
+        await record_flow(store, "lahore", flow(10 * index), 1000.0 + index)
+
+    body = b"".join([chunk async for chunk in store.export("flow", [], 0.0, float("inf"), fmt)])
+    if fmt == "arrow":
+        table = pa.ipc.open_stream(body).read_all()
+    else:
+        import pyarrow.parquet as pq
+        table = pq.read_table(pa.BufferReader(body))
+    assert table.num_rows == 7
+    assert table.column("current_speed").to_pylist() == [10.0 * index for index in range(7)]
+    assert table.column("timestamp").type == pa.timestamp("ms", tz="UTC")
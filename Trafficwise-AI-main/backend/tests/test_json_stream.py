@@ -0,0 +1,69 @@
+"""
+Tests for the incremental JSON array parser
+"""
+
+import json
+
+import pytest
+
+from services.json_stream import JSONArrayStreamParser, iter_json_array
+
+DOCUMENT = {
+    "meta": {"incidents": ["not this one"], "note": "a [tricky] {string}"},
+    "incidents": [
+        {"id": 1, "text": "quote \" and backslash \\ and ] }"},
+        {"id": 2, "points": [[74.3, 31.5], [74.4, 31.6]]},
+        {"id": 3, "text": "unicode é \\u0041"}
+    ],
+    "after": [{"id": 99}]
+}
+
+def feed_in_chunks(parser, data, size):
+    items = []
+    for start in range(0, len(data), size):
+        items += parser.feed(data[start:start + size])
+    return items
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 100000])
+def test_elements_match_json_loads_for_any_chunking(size):
+    data = json.dumps(DOCUMENT).encode()
+    parser = JSONArrayStreamParser("incidents")
+
+    assert feed_in_chunks(parser, data, size) == DOCUMENT["incidents"]
+    assert parser.done
+
+def test_only_the_top_level_key_is_extracted():
+    data = json.dumps({"meta": {"incidents": [{"id": 0}]}, "incidents": [{"id": 1}]}).encode()
+    assert JSONArrayStreamParser("incidents").feed(data) == [{"id": 1}]
+
+def test_elements_are_returned_as_soon_as_they_close():
+    parser = JSONArrayStreamParser("incidents")
+    assert parser.feed(b'{"incidents": [{"id": 1}, {"id"') == [{"id": 1}]
+    assert parser.feed(b': 2}') == [{"id": 2}]
+    assert not parser.done
+    assert parser.feed(b']}') == []
+    assert parser.done
+
+def test_buffer_holds_only_the_open_element():
+    parser = JSONArrayStreamParser("incidents")
+    parser.feed(b'{"incidents": [' + b'{"id": 1}, ' * 1000)
+    parser.feed(b'{"id": ')
+    assert len(parser._buffer) < 20
+
+def test_missing_key_yields_nothing():
+    parser = JSONArrayStreamParser("incidents")
+    assert parser.feed(json.dumps({"other": [{"id": 1}]}).encode()) == []
+    assert not parser.done
+
+@pytest.mark.asyncio
+async def test_iter_json_array_stops_after_the_array():
+    consumed = []
+
+    async def chunks():
+        for chunk in (b'{"incidents": [{"id": 1},', b' {"id": 2}]', b', "rest": 1}'):
+            consumed.append(chunk)
+            yield chunk
+
+    items = [item async for item in iter_json_array(chunks(), "incidents")]
+    assert items == [{"id": 1}, {"id": 2}]
+    assert len(consumed) == 2
@@ -0,0 +1,103 @@
+"""
+Tests for the national overview's running aggregates
+"""
+
+import random
+
+import pytest
+
+from services import overview_service as overview_module
+from services.overview_service import SEVERITIES, NationalOverview
+
+POPULATIONS = {"karachi": 300, "lahore": 200, "quetta": 100}
+
+@pytest.fixture
+def overview(monkeypatch):
+    monkeypatch.setattr(overview_module.tomtom_service, "on_refresh", lambda kind, listener: None)
+    return NationalOverview(POPULATIONS, worst_count=2, sync_seconds=15)
+
+def flow(current, free_flow=100, closed=False):
+    return {"current_speed": current, "free_flow_speed": free_flow, "road_closure": closed}
+
+def recomputed(latest_flow, latest_incidents):
+    """The overview computed from scratch over each city's latest data"""
+    weight = sum(POPULATIONS[city] for city in latest_flow)
+    ratio = sum(min(data["current_speed"] / data["free_flow_speed"], 1.0) * POPULATIONS[city] for city, data in latest_flow.items())
+    speed = sum(data["current_speed"] * POPULATIONS[city] for city, data in latest_flow.items())
+    counts = {severity: 0 for severity in SEVERITIES}
+    for incidents in latest_incidents.values():
+        for incident in incidents:
+            counts[incident["severity"]] += 1
+    return round(ratio / weight * 100, 1), round(speed / weight, 1), counts
+
+def test_empty_overview(overview):
+    data = overview.get_overview()["data"]
+    assert data["speed_index"] is None and data["avg_speed"] is None
+    assert data["incidents"]["total"] == 0
+    assert data["worst_cities"] == []
+
+def test_speed_index_is_population_weighted(overview):
+    overview.update_flow("karachi", flow(40))
+    overview.update_flow("lahore", flow(90))
+
+    data = overview.get_overview()["data"]
+    assert data["speed_index"] == pytest.approx((0.4 * 300 + 0.9 * 200) / 500 * 100, abs=0.05)
+    assert data["avg_speed"] == pytest.approx((40 * 300 + 90 * 200) / 500, abs=0.05)
+    assert data["population_coverage"] == pytest.approx(500 / 600, abs=0.001)
+
+def test_refresh_replaces_a_city_rather_than_adding_to_it(overview):
+    overview.update_flow("lahore", flow(20))
+    overview.update_flow("lahore", flow(80))
+    overview.update_incidents("lahore", {"incidents": [{"severity": "major", "delay": 60}] * 3})
+    overview.update_incidents("lahore", {"incidents": [{"severity": "minor", "delay": 30}]})
+
+    data = overview.get_overview()["data"]
+    assert data["speed_index"] == 80.0
+    assert data["cities_reporting"]["flow"] == 1
+    assert data["incidents"]["by_severity"] == {"major": 0, "moderate": 0, "minor": 1, "info": 0}
+    assert data["incidents"]["total_delay_seconds"] == 30
+
+def test_worst_cities_are_the_slowest(overview):
+    overview.update_flow("karachi", flow(70))
+    overview.update_flow("lahore", flow(30))
+    overview.update_flow("quetta", flow(0, closed=True))
+    overview.update_flow("lahore", flow(90))
+
+    worst = overview.get_overview()["data"]["worst_cities"]
+    assert [(city["city"], city["speed_ratio"]) for city in worst] == [("Quetta", 0.0), ("Karachi", 0.7)]
+
+def test_unknown_severities_count_as_info_and_flow_without_free_flow_is_ignored(overview):
+    overview.update_incidents("quetta", {"incidents": [{"severity": "weird"}, {}]})
+    overview.update_flow("quetta", flow(50, free_flow=0))
+
+    data = overview.get_overview()["data"]
+    assert data["incidents"]["by_severity"]["info"] == 2
+    assert data["cities_reporting"]["flow"] == 0
+
+def test_snapshot_is_reused_until_something_changes(overview):
+    overview.update_flow("karachi", flow(50))
+    first = overview.get_overview()
+    assert overview.get_overview() is first
+
+    overview.update_flow("karachi", flow(60))
+    assert overview.get_overview() is not first
+
+def test_running_sums_match_a_full_recompute(overview):
+    rng = random.Random(46)
+    latest_flow, latest_incidents = {}, {}
+    for _ in range(2500):
+        city = rng.choice(list(POPULATIONS))
+        if rng.random() < 0.5:
+            latest_flow[city] = flow(rng.uniform(1, 120))
+            overview.update_flow(city, latest_flow[city])
+        else:
+            latest_incidents[city] = [{"severity": rng.choice(SEVERITIES)} for _ in range(rng.randrange(5))]
+            overview.update_incidents(city, {"incidents": latest_incidents[city]})
+
+    speed_index, avg_speed, counts = recomputed(latest_flow, latest_incidents)
+    data = overview.get_overview()["data"]
+    assert data["speed_index"] == pytest.approx(speed_index, abs=0.1)
+    assert data["avg_speed"] == pytest.approx(avg_speed, abs=0.1)
+    assert data["incidents"]["by_severity"] == counts
+    ranking = sorted((min(values["current_speed"] / 100, 1.0), city) for city, values in latest_flow.items())
+    assert [city["city"].lower() for city in data["worst_cities"]] == [city for _, city in ranking[:2]]
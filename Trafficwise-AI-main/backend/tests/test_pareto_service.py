@@ -0,0 +1,135 @@
+"""
+Tests for Pareto-optimal route search over time, toll and distance
+"""
+
+import random
+
+import pytest
+
+from services.pareto_service import ParetoRouteService
+from services.road_graph import RoadGraph
+
+def random_graph(seed, size=7, extra_edges=10):
+    """A connected graph whose edges trade speed and length against tolls"""
+    rng = random.Random(seed)
+    graph = RoadGraph()
+    nodes = [graph.add_node(30.0 + index * 0.05, 70.0 + rng.random()) for index in range(size)]
+    pairs = {(index, index + 1) for index in range(size - 1)}
+    while len(pairs) < size - 1 + extra_edges:
+        a, b = sorted(rng.sample(range(size), 2))
+        pairs.add((a, b))
+    for a, b in sorted(pairs):
+        graph.add_edge(nodes[a], nodes[b], rng.uniform(5, 50), rng.choice([40.0, 80.0, 120.0]), toll=rng.choice([0.0, 0.0, 100.0, 300.0]))
+    return graph, nodes
+
+def simple_paths(graph, source, target):
+    """(minutes, toll, km) of every path from source to target that visits no node twice"""
+    minutes = graph.edge_minutes([1.0])
+    found = []
+
+    def walk(node, visited, cost):
+        if node == target:
+            found.append(cost)
+            return
+        for edge in graph.adjacency[node]:
+            nxt = graph.edge_to[edge]
+            if nxt not in visited:
+                walk(nxt, visited | {nxt}, (cost[0] + minutes[edge], cost[1] + graph.edge_toll[edge], cost[2] + graph.edge_km[edge]))
+
+    walk(source, {source}, (0.0, 0.0, 0.0))
+    return found
+
+def dominated(a, b):
+    """Whether ``a`` is beaten by ``b``: no worse on every criterion and better on one"""
+    return all(y <= x for x, y in zip(a, b)) and any(y < x for x, y in zip(a, b))
+
+def pareto_front(costs):
+    return sorted({cost for cost in costs if not any(dominated(cost, other) for other in costs)})
+
+def rounded(costs):
+    return sorted(tuple(round(value, 6) for value in cost) for cost in costs)
+
+@pytest.mark.parametrize("seed", range(8))
+def test_exact_search_finds_the_whole_pareto_front(seed):
+    graph, nodes = random_graph(seed)
+    minutes = graph.edge_minutes([1.0])
+    paths = graph.pareto_paths(nodes[0], nodes[-1], minutes, float("inf"), epsilon=0.0, max_labels_per_node=1000)
+
+    assert rounded(path[:3] for path in paths) == rounded(pareto_front(simple_paths(graph, nodes[0], nodes[-1])))
+
+@pytest.mark.parametrize("seed", range(4))
+def test_paths_follow_their_edges(seed):
+    graph, nodes = random_graph(seed)
+    minutes = graph.edge_minutes([1.0])
+    for total_minutes, toll, km, edges in graph.pareto_paths(nodes[0], nodes[-1], minutes, float("inf")):
+        node = nodes[0]
+        for edge in edges:
+            assert edge in graph.adjacency[node]
+            node = graph.edge_to[edge]
+        assert node == nodes[-1]
+        assert total_minutes == pytest.approx(sum(minutes[edge] for edge in edges))
+        assert toll == pytest.approx(sum(graph.edge_toll[edge] for edge in edges))
+        assert km == pytest.approx(sum(graph.edge_km[edge] for edge in edges))
+
+def test_no_returned_path_dominates_another():
+    graph, nodes = random_graph(3, size=10, extra_edges=25)
+    paths = graph.pareto_paths(nodes[0], nodes[-1], graph.edge_minutes([1.0]), float("inf"), epsilon=0.02)
+    costs = [path[:3] for path in paths]
+    assert costs
+    assert not any(dominated(a, b) for a in costs for b in costs)
+
+def two_roads():
+    """A fast tolled motorway and a slower free road between two towns"""
+    graph = RoadGraph()
+    a, b, c = graph.add_node(30.0, 70.0, "A"), graph.add_node(30.5, 70.0), graph.add_node(31.0, 70.0, "B")
+    graph.add_edge(a, c, 100.0, 120.0, toll=500.0, name="Motorway")
+    graph.add_edge(a, b, 50.0, 60.0, name="Old road")
+    graph.add_edge(b, c, 50.0, 60.0, name="Old road")
+    graph.city_nodes.update({"a": a, "b": c})
+    return graph, a, c
+
+def test_time_limit_drops_slow_alternatives():
+    graph, a, c = two_roads()
+    minutes = graph.edge_minutes([1.0])
+    assert len(graph.pareto_paths(a, c, minutes, float("inf"))) == 2
+    assert [path[0] for path in graph.pareto_paths(a, c, minutes, 60.0)] == [50.0]
+
+def test_epsilon_merges_near_identical_routes():
+    graph, a, c = two_roads()
+    # Make the motorway free, 1% longer and 1% faster than the old road: a trade-off, but barely
+    motorway = graph.adjacency[a][0]
+    graph.edge_toll[motorway] = 0.0
+    graph.edge_km[motorway] = 101.0
+    graph.edge_speed[motorway] = 61.0
+    minutes = graph.edge_minutes([1.0])
+
+    assert len(graph.pareto_paths(a, c, minutes, float("inf"), epsilon=0.0)) == 2
+    assert len(graph.pareto_paths(a, c, minutes, float("inf"), epsilon=0.02)) == 1
+
+@pytest.fixture
+def service():
+    graph, _, _ = two_roads()
+    return ParetoRouteService(graph, max_stretch=3.0, epsilon=0.0, max_labels_per_node=8, bucket_seconds=300, cache_size=2)
+
+@pytest.mark.asyncio
+async def test_routes_are_tagged_with_what_they_are_best_for(service):
+    result = await service.get_routes("A", "B")
+
+    fastest, cheapest = result["data"]["routes"]
+    assert fastest["best_for"] == ["fastest", "shortest"] and fastest["roads"] == ["Motorway"]
+    assert cheapest["best_for"] == ["cheapest", "shortest"] and cheapest["roads"] == ["Old road"]
+    assert [place["name"] for place in fastest["via"]] == ["A", "B"]
+
+@pytest.mark.asyncio
+async def test_results_are_cached_per_pair_and_trimmed_per_request(service):
+    first = await service.get_routes("A", "B")
+    assert await service.get_routes("a", "b") is first
+
+    trimmed = await service.get_routes("A", "B", max_routes=1)
+    assert len(trimmed["data"]["routes"]) == 1
+    assert len(first["data"]["routes"]) == 2
+
+@pytest.mark.asyncio
+async def test_unknown_or_identical_cities_are_errors(service):
+    assert (await service.get_routes("A", "Atlantis"))["error"] == "City not supported"
+    assert (await service.get_routes("A", "a"))["error"] == "Same origin and destination"
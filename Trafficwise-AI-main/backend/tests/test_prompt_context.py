@@ -0,0 +1,75 @@
+"""
+Tests for grounding chat prompts in cached live traffic data
+"""
+
+import pytest
+
+from services import prompt_context as context_module
+from services.prompt_context import PromptContextBuilder
+from services.shared_cache import MemoryCache
+
+@pytest.fixture
+def builder(monkeypatch):
+    monkeypatch.setattr(context_module.tomtom_service, "cache", MemoryCache())
+    return PromptContextBuilder(max_entities=3)
+
+@pytest.mark.parametrize("message, expected", [
+    ("How is traffic in Lahore?", [("city", "lahore")]),
+    ("pindi to ISB now", [("city", "rawalpindi"), ("city", "islamabad")]),
+    ("Is the M2 or motorway 1 faster?", [("highway", "M-2"), ("highway", "M-1")]),
+    ("Take the Grand Trunk Road", [("highway", "GT Road")]),
+    ("Lahore, then lahore again", [("city", "lahore")]),
+    ("Lahorean food and m-22 stickers", [])
+])
+def test_find_mentions(builder, message, expected):
+    assert builder.find_mentions(message) == expected
+
+def test_mentions_are_capped(builder):
+    assert len(builder.find_mentions("Lahore Karachi Multan Quetta Peshawar")) == 3
+
+@pytest.mark.asyncio
+async def test_no_mentions_means_no_context(builder):
+    assert await builder.build("hello there") == ""
+
+@pytest.mark.asyncio
+async def test_context_has_static_text_and_live_data_from_the_cache(builder):
+    cache = context_module.tomtom_service.cache
+    await cache.set("flow:lahore", {"fetched_at": 0.0, "result": {"success": True, "data": {
+        "traffic_level": "Heavy", "current_speed": 20, "free_flow_speed": 60
+    }}}, 60)
+    await cache.set("incidents:lahore", {"fetched_at": 0.0, "result": {"success": True, "data": {"incidents": [
+        {"severity": "major", "description": "Accident on Canal Road"},
+        {"severity": "minor"}
+    ]}}}, 60)
+
+    context = await builder.build("Traffic in Lahore?")
+    assert context.startswith("Current conditions")
+    assert "Lahore: Cultural capital" in context
+    assert "Now Heavy traffic, 20 km/h against 60 km/h free flow (as of 05:00 PKT)." in context
+    assert "2 incident(s), 1 major: Accident on Canal Road" in context
+
+@pytest.mark.asyncio
+async def test_cities_without_static_or_live_data_say_so(builder):
+    context = await builder.build("What about Quetta?")
+    assert "- Quetta: No live data available right now." in context
+
+@pytest.mark.asyncio
+async def test_summaries_are_rendered_once_per_cache_entry(builder, monkeypatch):
+    cache = context_module.tomtom_service.cache
+    entry = {"fetched_at": 1.0, "result": {"success": True, "data": {"road_closure": True}}}
+    await cache.set("flow:karachi", entry, 60)
+    rendered = []
+    describe = builder._describe_flow
+
+    def counting(data):
+        rendered.append(data)
+        return describe(data)
+
+    monkeypatch.setattr(builder, "_describe_flow", counting)
+    await builder.build("Karachi")
+    await builder.build("karachi please")
+    assert len(rendered) == 1
+
+    await cache.set("flow:karachi", dict(entry, fetched_at=2.0), 60)
+    await builder.build("Karachi")
+    assert len(rendered) == 2
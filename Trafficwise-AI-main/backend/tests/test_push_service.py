@@ -0,0 +1,55 @@
+"""
+Tests for the push hub and alert session tokens
+"""
+
+import pytest
+
+from services.push_service import PushHub, PushSessions
+from services.shared_cache import MemoryCache
+
+def test_publish_reaches_every_connection_of_the_user():
+    hub = PushHub()
+    first, second = hub.connect("u1"), hub.connect("u1")
+    other = hub.connect("u2")
+
+    assert hub.publish("u1", {"n": 1}) == 2
+    assert first.queue.get_nowait() == second.queue.get_nowait() == {"n": 1}
+    assert other.queue.empty()
+    assert hub.publish("nobody", {"n": 2}) == 0
+
+def test_slow_clients_lose_their_oldest_messages():
+    hub = PushHub(max_pending=2)
+    connection = hub.connect("u1")
+    for n in range(5):
+        hub.publish("u1", {"n": n})
+
+    assert [connection.queue.get_nowait()["n"] for _ in range(2)] == [3, 4]
+    assert hub.stats()["dropped"] == 3
+
+def test_disconnect_forgets_the_user_with_its_last_connection():
+    hub = PushHub()
+    first, second = hub.connect("u1"), hub.connect("u1")
+    hub.disconnect(first)
+    assert hub.is_connected("u1")
+    hub.disconnect(second)
+    assert not hub.is_connected("u1")
+    assert hub.broadcast({"n": 1}) == 0
+
+@pytest.mark.asyncio
+async def test_issued_tokens_resolve_to_a_stable_user():
+    sessions = PushSessions(MemoryCache(), ttl=60)
+    first, second = await sessions.issue(), await sessions.issue()
+
+    assert first["token"] != second["token"]
+    user_id = await sessions.user_id(first["token"])
+    assert user_id is not None and user_id != first["token"]
+    assert await sessions.user_id(first["token"]) == user_id
+    assert await sessions.user_id(second["token"]) != user_id
+
+@pytest.mark.asyncio
+async def test_unknown_and_expired_tokens_are_refused():
+    sessions = PushSessions(MemoryCache(), ttl=-1)
+    issued = await sessions.issue()
+
+    assert await sessions.user_id(issued["token"]) is None
+    assert await sessions.user_id("made-up-token") is None
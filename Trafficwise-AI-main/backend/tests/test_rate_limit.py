@@ -0,0 +1,80 @@
+"""
+Tests for the upstream call token bucket
+"""
+
+import asyncio
+import types
+
+import pytest
+
+from services import rate_limit
+from services.rate_limit import TokenBucket
+
+class FakeClock:
+    """Monotonic clock that only moves when told to, or when a bucket sleeps"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    monkeypatch.setattr(rate_limit, "asyncio", types.SimpleNamespace(Lock=asyncio.Lock, sleep=clock.sleep))
+    return clock
+
+def test_starts_full_and_allows_a_burst(clock):
+    bucket = TokenBucket(rate=2.0, capacity=5)
+    assert all(bucket.try_acquire() for _ in range(5))
+    assert not bucket.try_acquire()
+
+def test_capacity_defaults_to_rate_but_at_least_one(clock):
+    assert TokenBucket(rate=10.0).capacity == 10.0
+    assert TokenBucket(rate=0.2).capacity == 1.0
+
+def test_refills_at_rate_up_to_capacity(clock):
+    bucket = TokenBucket(rate=2.0, capacity=4)
+    for _ in range(4):
+        bucket.try_acquire()
+
+    clock.now += 1.0
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+    clock.now += 60.0
+    assert sum(bucket.try_acquire() for _ in range(10)) == 4
+
+def test_failed_try_acquire_takes_nothing(clock):
+    bucket = TokenBucket(rate=1.0, capacity=2)
+    assert not bucket.try_acquire(3)
+    assert bucket.try_acquire(2)
+
+@pytest.mark.asyncio
+async def test_acquire_waits_only_for_the_missing_tokens(clock):
+    bucket = TokenBucket(rate=4.0, capacity=1)
+    await bucket.acquire()
+    assert clock.sleeps == []
+
+    clock.now += 0.125
+    await bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.125)]
+
+@pytest.mark.asyncio
+async def test_waiters_are_served_in_order_at_rate(clock):
+    bucket = TokenBucket(rate=1.0, capacity=1)
+    order = []
+
+    async def call(name):
+        await bucket.acquire()
+        order.append((name, clock.now))
+
+    await asyncio.gather(*(call(name) for name in "abcd"))
+    assert order == [("a", 1000.0), ("b", 1001.0), ("c", 1002.0), ("d", 1003.0)]
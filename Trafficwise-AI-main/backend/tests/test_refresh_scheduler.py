@@ -0,0 +1,92 @@
+"""
+Tests for adaptive city refresh intervals and the scheduler lease
+"""
+
+import asyncio
+import math
+import time
+
+import pytest
+
+from services import refresh_scheduler as scheduler_module
+from services.refresh_scheduler import CityActivity, RefreshScheduler, parse_windows
+from services.shared_cache import MemoryCache
+
+def test_parse_windows():
+    assert parse_windows(["07:30-09:30", "17:00-19:45"]) == [(450, 570), (1020, 1185)]
+
+def test_demand_decays_with_its_time_constant():
+    activity = CityActivity([], demand_tau=60, alpha=0.3)
+    now = time.time()
+    activity.record_demand(now)
+    activity.record_demand(now)
+
+    assert activity.demand_rate(now) == pytest.approx(2 / 60)
+    assert activity.demand_rate(now + 60) == pytest.approx(2 / 60 / math.e)
+
+def test_volatility_and_churn_are_moving_averages_of_change():
+    activity = CityActivity([], demand_tau=60, alpha=0.5)
+    activity.observe_flow({"current_speed": 50, "free_flow_speed": 100})
+    assert activity.volatility == 0.0
+    activity.observe_flow({"current_speed": 90, "free_flow_speed": 100})
+    assert activity.volatility == pytest.approx(0.2)
+    activity.observe_flow({"road_closure": True, "free_flow_speed": 100})
+    assert activity.volatility == pytest.approx(0.55)
+
+    activity.observe_incidents({"incidents": [{"id": "a"}, {"id": "b"}]})
+    activity.observe_incidents({"incidents": [{"id": "b"}, {"id": "c"}]})
+    assert activity.churn == pytest.approx(0.5 * 2 / 3)
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setattr(scheduler_module.tomtom_service, "cache", MemoryCache())
+    monkeypatch.setattr(scheduler_module.tomtom_service, "on_refresh", lambda kind, listener: None)
+    scheduler = RefreshScheduler()
+    scheduler.tick = 0.01
+    return scheduler
+
+def test_interval_spans_slowest_to_fastest(scheduler):
+    now = time.time()
+    assert scheduler.interval("flow", "lahore", now, urgency=0.0) == pytest.approx(scheduler.max_interval)
+    assert scheduler.interval("flow", "lahore", now, urgency=1.0) == pytest.approx(scheduler.min_interval)
+    halfway = scheduler.interval("flow", "lahore", now, urgency=0.5)
+    assert halfway == pytest.approx((scheduler.min_interval * scheduler.max_interval) ** 0.5)
+    assert scheduler.interval("incidents", "lahore", now, urgency=0.5) == pytest.approx(halfway * scheduler.incidents_scale)
+
+def test_demand_raises_urgency(scheduler):
+    now = time.time()
+    before = scheduler.urgency("flow", "lahore", now)
+    for _ in range(100):
+        scheduler.record_demand("Lahore")
+    assert scheduler.urgency("flow", "lahore", now) == pytest.approx(before + 0.4)
+
+@pytest.mark.asyncio
+async def test_only_the_lease_holder_refreshes_until_it_stops(scheduler):
+    follower = RefreshScheduler()
+    follower.tick = 0.01
+    runs = {"leader": 0, "follower": 0}
+
+    def counting(name):
+        async def run_once():
+            runs[name] += 1
+            return 0
+        return run_once
+
+    scheduler.run_once = counting("leader")
+    follower.run_once = counting("follower")
+    leader_task = asyncio.create_task(scheduler.refresh_loop())
+    await asyncio.sleep(0.02)
+    follower_task = asyncio.create_task(follower.refresh_loop())
+    await asyncio.sleep(0.1)
+
+    assert runs["leader"] > 3 and runs["follower"] == 0
+    assert follower._lease is None
+
+    # Released on shutdown, so the follower takes over without waiting for expiry
+    leader_task.cancel()
+    await asyncio.gather(leader_task, return_exceptions=True)
+    await asyncio.sleep(0.05)
+    assert runs["follower"] > 0
+
+    follower_task.cancel()
+    await asyncio.gather(follower_task, return_exceptions=True)
@@ -0,0 +1,40 @@
+"""
+Tests for the bounds on region incident fetches
+"""
+
+import pytest
+from fastapi import HTTPException
+
+from routes.traffic import _parse_bbox
+from services.tomtom_service import tomtom_service, PAKISTAN_BBOX
+
+def test_bbox_defaults_to_pakistan():
+    assert _parse_bbox(None) == PAKISTAN_BBOX
+
+def test_bbox_is_clipped_to_pakistan():
+    assert _parse_bbox("-180,-90,180,90") == PAKISTAN_BBOX
+    assert _parse_bbox("74,31,80,32") == (74.0, 31.0, PAKISTAN_BBOX[2], 32.0)
+
+@pytest.mark.parametrize("bbox", ["0,0,10,10", "74,31,73,32", "a,b,c,d", "74,31,75"])
+def test_bad_or_foreign_bbox_is_rejected(bbox):
+    with pytest.raises(HTTPException) as error:
+        _parse_bbox(bbox)
+    assert error.value.status_code == 400
+
+def test_city_box_fits_one_upstream_call():
+    min_lon, min_lat, max_lon, max_lat = tomtom_service.city_bbox("lahore")
+    assert max(max_lon - min_lon, max_lat - min_lat) <= tomtom_service.incident_tile_max_deg
+    assert tomtom_service.refresh_cost("incidents", "lahore") == 1
+
+def test_region_key_rounds_nearby_views_together():
+    assert tomtom_service._region_key(74.301, 31.502, 74.6, 31.8) == tomtom_service._region_key(74.304, 31.498, 74.6, 31.8)
+
+@pytest.mark.asyncio
+async def test_region_over_the_tile_limit_fails_before_fetching(monkeypatch):
+    monkeypatch.setattr(tomtom_service, "incident_max_tiles", 1)
+    monkeypatch.setattr(tomtom_service, "_client", None)
+    assert tomtom_service.region_tiles(*PAKISTAN_BBOX) > 1
+
+    with pytest.raises(ValueError):
+        async for _ in tomtom_service.stream_region_incidents(*PAKISTAN_BBOX):
+            pass
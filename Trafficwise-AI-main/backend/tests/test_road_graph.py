@@ -0,0 +1,124 @@
+"""
+Tests for the road graph and its shortest-time search
+"""
+
+import json
+import random
+
+import pytest
+
+from services.road_graph import RoadGraph, build_road_graph
+
+def grid_graph(size=4, seed=43):
+    """A size x size grid of two-way roads with random lengths"""
+    rng = random.Random(seed)
+    graph = RoadGraph()
+    nodes = [[graph.add_node(30.0 + row * 0.01, 70.0 + col * 0.01) for col in range(size)] for row in range(size)]
+    for row in range(size):
+        for col in range(size):
+            if col + 1 < size:
+                graph.add_edge(nodes[row][col], nodes[row][col + 1], rng.uniform(1, 10), 60.0)
+            if row + 1 < size:
+                graph.add_edge(nodes[row][col], nodes[row + 1][col], rng.uniform(1, 10), 60.0)
+    return graph, nodes
+
+def bellman_ford(graph, sources, minutes):
+    best = {node: start for node, start in sources}
+    for _ in range(graph.node_count):
+        for node in range(graph.node_count):
+            if node not in best:
+                continue
+            for edge in graph.adjacency[node]:
+                arrival = best[node] + minutes[edge]
+                if arrival < best.get(graph.edge_to[edge], float("inf")):
+                    best[graph.edge_to[edge]] = arrival
+    return best
+
+def test_nodes_at_the_same_point_are_shared():
+    graph = RoadGraph()
+    first = graph.add_node(31.5, 74.3)
+    assert graph.add_node(31.500001, 74.300001, "Somewhere") == first
+    assert graph.names[first] == "Somewhere"
+    assert graph.node_city[first] == "lahore"
+    assert graph.node_city[graph.add_node(10.0, 10.0)] is None
+
+def test_edges_are_two_way_unless_oneway():
+    graph = RoadGraph()
+    a, b, c = (graph.add_node(30.0, 70.0 + step) for step in range(3))
+    graph.add_edge(a, b, 10.0, 60.0)
+    graph.add_edge(b, c, 10.0, 60.0, oneway=True)
+
+    assert graph.edge_count == 3
+    assert [graph.edge_to[edge] for edge in graph.adjacency[b]] == [a, c]
+    assert graph.adjacency[c] == []
+
+def test_edge_minutes_scale_with_live_factors():
+    graph = RoadGraph()
+    a, b = graph.add_node(30.0, 70.0), graph.add_node(30.0, 70.5)
+    graph.add_edge(a, b, 60.0, 60.0, group=("city", "lahore"), oneway=True)
+    assert graph.edge_minutes([0.5]) == [120.0]
+
+def test_shortest_times_match_exhaustive_relaxation():
+    graph, nodes = grid_graph()
+    minutes = graph.edge_minutes([1.0])
+    sources = [(nodes[0][0], 0.0), (nodes[3][3], 4.0)]
+
+    reached = graph.shortest_times(sources, minutes, max_minutes=1000)
+    expected = bellman_ford(graph, sources, minutes)
+    assert reached.keys() == expected.keys()
+    for node, time_at in expected.items():
+        assert reached[node] == pytest.approx(time_at)
+
+def test_shortest_times_stop_at_the_limit():
+    graph, nodes = grid_graph()
+    minutes = graph.edge_minutes([1.0])
+    full = graph.shortest_times([(nodes[0][0], 0.0)], minutes, max_minutes=1000)
+    limit = sorted(full.values())[len(full) // 2]
+
+    reached = graph.shortest_times([(nodes[0][0], 0.0)], minutes, max_minutes=limit)
+    assert reached == {node: time_at for node, time_at in full.items() if time_at <= limit}
+
+def test_flow_and_corridor_factors():
+    assert RoadGraph._flow_factor({"current_speed": 30, "free_flow_speed": 60}) == 0.5
+    assert RoadGraph._flow_factor({"road_closure": True}) == 0.0
+    assert RoadGraph._flow_factor({"current_speed": 30}) is None
+
+    snapshot = {"segments": [
+        {"from_km": 0, "to_km": 10, "speed_ratio": 1.0},
+        {"from_km": 10, "to_km": 20, "speed_ratio": 0.5},
+        {"from_km": 20, "to_km": 30, "speed_ratio": None, "road_closure": True},
+        {"from_km": 30, "to_km": 40, "speed_ratio": None}
+    ]}
+    # 5 km at 1.0, 10 km at 0.5 and 5 km closed
+    assert RoadGraph._corridor_factor(snapshot, 5, 25) == pytest.approx(10 / 20)
+    assert RoadGraph._corridor_factor(snapshot, 31, 39) is None
+
+def test_built_graph_joins_cities_by_highway():
+    graph = build_road_graph()
+    minutes = graph.edge_minutes([1.0] * len(graph.groups))
+    reached = graph.shortest_times([(graph.city_nodes["islamabad"], 0.0)], minutes, max_minutes=10_000)
+
+    for city in ("lahore", "peshawar", "karachi", "multan"):
+        assert graph.city_nodes[city] in reached
+    # The M-2 is 367 km of motorway
+    assert 180 < reached[graph.city_nodes["lahore"]] < 300
+
+def test_extra_edges_load_from_a_file(tmp_path):
+    path = tmp_path / "roads.json"
+    path.write_text(json.dumps({
+        "nodes": [{"id": "a", "lat": 31.0, "lon": 72.0, "name": "Junction"}],
+        "edges": [{"from": "a", "to": "Lahore", "speed_kmh": 80, "km": 200, "toll": 50, "oneway": True}]
+    }))
+    graph = build_road_graph(str(path))
+
+    junction = graph.node_count - 1
+    assert graph.names[junction] == "Junction"
+    [edge] = graph.adjacency[junction]
+    assert graph.edge_to[edge] == graph.city_nodes["lahore"]
+    assert (graph.edge_km[edge], graph.edge_toll[edge]) == (200.0, 50.0)
+
+def test_unknown_node_in_file_is_an_error(tmp_path):
+    path = tmp_path / "roads.json"
+    path.write_text(json.dumps({"edges": [{"from": "nowhere", "to": "Lahore", "speed_kmh": 80}]}))
+    with pytest.raises(ValueError):
+        build_road_graph(str(path))
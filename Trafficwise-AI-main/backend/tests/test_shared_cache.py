@@ -0,0 +1,51 @@
+"""
+Tests for shared cache values and single-writer leases
+"""
+
+import pytest
+
+from services.shared_cache import MemoryCache, SQLiteCache
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        return MemoryCache()
+    return SQLiteCache(str(tmp_path / "cache.sqlite3"))
+
+@pytest.mark.asyncio
+async def test_values_round_trip_and_expire(cache):
+    await cache.set("city:lahore", {"speed": 42}, ttl=60)
+    assert await cache.get("city:lahore") == {"speed": 42}
+
+    await cache.set("city:lahore", {"speed": 42}, ttl=-1)
+    assert await cache.get("city:lahore") is None
+
+@pytest.mark.asyncio
+async def test_lease_excludes_other_acquirers(cache):
+    first = await cache.acquire("refresh", ttl=60)
+    assert first is not None
+    # Each acquire gets its own token, so a second caller in this process is refused too
+    assert await cache.acquire("refresh", ttl=60) is None
+    assert await cache.acquire("refresh", ttl=60, token="someone-else") is None
+
+@pytest.mark.asyncio
+async def test_lease_renews_with_its_token(cache):
+    token = await cache.acquire("refresh", ttl=60)
+    assert await cache.acquire("refresh", ttl=60, token=token) == token
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_taken_over(cache):
+    stale = await cache.acquire("refresh", ttl=-1)
+    fresh = await cache.acquire("refresh", ttl=60)
+    assert fresh is not None and fresh != stale
+    # The old holder cannot renew once its lease has been taken
+    assert await cache.acquire("refresh", ttl=60, token=stale) is None
+
+@pytest.mark.asyncio
+async def test_release_only_by_holder(cache):
+    token = await cache.acquire("refresh", ttl=60)
+    await cache.release("refresh", "someone-else")
+    assert await cache.acquire("refresh", ttl=60) is None
+
+    await cache.release("refresh", token)
+    assert await cache.acquire("refresh", ttl=60) is not None
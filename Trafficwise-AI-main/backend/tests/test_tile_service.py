@@ -0,0 +1,140 @@
+"""
+Tests for the on-disk tile cache and the tile proxy in front of it
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+
+import httpx
+import pytest
+
+from services import tile_service as tile_module
+from services.tile_service import TileCache, TileFileResponse, TileService, lat_lon_to_tile
+
+def test_lat_lon_to_tile():
+    assert lat_lon_to_tile(0.0, 0.0, 0) == (0, 0)
+    assert lat_lon_to_tile(0.0, 0.0, 1) == (1, 1)
+    # Lahore at zoom 10
+    assert lat_lon_to_tile(31.5204, 74.3587, 10) == (723, 417)
+    # Clamped to the map at the poles and the antimeridian
+    assert lat_lon_to_tile(89.9, 180.0, 2) == (3, 0)
+
+def usage(cache):
+    return cache._locked(lambda conn: conn.execute("SELECT bytes FROM usage").fetchone()[0])
+
+@pytest.mark.asyncio
+async def test_identical_tiles_share_one_object(tmp_path):
+    cache = TileCache(str(tmp_path), max_bytes=10_000)
+    first = await cache.store("flow/a/1/0/0.png", b"empty tile")
+    second = await cache.store("flow/a/1/0/1.png", b"empty tile")
+
+    assert first == second == hashlib.sha256(b"empty tile").hexdigest()
+    assert usage(cache) == len(b"empty tile")
+    assert len(os.listdir(os.path.dirname(cache.object_path(first)))) == 1
+
+@pytest.mark.asyncio
+async def test_replaced_tile_frees_its_old_object(tmp_path):
+    cache = TileCache(str(tmp_path), max_bytes=10_000)
+    old = await cache.store("flow/a/1/0/0.png", b"old body")
+    await cache.store("flow/a/1/0/0.png", b"new body!")
+
+    assert not os.path.exists(cache.object_path(old))
+    assert usage(cache) == len(b"new body!")
+
+@pytest.mark.asyncio
+async def test_eviction_drops_least_recently_used_tiles(tmp_path):
+    cache = TileCache(str(tmp_path), max_bytes=1000)
+    for index in range(4):
+        await cache.store(f"flow/a/1/0/{index}.png", bytes([index]) * 300)
+        # Distinct access times so the order is well defined
+        cache._locked(lambda conn, i=index: conn.execute("UPDATE tiles SET last_access = ? WHERE tile_key = ?", (i, f"flow/a/1/0/{i}.png")))
+
+    assert await cache.lookup("flow/a/1/0/0.png") is None
+    for index in (2, 3):
+        _, _, file = await cache.lookup(f"flow/a/1/0/{index}.png")
+        file.close()
+    assert usage(cache) <= 900
+
+@pytest.mark.asyncio
+async def test_open_file_survives_eviction(tmp_path):
+    cache = TileCache(str(tmp_path), max_bytes=500)
+    await cache.store("flow/a/1/0/0.png", b"a" * 300)
+    _, _, file = await cache.lookup("flow/a/1/0/0.png")
+
+    await cache.store("flow/a/1/0/1.png", b"b" * 300)
+    assert await cache.lookup("flow/a/1/0/0.png") is None
+    with file:
+        assert file.read() == b"a" * 300
+
+@pytest.mark.asyncio
+async def test_usage_is_reconciled_when_the_index_is_opened(tmp_path):
+    cache = TileCache(str(tmp_path), max_bytes=10_000)
+    await cache.store("flow/a/1/0/0.png", b"x" * 100)
+    cache._locked(lambda conn: conn.execute("UPDATE usage SET bytes = 12345"))
+
+    assert usage(TileCache(str(tmp_path), max_bytes=10_000)) == 100
+
+@pytest.mark.asyncio
+async def test_file_response_streams_and_closes_the_file(tmp_path):
+    path = tmp_path / "tile.png"
+    path.write_bytes(b"p" * 150_000)
+    file = open(path, "rb")
+    response = TileFileResponse(file, media_type="image/png")
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await response({"type": "http", "method": "GET", "headers": []}, None, send)
+    assert sent[0]["status"] == 200
+    assert (b"content-length", b"150000") in sent[0]["headers"]
+    assert b"".join(message.get("body", b"") for message in sent[1:]) == b"p" * 150_000
+    assert sent[-1]["more_body"] is False
+    assert file.closed
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    service = TileService()
+    service.cache = TileCache(str(tmp_path), max_bytes=10_000)
+    calls = []
+
+    async def get_map_tile(layer, style, zoom, x, y, fmt):
+        calls.append((layer, zoom, x, y))
+        await asyncio.sleep(0.01)
+        return service.upstream
+
+    service.upstream = httpx.Response(200, content=b"tile body")
+    service.calls = calls
+    monkeypatch.setattr(tile_module.tomtom_service, "get_map_tile", get_map_tile)
+    return service
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_fetch_and_hits_serve_the_file(service):
+    results = await asyncio.gather(*(service.get_tile("flow", "relative0", 10, 723, 415, "png") for _ in range(5)))
+    assert len(service.calls) == 1
+    assert all(result["body"] == b"tile body" for result in results)
+
+    hit = await service.get_tile("flow", "relative0", 10, 723, 415, "png")
+    with hit["file"] as file:
+        assert file.read() == b"tile body"
+    assert hit["etag"] == f'"{hashlib.sha256(b"tile body").hexdigest()}"'
+    assert 0 < hit["max_age"] <= service.ttl
+    assert len(service.calls) == 1
+
+@pytest.mark.asyncio
+async def test_stale_tile_is_served_when_the_refetch_fails(service):
+    await service.get_tile("flow", "relative0", 10, 723, 415, "png")
+    service.cache._locked(lambda conn: conn.execute("UPDATE tiles SET fetched_at = ?", (time.time() - 2 * service.ttl,)))
+    service.upstream = httpx.Response(503)
+
+    result = await service.get_tile("flow", "relative0", 10, 723, 415, "png")
+    assert len(service.calls) == 2
+    assert result["success"] and result["body"] == b"tile body" and result["max_age"] == 0
+
+@pytest.mark.asyncio
+async def test_upstream_errors_without_a_cached_tile_are_reported(service):
+    service.upstream = httpx.Response(404)
+    result = await service.get_tile("flow", "relative0", 3, 1, 1, "png")
+    assert not result["success"] and result["status_code"] == 404
@@ -0,0 +1,70 @@
+"""
+Tests for request timing spans, the Server-Timing header and sampled profiling
+"""
+
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from services.timing import RequestTimings, SampledProfiler, ServerTimingMiddleware, TimedJSONResponse, current_timings, span
+
+def test_overlapping_spans_of_a_name_are_merged():
+    timings = RequestTimings()
+    timings.spans = [
+        ["tomtom", 0.0, 0.5],
+        ["tomtom", 0.2, 0.7],
+        ["tomtom", 1.0, 1.1],
+        ["cache", 0.0, 0.01],
+        ["open", 2.0, None]
+    ]
+    summary = timings.summary(now=2.5)
+
+    assert summary["tomtom"] == 800.0
+    assert round(summary["cache"], 6) == 10.0
+    assert summary["open"] == 500.0
+
+def test_recorded_phases_end_now():
+    timings = RequestTimings()
+    timings.record("queue", 250.0)
+    [(name, start, end)] = timings.spans
+    assert name == "queue" and round((end - start) * 1000, 6) == 250.0
+
+def test_span_outside_a_request_is_a_no_op():
+    assert current_timings() is None
+    with span("work"):
+        pass
+    assert current_timings() is None
+
+def make_app(profiler=None):
+    app = FastAPI()
+    app.add_middleware(ServerTimingMiddleware, profiler=profiler)
+
+    @app.get("/work")
+    async def work():
+        with span("tomtom"):
+            await asyncio.gather(asyncio.sleep(0.02), asyncio.sleep(0.02))
+        return TimedJSONResponse({"ok": True})
+
+    return app
+
+def test_middleware_reports_spans_in_server_timing():
+    response = TestClient(make_app()).get("/work")
+
+    entries = dict(entry.split(";dur=") for entry in response.headers["server-timing"].split(", "))
+    assert response.json() == {"ok": True}
+    assert {"tomtom", "serialize", "total"} <= entries.keys()
+    assert 20.0 <= float(entries["tomtom"]) <= float(entries["total"])
+
+def test_slow_sampled_requests_are_saved(tmp_path):
+    profiler = SampledProfiler(sample_rate=1.0, threshold_ms=0.0, output_dir=str(tmp_path))
+    TestClient(make_app(profiler)).get("/work")
+
+    [saved] = list(tmp_path.iterdir())
+    assert saved.name.endswith(".prof") and "-work-" in saved.name
+    assert not profiler._active
+
+def test_fast_requests_are_not_saved(tmp_path):
+    profiler = SampledProfiler(sample_rate=1.0, threshold_ms=60_000, output_dir=str(tmp_path))
+    TestClient(make_app(profiler)).get("/work")
+    assert list(tmp_path.iterdir()) == []